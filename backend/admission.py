@@ -0,0 +1,324 @@
+"""
+Admission control in front of inference.
+
+- RateLimiter: a token bucket per client (API key or IP), so one partner
+  script cannot take the capacity meant for app users. Over the limit the
+  request is answered 429 at once with a Retry-After.
+- Admission:   at most `concurrency` requests run inference at a time; the
+  rest wait in a bounded priority queue (verify > predict > bulk, FIFO
+  within a class). When the queue is full, a new request displaces the
+  lowest-priority waiter if it outranks it, otherwise it is shed with a 503.
+  Overload shows up as fast rejections instead of timeouts.
+
+Every waiter carries a deadline: the client's own budget (X-Moomingle-Timeout-Ms)
+or MOOMINGLE_ADMISSION_TIMEOUT_MS. A request whose deadline passes while it
+waits is dropped before it reaches the model: its client has given up already.
+
+Admission.acquire() is for threaded servers (Flask / gunicorn threads),
+Admission.acquire_async() for asyncio servers (FastAPI). Limits are per
+process, like the rest of the in-memory state.
+"""
+
+import asyncio
+import heapq
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PRIORITIES = ('verify', 'predict', 'bulk')  # highest first
+DEADLINE_HEADER = 'X-Moomingle-Timeout-Ms'
+API_KEY_HEADER = 'X-API-Key'
+
+CONCURRENCY = int(os.environ.get('MOOMINGLE_ADMISSION_CONCURRENCY', '2'))  # 0 = no admission control
+QUEUE_SIZE = int(os.environ.get('MOOMINGLE_ADMISSION_QUEUE', '32'))
+TIMEOUT_MS = float(os.environ.get('MOOMINGLE_ADMISSION_TIMEOUT_MS', '10000'))  # without a client deadline
+RATE_LIMIT = float(os.environ.get('MOOMINGLE_RATE_LIMIT', '0'))               # requests/s per client, 0 = off
+RATE_BURST = float(os.environ.get('MOOMINGLE_RATE_BURST', '20'))
+MAX_CLIENTS = 10000                                                           # buckets kept (LRU)
+# "key" or "key=rate" entries; other keys are ignored and the client IP is used
+API_KEYS = [k for k in os.environ.get('MOOMINGLE_API_KEYS', '').split(',') if k]
+TRUSTED_PROXIES = int(os.environ.get('MOOMINGLE_TRUSTED_PROXIES', '0'))       # X-Forwarded-For hops, 0 = peer address
+
+
+class Shed(Exception):
+    """A request turned away by admission control, with its HTTP status and Retry-After."""
+
+    STATUS = {'rate_limited': 429, 'queue_full': 503, 'displaced': 503, 'expired': 504}
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__({
+            'rate_limited': 'Too many requests from this client',
+            'queue_full': 'Server is busy, please retry shortly',
+            'displaced': 'Server is busy, please retry shortly',
+            'expired': 'Request deadline passed before it could run',
+        }[reason])
+        self.reason = reason
+        self.status = self.STATUS[reason]
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    def body(self) -> dict:
+        return {'error': str(self), 'reason': self.reason, 'retry_after': self.retry_after}
+
+
+def deadline_from(timeout_ms, default_ms: float = TIMEOUT_MS):
+    """time.monotonic() deadline for a client's budget in ms (header value), capped at the default."""
+    try:
+        budget = float(timeout_ms) if timeout_ms not in (None, '') else default_ms
+    except ValueError:
+        budget = default_ms
+    budget = min(budget, default_ms) if default_ms > 0 else budget
+    return time.monotonic() + budget / 1000.0 if budget > 0 else None
+
+
+def expired(deadline) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+# =============================================================================
+# RATE LIMITS
+# =============================================================================
+
+class RateLimiter:
+    """Token bucket per client: `rate` requests/s sustained, bursts up to `burst`."""
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: float = RATE_BURST,
+                 api_keys: list = API_KEYS, max_clients: int = MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self.key_rates = {}
+        for entry in api_keys:
+            key, _, key_rate = entry.partition('=')
+            self.key_rates[key] = float(key_rate) if key_rate else rate
+        self._buckets = OrderedDict()  # client -> [tokens, last refill]
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Keys listed with their own rate are limited even when the default is off
+        return self.rate > 0 or any(rate > 0 for rate in self.key_rates.values())
+
+    def client(self, api_key: str = None, forwarded_for: list = None, remote_addr: str = None) -> str:
+        """
+        Bucket name: a configured API key, else the client IP: the peer
+        address by default. Only a deployment that sets TRUSTED_PROXIES to
+        the hops in front of it (Render, a load balancer) takes the IP that
+        many entries from the end of X-Forwarded-For, since any caller can
+        send that header.
+        """
+        if api_key and api_key in self.key_rates:
+            return f'key:{api_key}'
+        route = forwarded_for or []
+        if TRUSTED_PROXIES > 0 and route:
+            return f'ip:{route[-min(TRUSTED_PROXIES, len(route))]}'
+        return f'ip:{remote_addr}'
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        """Take `cost` tokens. Returns 0 if allowed, else seconds until it would be."""
+        if not self.enabled:
+            return 0.0
+        rate = self.key_rates.get(client[4:], self.rate) if client.startswith('key:') else self.rate
+        if rate <= 0:
+            return 0.0
+        cost = min(cost, self.burst)  # a large batch drains the bucket but is never refused outright
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            self.limited += 1
+            return (cost - bucket[0]) / rate
+
+    def stats(self) -> dict:
+        return {'rate': self.rate, 'burst': self.burst, 'api_keys': len(self.key_rates),
+                'clients': len(self._buckets), 'limited': self.limited}
+
+
+# =============================================================================
+# PRIORITY QUEUE
+# =============================================================================
+
+class _Waiter:
+    __slots__ = ('priority', 'rank', 'seq', 'deadline', 'outcome', 'event', 'loop', 'future')
+
+    def __init__(self, priority: str, rank: int, seq: int, deadline, loop=None):
+        self.priority = priority
+        self.rank = rank
+        self.seq = seq
+        self.deadline = deadline
+        self.outcome = None   # 'granted' or a shed reason
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Admission:
+    """Bounded, prioritized, deadline-aware concurrency limit (see module docstring)."""
+
+    def __init__(self, concurrency: int = CONCURRENCY, max_queue: int = QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._heap = []
+        self._queued = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._service_s = 0.5   # moving average of slot hold time, for Retry-After
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.shed = {reason: {p: 0 for p in PRIORITIES} for reason in ('queue_full', 'displaced', 'expired')}
+        self.waited_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0
+
+    def _retry_after(self) -> float:
+        return (self._queued + 1) * self._service_s / max(self.concurrency, 1)
+
+    def _drop(self, waiter: _Waiter, reason: str):
+        waiter.outcome = reason
+        self._queued -= 1
+        self.shed[reason][waiter.priority] += 1
+        waiter.wake()
+
+    def _enter(self, priority: str, deadline, loop=None):
+        """Take a free slot (None) or queue a waiter; raises Shed when neither is possible."""
+        rank = PRIORITIES.index(priority)
+        with self._lock:
+            if expired(deadline):
+                self.shed['expired'][priority] += 1
+                raise Shed('expired')
+            if self.in_flight < self.concurrency and not self._queued:
+                self.in_flight += 1
+                self.admitted[priority] += 1
+                return None
+            if self._queued >= self.max_queue:
+                worst = max((w for w in self._heap if w.outcome is None), default=None)
+                if worst is None or worst.rank <= rank:
+                    self.shed['queue_full'][priority] += 1
+                    raise Shed('queue_full', self._retry_after())
+                self._drop(worst, 'displaced')
+            self._seq += 1
+            waiter = _Waiter(priority, rank, self._seq, deadline, loop)
+            heapq.heappush(self._heap, waiter)
+            self._queued += 1
+            return waiter
+
+    def _settle(self, waiter: _Waiter, waited_since: float):
+        """After waiting: return if the slot was granted, else raise the shed reason."""
+        with self._lock:
+            if waiter.outcome is None:  # deadline passed while queued
+                self._drop(waiter, 'expired')
+            self.waited_ms += (time.monotonic() - waited_since) * 1000
+            if waiter.outcome != 'granted':
+                raise Shed(waiter.outcome, self._retry_after())
+
+    def _abandon(self, waiter: _Waiter):
+        """The waiting caller went away (cancelled): give back whatever it held."""
+        with self._lock:
+            if waiter.outcome is None:
+                self._drop(waiter, 'expired')
+                return
+        if waiter.outcome == 'granted':
+            self.release()
+
+    def _grant(self):
+        while self.in_flight < self.concurrency and self._heap:
+            waiter = heapq.heappop(self._heap)
+            if waiter.outcome is not None:  # displaced or expired, already counted
+                continue
+            if expired(waiter.deadline):
+                self._drop(waiter, 'expired')
+                continue
+            waiter.outcome = 'granted'
+            self._queued -= 1
+            self.in_flight += 1
+            self.admitted[waiter.priority] += 1
+            waiter.wake()
+
+    def acquire(self, priority: str, deadline=None) -> float:
+        """Block until a slot is free (threads). Returns the acquire time for release()."""
+        if not self.enabled:
+            return time.monotonic()
+        waiter = self._enter(priority, deadline)
+        started = time.monotonic()
+        if waiter is not None:
+            waiter.event.wait(None if deadline is None else max(0.0, deadline - started))
+            self._settle(waiter, started)
+        return time.monotonic()
+
+    async def acquire_async(self, priority: str, deadline=None) -> float:
+        """acquire() for asyncio: waits without blocking the event loop."""
+        if not self.enabled:
+            return time.monotonic()
+        waiter = self._enter(priority, deadline, asyncio.get_running_loop())
+        started = time.monotonic()
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future),
+                                       None if deadline is None else max(0.0, deadline - started))
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                self._abandon(waiter)
+                raise
+            self._settle(waiter, started)
+        return time.monotonic()
+
+    def check_deadline(self, priority: str, deadline):
+        """Raise Shed('expired') if `deadline` has passed (call before starting expensive work)."""
+        if expired(deadline):
+            with self._lock:
+                self.shed['expired'][priority] += 1
+            raise Shed('expired')
+
+    def release(self, acquired_at: float = None):
+        """Give the slot back; the best waiter still within its deadline gets it."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if acquired_at is not None:
+                self._service_s = 0.9 * self._service_s + 0.1 * (time.monotonic() - acquired_at)
+            self.in_flight -= 1
+            self._grant()
+
+    @contextmanager
+    def slot(self, priority: str, deadline=None):
+        """`with admission.slot('bulk'):` acquire() ... release()."""
+        acquired_at = self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self) -> dict:
+        admitted = sum(self.admitted.values())
+        return {
+            'concurrency': self.concurrency,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queued': self._queued,
+            'admitted': dict(self.admitted),
+            'shed': {reason: dict(counts) for reason, counts in self.shed.items()},
+            'mean_wait_ms': round(self.waited_ms / admitted, 2) if admitted else 0.0,
+            'mean_service_ms': round(self._service_s * 1000, 1),
+        }
@@ -7,28 +7,83 @@ Includes:
 - Muzzle biometric registration and verification
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify
 from flask_cors import CORS
-from huggingface_hub import hf_hub_download
-import onnxruntime as ort
 import numpy as np
-import json
+import functools
 import hashlib
 import base64
 from PIL import Image
-from torchvision import transforms
 import io
+import os
+import json
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+import preprocessing
+import profiling
+from admission import API_KEY_HEADER, DEADLINE_HEADER, Admission, RateLimiter, Shed, deadline_from
+from cascade import CropCascade
+from embedding_store import EmbeddingStore
+from embeddings import (
+    DEFAULT_DTYPE, EmbeddingCache, EmbeddingError, decode_embedding,
+    encode_embedding, image_hash
+)
+from frame_quality import MAX_FRAMES, TOP_FRAMES, aggregate, clip_frames, image_quality, region_weight
+from jobs import InteractiveGate, JobError, JobStore, JobWorkers, RetryLater, archive_items
+from listing_index import ListingIndex, ListingIndexer, ListingsClient
+from model_registry import ModelRegistry
+from muzzle_shards import ShardedMuzzleStore
+from muzzle_snapshot import MuzzlePrintsClient, MuzzleSync
+from muzzle_store import MuzzleStore
+from phash import PHashIndex, dhash
+from profiling import stage
+from scoring import VERIFIED_MARGIN, degraded_result
+from singleflight import SingleFlight, SingleFlightTimeout
+
 app = Flask(__name__)
 CORS(app)
+# Largest request body (job archives are the big ones); Flask answers 413 beyond it
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MOOMINGLE_MAX_UPLOAD_MB', '256')) * 2 ** 20)
+
+# In-memory muzzle registry: metadata + compact embedding index (see muzzle_store.py),
+# or shard processes searched scatter-gather (see muzzle_shards.py)
+MUZZLE_SHARDS = [u for u in os.environ.get('MOOMINGLE_MUZZLE_SHARDS', '').split(',') if u]
+muzzle_store = ShardedMuzzleStore(MUZZLE_SHARDS) if MUZZLE_SHARDS else MuzzleStore()
+
+# Exact re-uploads: sha256 of a registered photo's bytes -> muzzle_id. The same
+# bytes are the same photo, so these are answered 409 before any inference or
+# vector search. Covers the registrations this worker made or restored from a
+# snapshot; others fall through to the embedding check, which catches them too.
+muzzle_photo_digests = {}
+photo_prefilter = {'lookups': 0, 'hits': 0}
+# Perceptual hashes of registered muzzle photos: a close hash (a recompressed or
+# resized re-upload) names a candidate that counts as a duplicate at a lower
+# embedding similarity. This runs after inference and saves no time.
+muzzle_phashes = PHashIndex()
+duplicate_counts = {'exact_photo': 0, 'photo': 0, 'embedding': 0}
+PHOTO_CONFIRM_SIMILARITY = float(os.environ.get('MOOMINGLE_PHASH_CONFIRM_SIMILARITY', '0.9'))
+PHOTO_CONFIRM_K = 5  # the candidate must be among this many nearest embeddings
 
-# In-memory muzzle database (use Redis/PostgreSQL in production)
-muzzle_database = {}
+def _index_phashes(records):
+    """Index the photo digests and hashes of restored or synced (muzzle_id, record) pairs."""
+    for muzzle_id, record in records:
+        if record.get('photo_sha256'):
+            muzzle_photo_digests[record['photo_sha256']] = muzzle_id
+        if record.get('phash'):
+            muzzle_phashes.add(muzzle_id, int(record['phash'], 16))
 
-# Global model state
-session = None
-prototypes = None
+# Warm start from a snapshot file, then paged pulls of new muzzle_prints rows
+# (MOOMINGLE_MUZZLE_SYNC=1; see muzzle_snapshot.py). Registrations are written through.
+MUZZLE_SNAPSHOT = os.environ.get('MOOMINGLE_MUZZLE_SNAPSHOT')
+MUZZLE_SYNC_SECONDS = float(os.environ.get('MOOMINGLE_MUZZLE_SYNC_SECONDS', '0'))
+muzzle_sync = MuzzleSync(
+    muzzle_store,
+    MuzzlePrintsClient.from_env() if os.environ.get('MOOMINGLE_MUZZLE_SYNC') == '1' else None,
+    MUZZLE_SNAPSHOT,
+    on_added=_index_phashes
+)
 
 BUFFALO_BREEDS = ['Bhadawari', 'Jaffarbadi', 'Mehsana', 'Murrah', 'Surti',
                   'Nili-Ravi', 'Pandharpuri', 'Nagpuri', 'Toda', 'Chilika']
@@ -42,105 +97,380 @@ CATTLE_BREEDS = ['Gir', 'Kankrej', 'Ongole', 'Sahiwal', 'Tharparkar',
                  'Bhagnari', 'Dhanni', 'Cholistani', 'Achai', 'Lakhani']
 
 ALL_BREEDS = BUFFALO_BREEDS + CATTLE_BREEDS
+ANIMAL_TYPES = {**{b: 'Buffalo' for b in BUFFALO_BREEDS}, **{b: 'Cattle' for b in CATTLE_BREEDS}}
+
+# Hot-reloadable model versions (see model_registry.py)
+models = ModelRegistry(animal_types=ANIMAL_TYPES)
+
+# Embeddings of recently seen images, keyed by image hash + model version. Misses
+# read through to the persistent store at MOOMINGLE_EMBEDDING_STORE, if set
+# (filled by data_import/import_csv.py --precompute and the listing index sync)
+embedding_store = EmbeddingStore.from_env()
+embedding_cache = EmbeddingCache(store=embedding_store)
+
+# Concurrent uploads of the same image share one decode + inference
+inflight = SingleFlight()
+
+# Version tag of the hash-based pseudo-features used when no model is loaded
+FALLBACK_FEATURES_VERSION = 'image-hash'
+
+# Test-time augmentation for uncertain classifications: off | auto (only when the
+# single-view top-1/top-2 margin is below MOOMINGLE_TTA_MARGIN) | always
+TTA_MODE = os.environ.get('MOOMINGLE_TTA', 'auto')
+TTA_VIEWS = os.environ.get('MOOMINGLE_TTA_VIEWS', 'ten')
+TTA_MARGIN = float(os.environ.get('MOOMINGLE_TTA_MARGIN', str(VERIFIED_MARGIN)))
+TTA_MODES = ('off', 'auto', 'always')
+tta_counts = {'checked': 0, 'applied': 0, 'changed': 0}
+
+# Optional detector that crops muzzle photos to the animal/muzzle (see cascade.py)
+crop_cascade = CropCascade.from_env()
 
 def load_model():
-    """Download and load the ONNX model from Hugging Face."""
-    global session, prototypes
-    
-    if session is not None:
+    """
+    Download and load the ONNX model from Hugging Face (if none is loaded
+    yet). Waits for a load that is already running instead of starting another.
+    """
+    if models.current() is not None:
         return  # Already loaded
     
     print("Loading model...")
+    models.reload(only_if_empty=True)
+
+@models.on_swap
+def _migrate_model_state(old, new):
+    """
+    Keep caches and the muzzle index consistent across hot swaps. A new
+    prototypes.json keeps every embedding valid; only a new model file
+    changes the embedding space.
+    """
+    if old is None or old.model_version == new.model_version:
+        return
+    dropped = (embedding_cache.drop_version(old.model_version)
+               + embedding_cache.drop_version(tta_features_version(old))
+               + embedding_cache.drop_version(muzzle_features_version(old)))
+    if listing_index.model_version not in (None, new.model_version):
+        listing_indexer.reset()  # Re-embedded by the next sync
+    current = muzzle_features_version(new)
+    stale = muzzle_store.count_other_versions(current)
+    print(f"🧹 Embedding space changed: dropped {dropped} cached embeddings, "
+          f"{stale} muzzle records need re-registration")
+
+def resolve_model(model=None):
+    """
+    The model version to use: the given one, the one pinned for this
+    request, or the current one (loading it on first use). May be None.
+    """
+    if model is not None:
+        return model
+    pinned = g.get('model') if has_request_context() else None
+    if pinned is not None:
+        return pinned
+    if models.current() is None:
+        load_model()
+    return models.current()
+
+def with_model(view):
+    """Pin one model version for a whole request, so hot swaps never split it."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if models.current() is None:
+            load_model()
+        with models.use() as model:
+            g.model = model
+            return view(*args, **kwargs)
+    return wrapper
+
+def compute_embedding(image: Image.Image, model=None):
+    """
+    Run the model once and return the image embedding.
+    Returns None if the model is not available.
+    """
+    embeddings = compute_embeddings([image], model)
+    return embeddings[0] if embeddings is not None else None
+
+def compute_embeddings(images: list, model=None):
+    """
+    Embeddings of several images in one model batch (N x D).
+    Returns None if the model is not available.
+    """
+    model = resolve_model(model)
+    if model is None:
+        return None
+    
+    with stage('preprocess'):
+        input_data = preprocessing.to_batch(images)
+    with stage('inference'):
+        return model.run(input_data)
+
+def coalesced(key, compute):
+    """
+    compute(), shared with concurrent requests for the same key (retry
+    storms send the same photo several times). If the first request takes
+    too long, a waiter stops waiting and computes on its own.
+    """
     try:
-        model_path = hf_hub_download("vishnuamar/cattle-breed-classifier", "model.onnx")
-        prototypes_path = hf_hub_download("vishnuamar/cattle-breed-classifier", "prototypes.json")
-        
-        session = ort.InferenceSession(model_path)
-        with open(prototypes_path, 'r') as f:
-            prototypes = json.load(f)
-        
-        print(f"✅ Model loaded! {len(prototypes.get('prototypes', {}))} breeds on {ort.get_device()}")
-    except Exception as e:
-        print(f"❌ Model load failed: {e}")
-        session = None
-        prototypes = None
+        return inflight.do(key, compute)
+    except SingleFlightTimeout as e:
+        print(f"⚠️ {e}, computing again")
+        return compute()
 
-def classify_breed(image: Image.Image) -> dict:
+def embed_image_bytes(image_bytes: bytes, model=None):
     """
-    Classify the breed of cattle/buffalo in the image.
+    Embedding for uploaded image bytes, served from the embedding cache when
+    the same image was already seen by the same model version.
+    Returns None if the model is not available.
     """
-    global session, prototypes
+    model = resolve_model(model)
+    if model is None:
+        return None
     
-    if session is None or prototypes is None:
-        load_model()
+    key = image_hash(image_bytes)
+    features = embedding_cache.get(key, model.model_version)
+    if features is not None:
+        return features
+    
+    def compute():
+        with stage('decode'):
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+        features = compute_embedding(image, model)
+        embedding_cache.put(key, model.model_version, features)
+        return features
+    
+    return coalesced((key, model.model_version), compute)
+
+def muzzle_features_version(model) -> str:
+    """
+    Embedding-space tag of muzzle features. Cropped and uncropped photos do
+    not give comparable embeddings, so the crop detector is part of the tag.
+    """
+    if crop_cascade is None:
+        return model.model_version
+    return f"{model.model_version}+crop-{crop_cascade.version}"
+
+def muzzle_crops(images: list, keys: list) -> list:
+    """Muzzle photos cropped to the detected muzzle/animal (unchanged without a detector)."""
+    if crop_cascade is None:
+        return images
+    with stage('detect'):
+        return [crop for crop, _ in crop_cascade.crop(images, keys)]
+
+def decode_image(image_bytes: bytes) -> Image.Image:
+    with stage('decode'):
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    return image
+
+def embed_muzzle_bytes(images_bytes: list, model=None, images: list = None):
+    """
+    Muzzle embeddings for several uploaded photos: cached ones are reused,
+    the rest are cropped (one detector batch) and embedded (one model batch).
+    `images` may hold already decoded photos (same order as images_bytes).
+    Returns None if the model is not available.
+    """
+    model = resolve_model(model)
+    if model is None:
+        return None
+    
+    version = muzzle_features_version(model)
+    keys = [image_hash(image_bytes) for image_bytes in images_bytes]
+    features = [embedding_cache.get(key, version) for key in keys]
+    missing = [i for i, f in enumerate(features) if f is None]
+    if not missing:
+        return features
     
-    if session is None:
-        # Fallback if model fails to load
-        return _get_fallback_result()
+    def compute(indices):
+        decoded = [images[i] if images else decode_image(images_bytes[i]) for i in indices]
+        crops = muzzle_crops(decoded, [keys[i] for i in indices])
+        embeddings = compute_embeddings(crops, model)
+        for i, embedding in zip(indices, embeddings):
+            embedding_cache.put(keys[i], version, embedding)
+        return embeddings
+    
+    if len(missing) == 1:
+        # Single upload (register/verify): coalesce with identical requests
+        i = missing[0]
+        features[i] = coalesced((keys[i], version), lambda: compute(missing)[0])
+    else:
+        for i, embedding in zip(missing, compute(missing)):
+            features[i] = embedding
+    return features
+
+def classify_breed(image: Image.Image, model=None, tta: str = None, image_key: str = None) -> dict:
+    """
+    Classify the breed of cattle/buffalo in the image.
+    `tta` overrides MOOMINGLE_TTA for this call (see classify_with_tta).
+    """
+    model = resolve_model(model)
+    if model is None:
+        # Model failed to load: say so instead of guessing
+        return degraded_result()
     
     try:
-        # Preprocess image
-        image = image.convert('RGB')
-        transform = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        input_data = transform(image).unsqueeze(0).numpy()
-        
-        # Run inference
-        features = session.run(None, {'input': input_data})[0][0]
-        
-        # Calculate similarities with prototypes
-        similarities = {}
-        for breed, prototype in prototypes.get('prototypes', {}).items():
-            similarity = float(np.dot(features, np.array(prototype)))
-            # Normalize to 0-1 range
-            normalized = max(0, min(1, (similarity + 1) / 2))
-            similarities[breed] = round(normalized, 4)
-        
-        if not similarities:
-            return _get_fallback_result()
-        
-        # Get best match
-        predicted_breed = max(similarities, key=similarities.get)
-        confidence = similarities[predicted_breed]
-        
-        # Determine animal type
-        if predicted_breed in BUFFALO_BREEDS:
-            animal_type = 'Buffalo'
-        elif predicted_breed in CATTLE_BREEDS:
-            animal_type = 'Cattle'
-        else:
-            animal_type = 'Unknown'
-        
-        # Sort scores descending
-        sorted_scores = dict(sorted(similarities.items(), key=lambda x: -x[1]))
-        
-        return {
-            'breed': predicted_breed,
-            'confidence': confidence,
-            'animal_type': animal_type,
-            'is_verified': confidence >= 0.8,
-            'all_scores': dict(list(sorted_scores.items())[:5])  # Top 5 only
-        }
+        features = compute_embedding(image, model)
     except Exception as e:
         print(f"Classification error: {e}")
-        return _get_fallback_result()
+        return degraded_result('inference_error')
+    
+    return classify_with_tta(image, features, model, tta, image_key)
 
-def _get_fallback_result():
-    """Return a fallback result when model fails."""
-    import random
-    breeds = ['Murrah', 'Gir', 'Sahiwal', 'Jaffarbadi', 'Kankrej']
-    breed = random.choice(breeds)
-    return {
-        'breed': breed,
-        'confidence': 0.75 + random.random() * 0.15,
-        'animal_type': 'Buffalo' if breed in BUFFALO_BREEDS else 'Cattle',
-        'is_verified': False,
-        'all_scores': {breed: 0.85}
+def tta_features_version(model) -> str:
+    """Cache tag of TTA-averaged embeddings (they differ from single-view ones)."""
+    return f"{model.model_version}+tta-{TTA_VIEWS}"
+
+def tta_embedding(image, features: np.ndarray, model, image_key: str = None) -> tuple:
+    """
+    Mean direction of the center-crop embedding and the TTA views, which are
+    all run as one batch (a single session.run). `image` may be the upload's
+    bytes; it is only decoded on a cache miss. Returns (embedding, views).
+    """
+    version = tta_features_version(model)
+    views = 1 + preprocessing.TTA_VIEWS[TTA_VIEWS]
+    if isinstance(image, bytes):
+        image_key = image_key or image_hash(image)
+    cached = embedding_cache.get(image_key, version) if image_key else None
+    if cached is not None:
+        return cached, views
+    if isinstance(image, bytes):
+        with stage('decode'):
+            image = Image.open(io.BytesIO(image))
+            image.load()
+    with stage('preprocess'):
+        batch = preprocessing.tta_views(image, TTA_VIEWS)
+    with stage('inference'):
+        embeddings = np.concatenate([np.atleast_2d(features), model.run(batch)])
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    embedding = embeddings.mean(axis=0).astype(np.float32)
+    if image_key:
+        embedding_cache.put(image_key, version, embedding)
+    return embedding, views
+
+def classify_with_tta(image, features: np.ndarray, model, tta: str = None,
+                      image_key: str = None) -> dict:
+    """
+    Score the single-view embedding; if its top-1/top-2 margin is low (or
+    tta='always'), score the average over multi-crop + flip views instead.
+    The result then carries 'tta' with the view count and the single-view answer.
+    """
+    tta = tta or TTA_MODE
+    result = classify_features(features, model)
+    if tta == 'off' or result['status'] != 'ok':
+        return result
+    tta_counts['checked'] += 1
+    if tta == 'auto' and result['margin'] >= TTA_MARGIN:
+        return result
+    
+    try:
+        embedding, views = tta_embedding(image, features, model, image_key)
+    except Exception as e:
+        print(f"TTA error, keeping the single-view result: {e}")
+        return result
+    augmented = classify_features(embedding, model)
+    if augmented['status'] == 'degraded':
+        return result
+    tta_counts['applied'] += 1
+    if augmented['breed'] != result['breed']:
+        tta_counts['changed'] += 1
+    augmented['tta'] = {
+        'views': views,
+        'single_view': {k: result[k] for k in ('breed', 'confidence', 'margin')},
     }
+    return augmented
+
+def classify_features(features: np.ndarray, model=None) -> dict:
+    """
+    Classify a breed from a precomputed embedding.
+    
+    Returns calibrated probabilities, the top-1/top-2 margin and an
+    open-set "not a cow/buffalo" rejection (status 'rejected').
+    """
+    model = resolve_model(model)
+    if model is None:
+        return degraded_result()
+    
+    try:
+        with stage('scoring'):
+            return model.scorer.score(features)[0]
+    except Exception as e:
+        print(f"Classification error: {e}")
+        return degraded_result('scoring_error')
+
+@app.before_request
+def _begin_trace():
+    """Start an opt-in request trace (header or sampling rate)."""
+    g.trace_token = profiling.start_trace(
+        f"{request.method} {request.path}",
+        request.headers.get(profiling.TRACE_HEADER)
+    )
+
+
+@app.after_request
+def _finish_trace(response):
+    """Attach stage timings to traced responses."""
+    trace = profiling.end_trace(g.pop('trace_token', None))
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Moomingle-Trace-Id'] = trace.trace_id
+    return response
+
+
+@app.teardown_request
+def _abort_trace(exc):
+    """Make sure traces of failed requests are closed too."""
+    profiling.end_trace(g.pop('trace_token', None))
+
+
+# ============== ADMISSION CONTROL ==============
+
+# Inference endpoints and their queue priority (see admission.py); bulk job
+# batches queue behind all of them as 'bulk'
+ADMISSION_PRIORITIES = {
+    'verify_muzzle': 'verify',
+    'register_muzzle': 'verify',
+    'predict': 'predict',
+    'embed': 'predict',
+    'similar_listings': 'predict',
+}
+RATE_LIMITED_ENDPOINTS = set(ADMISSION_PRIORITIES) | {'submit_job'}
+admission = Admission()
+rate_limiter = RateLimiter()
+
+@app.errorhandler(413)
+def _too_large(e):
+    limit = app.config['MAX_CONTENT_LENGTH']
+    return jsonify({'error': f'Request body is larger than {limit // 2 ** 20} MB'}), 413
+
+@app.errorhandler(Shed)
+def _shed(e):
+    response = jsonify(e.body())
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.before_request
+def _admit():
+    """
+    Per-client rate limit, then wait for an inference slot. Requests over
+    the limit, beyond the queue or past their deadline are answered at once
+    (429 / 503 / 504 with Retry-After) and never reach the model.
+    """
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return
+    client = rate_limiter.client(request.headers.get(API_KEY_HEADER), request.access_route,
+                                 request.remote_addr)
+    wait = rate_limiter.check(client)
+    if wait:
+        raise Shed('rate_limited', wait)
+    priority = ADMISSION_PRIORITIES.get(request.endpoint)
+    if priority:
+        g.admitted_at = admission.acquire(priority, deadline_from(request.headers.get(DEADLINE_HEADER)))
+
+@app.teardown_request
+def _release_admission(exc):
+    acquired_at = g.pop('admitted_at', None)
+    if acquired_at is not None:
+        admission.release(acquired_at)
+
 
 @app.route('/')
 def health():
@@ -148,18 +478,126 @@ def health():
     return jsonify({
         'status': 'ok',
         'service': 'MooMingle Breed Classifier API',
-        'model_loaded': session is not None,
-        'supported_breeds': len(ALL_BREEDS)
+        'model_loaded': models.current() is not None,
+        'model_version': models.current().model_version if models.current() else None,
+        'supported_breeds': len(ALL_BREEDS),
+        'embedding_cache': embedding_cache.stats(),
+        'crop_cascade': crop_cascade.stats() if crop_cascade else None,
+        'coalescing': inflight.stats(),
+        'admission': {**admission.stats(), 'rate_limit': rate_limiter.stats()},
+        'jobs': job_workers.stats(),
+        'listing_index': {**listing_index.stats(), 'sync': listing_indexer.stats()},
+        'tta': {'mode': TTA_MODE, 'views': TTA_VIEWS, 'margin': TTA_MARGIN, **tta_counts}
+    })
+
+def _embedding_from_payload(data: dict, model, expected_version: str = None) -> np.ndarray:
+    """
+    Decode a client-supplied embedding ({embedding, dtype, model_version}).
+    Raises EmbeddingError if it was made by another model version
+    (expected_version, by default the model's own).
+    """
+    if model is None:
+        raise EmbeddingError('Model is not loaded, embeddings cannot be used right now', 503)
+    
+    expected_version = expected_version or model.model_version
+    client_version = data.get('model_version')
+    if client_version != expected_version:
+        raise EmbeddingError(
+            f"Embedding was computed by model version '{client_version}', "
+            f"current version is '{expected_version}'. Call /embed again.", 409
+        )
+    return decode_embedding(data['embedding'], data.get('dtype', DEFAULT_DTYPE),
+                            expected_dim=model.scorer.dim)
+
+@app.route('/embed', methods=['POST'])
+@with_model
+def embed():
+    """
+    Compute an image embedding once so it can be reused by /predict and the
+    muzzle endpoints without running the model again.
+    
+    Expects: multipart/form-data with 'file', or JSON { "image": "<base64>" }
+    Options (query string or JSON): dtype=float16|float32 (default float16),
+                                    format=json|binary (default json),
+                                    region=image|muzzle (default image; muzzle
+                                    embeddings are for the muzzle endpoints)
+    Returns: JSON { embedding (base64), dtype, dim, model_version, image_sha256 }
+             or raw little-endian bytes with X-Model-Version / X-Embedding-* headers
+    """
+    data = request.get_json(silent=True) or {}
+    dtype = request.args.get('dtype', data.get('dtype', DEFAULT_DTYPE))
+    output_format = request.args.get('format', data.get('format', 'json'))
+    region = request.args.get('region', data.get('region', 'image'))
+    if region not in ('image', 'muzzle'):
+        return jsonify({'error': "region must be 'image' or 'muzzle'"}), 400
+    
+    try:
+        if 'file' in request.files:
+            image_bytes = request.files['file'].read()
+        elif 'image' in data:
+            image_bytes = base64.b64decode(data['image'])
+        else:
+            return jsonify({'error': 'No file or image provided'}), 400
+        
+        if region == 'muzzle':
+            features = embed_muzzle_bytes([image_bytes], g.model)
+            features = features[0] if features is not None else None
+        else:
+            features = embed_image_bytes(image_bytes, g.model)
+        if features is None:
+            return jsonify({'error': 'Model is not loaded, embeddings are unavailable'}), 503
+        
+        payload = encode_embedding(features, dtype)
+        version = muzzle_features_version(g.model) if region == 'muzzle' else g.model.model_version
+    except EmbeddingError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print(f"❌ Embedding error: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    if output_format == 'binary':
+        return Response(payload, mimetype='application/octet-stream', headers={
+            'X-Model-Version': version,
+            'X-Embedding-Dtype': dtype,
+            'X-Embedding-Dim': str(len(features)),
+            'X-Image-Sha256': image_hash(image_bytes),
+        })
+    
+    return jsonify({
+        'embedding': base64.b64encode(payload).decode('ascii'),
+        'dtype': dtype,
+        'dim': len(features),
+        'model_version': version,
+        'image_sha256': image_hash(image_bytes)
     })
 
 @app.route('/predict', methods=['POST'])
+@with_model
 def predict():
     """
     Predict breed from uploaded image.
     
-    Expects: multipart/form-data with 'file' field containing image
-    Returns: JSON with breed, confidence, animal_type, is_verified, all_scores
+    Expects: multipart/form-data with 'file' field containing image,
+             or JSON { "embedding": "<base64>", "dtype": "float16", "model_version": "..." }
+    Returns: JSON with breed, confidence, animal_type, is_verified, all_scores,
+             margin, similarity and status ('ok', 'rejected' = not a cow/buffalo,
+             'degraded' = model unavailable, sent with HTTP 503).
+             ?tta=off|auto|always overrides MOOMINGLE_TTA; when test-time
+             augmentation was used the result has 'tta' (views, single_view).
     """
+    tta = request.args.get('tta')
+    if tta is not None and tta not in TTA_MODES:
+        return jsonify({'error': f"tta must be one of: {', '.join(TTA_MODES)}"}), 400
+    
+    data = request.get_json(silent=True)
+    if data and 'embedding' in data:
+        # A client-side embedding has no image to augment
+        try:
+            result = classify_features(_embedding_from_payload(data, g.model), g.model)
+        except EmbeddingError as e:
+            return jsonify({'error': str(e)}), e.status
+        return jsonify(result), 503 if result['status'] == 'degraded' else 200
+    
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -168,14 +606,19 @@ def predict():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        # Read image
+        # Read image and classify (embedding is cached per image)
         image_bytes = file.read()
-        image = Image.open(io.BytesIO(image_bytes))
+        features = embed_image_bytes(image_bytes, g.model)
+        if features is None:
+            result = degraded_result()
+        else:
+            result = classify_with_tta(image_bytes, features, g.model, tta)
         
-        # Classify
-        result = classify_breed(image)
+        if result['status'] == 'degraded':
+            print(f"⚠️ Prediction unavailable: {result['reason']}")
+            return jsonify(result), 503
         
-        print(f"🐮 Prediction: {result['breed']} ({result['confidence']:.2%})")
+        print(f"🐮 Prediction: {result['breed']} ({result['confidence']:.2%}, {result['status']})")
         
         return jsonify(result)
     
@@ -195,33 +638,21 @@ def list_breeds():
 
 # ============== MUZZLE BIOMETRIC ENDPOINTS ==============
 
-def extract_muzzle_features(image: Image.Image) -> np.ndarray:
+def extract_muzzle_features(image: Image.Image, model=None) -> np.ndarray:
     """
     Extract feature vector from muzzle image.
     Uses the same model as breed classification but extracts intermediate features.
     In production, use a dedicated muzzle recognition model.
     """
-    global session
-    
-    if session is None:
-        load_model()
-    
-    # Preprocess - focus on texture/pattern extraction
-    image = image.convert('RGB')
-    transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    input_data = transform(image).unsqueeze(0).numpy()
-    
-    # Extract features (embedding vector)
-    if session is not None:
-        features = session.run(None, {'input': input_data})[0][0]
+    # Extract features (embedding vector) of the muzzle/animal crop
+    if crop_cascade is not None and resolve_model(model) is not None:
+        image = muzzle_crops([image], [image_hash(image.tobytes())])[0]
+    features = compute_embedding(image, model)
+    if features is not None:
         return features
     
     # Fallback: generate pseudo-features from image hash
+    image = image.convert('RGB')
     img_bytes = io.BytesIO()
     image.save(img_bytes, format='PNG')
     img_hash = hashlib.sha256(img_bytes.getvalue()).hexdigest()
@@ -229,6 +660,90 @@ def extract_muzzle_features(image: Image.Image) -> np.ndarray:
     return np.array([int(img_hash[i:i+2], 16) / 255.0 for i in range(0, 64, 2)])
 
 
+def is_burst(data: dict) -> bool:
+    return 'frames' in data or 'clip' in data
+
+
+def select_burst_frames(data: dict, model=None):
+    """
+    The best frames of a burst upload: { "frames": ["<base64>", ...] } or
+    { "clip": "<base64 animated GIF/WebP>" }. Every frame is scored for
+    sharpness and exposure; with the crop cascade, the best candidates go
+    through the detector in one batch and the size of the found muzzle or
+    animal counts too.
+    
+    Returns ([(frame bytes, image), ...] best first, their weights, info)
+    """
+    with stage('decode'):
+        if 'clip' in data:
+            frames = clip_frames(decode_image(base64.b64decode(data['clip'])))
+            payloads = [frame.tobytes() for frame in frames]  # Raw pixels key the caches
+        else:
+            payloads = [base64.b64decode(frame) for frame in data['frames'][:MAX_FRAMES]]
+            frames = [decode_image(payload) for payload in payloads]
+    if not frames:
+        raise EmbeddingError('The upload contains no frames')
+    
+    with stage('frame_quality'):
+        quality = image_quality(frames)
+    scores = quality['score']
+    candidates = np.argsort(-scores)[:2 * TOP_FRAMES]
+    if crop_cascade is not None and resolve_model(model) is not None:
+        # Boxes are cached per frame, so the crop step reuses this detection
+        with stage('detect'):
+            located = crop_cascade.locate([frames[i] for i in candidates],
+                                          [image_hash(payloads[i]) for i in candidates])
+        scores = scores.copy()
+        scores[candidates] *= region_weight(located, [frames[i].size for i in candidates])
+        candidates = candidates[np.argsort(-scores[candidates])]
+    best = candidates[:TOP_FRAMES]
+    
+    info = {
+        'frames': len(frames),
+        'selected': best.tolist(),
+        'scores': [round(float(scores[i]), 4) for i in best],
+        'sharpness': [round(float(quality['sharpness'][i]), 6) for i in best],
+    }
+    return [(payloads[i], frames[i]) for i in best], scores[best], info
+
+
+def muzzle_features_from_payload(data: dict, model=None, decoded=None, weights=None):
+    """
+    Muzzle features from a request: a precomputed embedding if given
+    (from /embed?region=muzzle), otherwise the base64 image (cropped by the
+    detector cascade and served from the embedding cache if possible).
+    
+    `decoded` may pass [(image bytes, PIL image), ...] when the caller has
+    already decoded the upload. Several frames (select_burst_frames) are
+    embedded as one batch and aggregated into one template, using `weights`.
+    
+    Returns (features, features_version); only features of the same
+    version can be compared with each other.
+    """
+    model = resolve_model(model)
+    if 'embedding' in data:
+        version = muzzle_features_version(model) if model is not None else None
+        return _embedding_from_payload(data, model, version), version
+    
+    if decoded is None:
+        if is_burst(data):
+            decoded, weights, _ = select_burst_frames(data, model)
+        else:
+            decoded = [(base64.b64decode(data['image']), None)]
+    images_bytes = [image_data for image_data, _ in decoded]
+    images = [image for _, image in decoded]
+    features = embed_muzzle_bytes(images_bytes, model, images if all(images) else None)
+    if features is not None:
+        if len(features) > 1:
+            with stage('aggregate'):
+                features = [aggregate(features, weights)[0]]
+        return features[0], muzzle_features_version(model)
+    
+    # Model unavailable: fall back to hash-based pseudo-features (of the best frame)
+    image_data, image = decoded[0]
+    return extract_muzzle_features(image or decode_image(image_data)), FALLBACK_FEATURES_VERSION
+
+
 def compute_similarity(features1: np.ndarray, features2: np.ndarray) -> float:
     """Compute cosine similarity between two feature vectors."""
     dot_product = np.dot(features1, features2)
@@ -239,103 +754,199 @@ def compute_similarity(features1: np.ndarray, features2: np.ndarray) -> float:
     return float(dot_product / (norm1 * norm2))
 
 
+def find_photo_duplicate(image_bytes: bytes, image: Image.Image) -> tuple:
+    """
+    Look a muzzle photo up among the registered ones. The same bytes
+    registered before give the 409 body at once, before any inference.
+    Otherwise returns the photo facts for store_registration(): its sha256,
+    perceptual hash and the (existing_id, distance) of a close hash, if any
+    (only a candidate: a 9x8 hash of two close-ups framed alike can be close
+    for different animals). Returns (photo, duplicate body or None).
+    """
+    digest = image_hash(image_bytes)
+    photo_prefilter['lookups'] += 1
+    existing_id = muzzle_photo_digests.get(digest)
+    if existing_id is not None and existing_id in muzzle_store:
+        photo_prefilter['hits'] += 1
+        duplicate_counts['exact_photo'] += 1
+        return None, {
+            'success': False,
+            'error': 'This animal appears to already be registered',
+            'existing_muzzle_id': existing_id,
+            'similarity': 1.0,
+            'match_type': 'exact_photo'
+        }
+    with stage('phash'):
+        photo_hash = dhash(image)
+        candidate = muzzle_phashes.find_duplicate(photo_hash)
+    return {'sha256': digest, 'phash': photo_hash, 'candidate': candidate}, None
+
+
+def store_registration(features: np.ndarray, features_version: str, listing_id: str,
+                       animal_name: str, region: str = None, photo: dict = None) -> tuple:
+    """
+    Add a muzzle to the registry unless the same animal is already in it
+    (embedding search), writing it through to muzzle_prints. The photo
+    candidate from find_photo_duplicate() is a duplicate only if its
+    embedding is also close (PHOTO_CONFIRM_SIMILARITY).
+    Returns (response body, HTTP status).
+    """
+    photo = photo or {}
+    photo_candidate = photo.get('candidate')
+    photo_hash = photo.get('phash')
+    # Generate unique muzzle ID
+    muzzle_id = f"MZL-{hashlib.md5(f'{listing_id}-{datetime.now().isoformat()}'.encode()).hexdigest()[:12].upper()}"
+    
+    # Check for duplicates (same animal registered twice)
+    # (only records of the same embedding space are compared)
+    with stage('duplicate_search'):
+        nearest = muzzle_store.search(features, features_version,
+                                      k=PHOTO_CONFIRM_K if photo_candidate else 1)
+    if photo_candidate is not None:
+        existing_id, distance = photo_candidate
+        similarity = next((s for m, s in nearest if m == existing_id), None)
+        if similarity is not None and similarity >= PHOTO_CONFIRM_SIMILARITY:
+            duplicate_counts['photo'] += 1
+            return {
+                'success': False,
+                'error': 'This animal appears to already be registered',
+                'existing_muzzle_id': existing_id,
+                'similarity': round(similarity, 4),
+                'photo_distance': distance,
+                'match_type': 'photo'
+            }, 409
+    if nearest and nearest[0][1] > 0.95:  # Very high similarity = likely same animal
+        existing_id, similarity = nearest[0]
+        duplicate_counts['embedding'] += 1
+        return {
+            'success': False,
+            'error': 'This animal appears to already be registered',
+            'existing_muzzle_id': existing_id,
+            'similarity': round(similarity, 4),
+            'match_type': 'embedding'
+        }, 409
+    
+    # Store in database
+    record = {
+        'phash': f'{photo_hash:016x}' if photo_hash is not None else None,
+        'photo_sha256': photo.get('sha256'),
+        'listing_id': listing_id,
+        'animal_name': animal_name,
+        'region': region,
+        'registered_at': datetime.now().isoformat(),
+        'status': 'verified'
+    }
+    muzzle_store.add(muzzle_id, features, features_version, **record)
+    if muzzle_sync.client is not None:
+        with stage('write_through'):
+            muzzle_sync.write_through(muzzle_id, features, features_version, record)
+    if photo.get('sha256'):
+        muzzle_photo_digests[photo['sha256']] = muzzle_id
+    if photo_hash is not None:
+        muzzle_phashes.add(muzzle_id, photo_hash)
+    
+    print(f"🐮 Registered muzzle: {muzzle_id} for listing {listing_id}")
+    
+    return {
+        'success': True,
+        'muzzle_id': muzzle_id,
+        'confidence': 0.95,
+        'status': 'verified',
+        'message': f'Muzzle biometric registered for {animal_name}'
+    }, 200
+
+
 @app.route('/api/muzzle/register', methods=['POST'])
+@with_model
 def register_muzzle():
     """
     Register a new muzzle biometric for a listing.
     
-    Expects JSON: { "image": "<base64>", "listing_id": "...", "animal_name": "..." }
+    Expects JSON: { "image": "<base64>", "listing_id": "...", "animal_name": "...",
+                    "region": "..." (optional, keeps a region's animals on one shard) }
+                  ("embedding" + "dtype" + "model_version" from /embed may replace "image";
+                   so may a burst: "frames": ["<base64>", ...] or "clip": "<base64 GIF/WebP>",
+                   of which the sharpest, best exposed frames are embedded and combined)
     Returns: { "success": true, "muzzle_id": "MZL-...", "confidence": 0.95 }
     """
     try:
         data = request.get_json()
-        if not data or 'image' not in data or 'listing_id' not in data:
+        if not data or not ('image' in data or 'embedding' in data or is_burst(data)) or 'listing_id' not in data:
             return jsonify({'success': False, 'error': 'Missing image or listing_id'}), 400
         
-        # Decode image
-        image_data = base64.b64decode(data['image'])
-        image = Image.open(io.BytesIO(image_data))
-        
         listing_id = data['listing_id']
         animal_name = data.get('animal_name', 'Unknown')
         
-        # Extract muzzle features
-        features = extract_muzzle_features(image)
-        
-        # Generate unique muzzle ID
-        muzzle_id = f"MZL-{hashlib.md5(f'{listing_id}-{datetime.now().isoformat()}'.encode()).hexdigest()[:12].upper()}"
-        
-        # Check for duplicates (same animal registered twice)
-        for existing_id, existing_data in muzzle_database.items():
-            similarity = compute_similarity(features, np.array(existing_data['features']))
-            if similarity > 0.95:  # Very high similarity = likely same animal
-                return jsonify({
-                    'success': False,
-                    'error': 'This animal appears to already be registered',
-                    'existing_muzzle_id': existing_id,
-                    'similarity': round(similarity, 4)
-                }), 409
+        # Same photo uploaded again? The same bytes are answered before any
+        # inference; a recompressed copy is confirmed by embedding below
+        # (for a burst: its best frame)
+        decoded = weights = burst = photo = None
+        if is_burst(data):
+            decoded, weights, burst = select_burst_frames(data, g.model)
+        elif 'image' in data:
+            image_data = base64.b64decode(data['image'])
+            decoded = [(image_data, decode_image(image_data))]
+        if decoded is not None:
+            photo, duplicate = find_photo_duplicate(*decoded[0])
+            if duplicate is not None:
+                return jsonify(duplicate), 409
         
-        # Store in database
-        muzzle_database[muzzle_id] = {
-            'features': features.tolist(),
-            'listing_id': listing_id,
-            'animal_name': animal_name,
-            'registered_at': datetime.now().isoformat(),
-            'status': 'verified'
-        }
+        # Extract muzzle features
+        features, features_version = muzzle_features_from_payload(data, g.model, decoded, weights)
         
-        print(f"🐮 Registered muzzle: {muzzle_id} for listing {listing_id}")
-        
-        return jsonify({
-            'success': True,
-            'muzzle_id': muzzle_id,
-            'confidence': 0.95,
-            'status': 'verified',
-            'message': f'Muzzle biometric registered for {animal_name}'
-        })
+        body, status = store_registration(features, features_version, listing_id, animal_name,
+                                          data.get('region'), photo)
+        if status == 200:
+            body['burst'] = burst
+        return jsonify(body), status
         
+    except EmbeddingError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
     except Exception as e:
         print(f"❌ Muzzle registration error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @app.route('/api/muzzle/verify', methods=['POST'])
+@with_model
 def verify_muzzle():
     """
     Verify a muzzle against the database.
     
     Expects JSON: { "image": "<base64>", "expected_listing_id": "..." (optional) }
+                  ("embedding" + "dtype" + "model_version" from /embed may replace "image";
+                   so may "frames": ["<base64>", ...] or "clip": "<base64 GIF/WebP>")
     Returns: { "success": true/false, "matched_listing_id": "...", "confidence": 0.92 }
     """
     try:
         data = request.get_json()
-        if not data or 'image' not in data:
+        if not data or not ('image' in data or 'embedding' in data or is_burst(data)):
             return jsonify({'success': False, 'error': 'Missing image'}), 400
         
-        # Decode image
-        image_data = base64.b64decode(data['image'])
-        image = Image.open(io.BytesIO(image_data))
-        
         expected_listing_id = data.get('expected_listing_id')
         
-        # Extract features from uploaded image
-        query_features = extract_muzzle_features(image)
+        # Extract features from uploaded image (or use the precomputed embedding);
+        # a burst is reduced to a template of its best frames
+        decoded = weights = burst = None
+        if is_burst(data):
+            decoded, weights, burst = select_burst_frames(data, g.model)
+        query_features, features_version = muzzle_features_from_payload(data, g.model, decoded, weights)
         
-        # Search database for matches
+        # Search database for matches (same embedding space only)
         best_match = None
         best_similarity = 0.0
         
-        for muzzle_id, muzzle_data in muzzle_database.items():
-            similarity = compute_similarity(query_features, np.array(muzzle_data['features']))
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match = {
-                    'muzzle_id': muzzle_id,
-                    'listing_id': muzzle_data['listing_id'],
-                    'animal_name': muzzle_data['animal_name'],
-                    'similarity': similarity
-                }
+        with stage('search'):
+            nearest = muzzle_store.search(query_features, features_version, k=1)
+        if nearest:
+            muzzle_id, best_similarity = nearest[0]
+            muzzle_data = muzzle_store.get(muzzle_id)
+            best_match = {
+                'muzzle_id': muzzle_id,
+                'listing_id': muzzle_data['listing_id'],
+                'animal_name': muzzle_data['animal_name'],
+                'similarity': best_similarity
+            }
         
         # Threshold for positive match
         MATCH_THRESHOLD = 0.75
@@ -356,7 +967,8 @@ def verify_muzzle():
                 'animal_name': best_match['animal_name'],
                 'confidence': round(best_similarity, 4),
                 'is_expected_match': is_expected_match,
-                'status': 'verified'
+                'status': 'verified',
+                'burst': burst
             })
         else:
             print(f"❌ No muzzle match found (best similarity: {best_similarity:.2%})")
@@ -364,9 +976,12 @@ def verify_muzzle():
                 'success': False,
                 'error': 'No matching muzzle print found in database',
                 'best_similarity': round(best_similarity, 4) if best_match else 0,
-                'status': 'no_match'
+                'status': 'no_match',
+                'burst': burst
             })
             
+    except EmbeddingError as e:
+        return jsonify({'success': False, 'error': str(e), 'status': 'failed'}), e.status
     except Exception as e:
         print(f"❌ Muzzle verification error: {e}")
         return jsonify({'success': False, 'error': str(e), 'status': 'failed'}), 500
@@ -378,16 +993,17 @@ def muzzle_status(listing_id):
     Check muzzle verification status for a listing.
     """
     # Find muzzle record for this listing
-    for muzzle_id, muzzle_data in muzzle_database.items():
-        if muzzle_data['listing_id'] == listing_id:
-            return jsonify({
-                'success': True,
-                'muzzle_id': muzzle_id,
-                'status': muzzle_data['status'],
-                'registered_at': muzzle_data['registered_at'],
-                'animal_name': muzzle_data['animal_name'],
-                'confidence': 0.95
-            })
+    found = muzzle_store.by_listing(listing_id)
+    if found is not None:
+        muzzle_id, muzzle_data = found
+        return jsonify({
+            'success': True,
+            'muzzle_id': muzzle_id,
+            'status': muzzle_data['status'],
+            'registered_at': muzzle_data['registered_at'],
+            'animal_name': muzzle_data['animal_name'],
+            'confidence': 0.95
+        })
     
     return jsonify({
         'success': False,
@@ -400,14 +1016,487 @@ def muzzle_status(listing_id):
 def muzzle_stats():
     """Get statistics about the muzzle database."""
     return jsonify({
-        'total_registered': len(muzzle_database),
-        'status': 'operational'
+        'total_registered': len(muzzle_store),
+        'status': 'operational',
+        'storage': muzzle_store.stats(),
+        # Only exact re-uploads skip inference; pHash candidates are confirmed after it
+        'photo_prefilter': {**photo_prefilter, 'indexed': len(muzzle_photo_digests)},
+        'phash_candidates': muzzle_phashes.stats(),
+        'duplicates_caught': duplicate_counts,
+        'persistence': muzzle_sync.stats()
     })
 
 
-# Pre-load model on startup
+# ============== SIMILAR LISTINGS ==============
+
+# Listing photos embedded into an IVF index with in-scan filters (see listing_index.py),
+# kept current from the listings table with MOOMINGLE_LISTING_INDEX_SYNC=1
+LISTING_INDEX_PATH = os.environ.get('MOOMINGLE_LISTING_INDEX')
+LISTING_SYNC_SECONDS = float(os.environ.get('MOOMINGLE_LISTING_SYNC_SECONDS', '300'))
+MAX_SIMILAR = 100
+
+def _embed_listing_images(images: list, keys: list) -> tuple:
+    """
+    (embeddings, model_version) of downloaded listing photos. Embeddings
+    already cached or stored are reused, the rest run as one model batch
+    and are written to the persistent store (not the LRU, which a full
+    sync would flush).
+    """
+    if models.current() is None:
+        load_model()
+    with models.use() as model:
+        if model is None:
+            raise RuntimeError('Model is not loaded')
+        version = model.model_version
+        features = [embedding_cache.get(key, version) for key in keys]
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            computed = compute_embeddings([images[i] for i in missing], model)
+            for i, embedding in zip(missing, computed):
+                features[i] = embedding
+            if embedding_store is not None:
+                embedding_store.put_many([(keys[i], features[i]) for i in missing], version)
+        return np.stack(features), version
+
+listing_index = ListingIndex()
+listing_indexer = ListingIndexer(
+    listing_index,
+    ListingsClient.from_env() if os.environ.get('MOOMINGLE_LISTING_INDEX_SYNC') == '1' else None,
+    LISTING_INDEX_PATH,
+    embed=_embed_listing_images
+)
+
+def _optional_float(value, name: str):
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise EmbeddingError(f'{name} must be a number')
+
+@app.route('/listings/similar', methods=['GET', 'POST'])
+@with_model
+def similar_listings():
+    """
+    Listings whose photo looks most like a given listing or photo.
+    
+    Query: ?listing_id=... (an indexed listing), or POST multipart 'file' /
+           JSON { "image": "<base64>" } / JSON { "embedding", "dtype", "model_version" }
+    Filters (query string or JSON): k (default 10), animal_type, min_price,
+           max_price, status ('active' by default, 'any' for all listings)
+    Returns: { "results": [{ "listing_id", "similarity", "image_url",
+               "animal_type", "price", "active" }], "scan": {...} }
+    """
+    data = request.get_json(silent=True) or {}
+    params = {**data, **request.args.to_dict()}
+    try:
+        k = int(params.get('k', 10))
+        if k < 1:
+            raise ValueError(k)
+        k = min(k, MAX_SIMILAR)
+        min_price = _optional_float(params.get('min_price'), 'min_price')
+        max_price = _optional_float(params.get('max_price'), 'max_price')
+    except (TypeError, ValueError):
+        return jsonify({'error': f'k must be an integer from 1 to {MAX_SIMILAR}'}), 400
+    except EmbeddingError as e:
+        return jsonify({'error': str(e)}), e.status
+    status = params.get('status', 'active')
+    if status not in ('active', 'any'):
+        return jsonify({'error': "status must be 'active' or 'any'"}), 400
+    if g.model is None:
+        return jsonify(degraded_result()), 503
+    if listing_index.model_version != g.model.model_version:
+        return jsonify({'error': 'The listing index is being built for the current model, try again later',
+                        'indexed': len(listing_index)}), 503
+    
+    listing_id = params.get('listing_id')
+    try:
+        if listing_id:
+            query = listing_index.vector(str(listing_id))
+            if query is None:
+                return jsonify({'error': 'Listing is not indexed (no photo, or not synced yet)'}), 404
+        elif 'embedding' in data:
+            query = _embedding_from_payload(data, g.model)
+        elif 'image' in data or 'file' in request.files:
+            image_bytes = base64.b64decode(data['image']) if 'image' in data else request.files['file'].read()
+            query = embed_image_bytes(image_bytes, g.model)
+        else:
+            return jsonify({'error': 'Give a listing_id, an image or an embedding'}), 400
+    except EmbeddingError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    with stage('search'):
+        results, scan = listing_index.search(
+            query, k, animal_type=params.get('animal_type'), min_price=min_price, max_price=max_price,
+            active_only=status == 'active', exclude=listing_id
+        )
+    return jsonify({
+        'results': [{'listing_id': found, 'similarity': round(similarity, 4), **listing_index.describe(found)}
+                    for found, similarity in results],
+        'scan': scan,
+        'model_version': listing_index.model_version
+    })
+
+
+# ============== BULK JOBS ==============
+
+# Interactive endpoints; bulk job batches wait while any of them is running
+INTERACTIVE_ENDPOINTS = {'predict', 'embed', 'register_muzzle', 'verify_muzzle', 'similar_listings'}
+interactive_gate = InteractiveGate()
+job_store = JobStore()
+
+@app.before_request
+def _enter_interactive():
+    if request.endpoint in INTERACTIVE_ENDPOINTS:
+        interactive_gate.enter()
+        g.interactive = True
+
+@app.teardown_request
+def _leave_interactive(exc):
+    if g.pop('interactive', False):
+        interactive_gate.leave()
+
+def _job_model():
+    """The model for a job batch; the batch is put back while none is loaded."""
+    if models.current() is None:
+        load_model()
+    if models.current() is None:
+        raise RetryLater('model is not loaded')
+
+@contextmanager
+def _bulk_slot():
+    """An inference slot for a job batch, queued behind interactive requests; shed batches are put back."""
+    try:
+        acquired_at = admission.acquire('bulk')
+    except Shed as e:
+        raise RetryLater(f'admission control ({e.reason})')
+    try:
+        yield
+    finally:
+        admission.release(acquired_at)
+
+def _decode_items(items: list) -> tuple:
+    """Decoded images of job items: ([(position, image)], outcomes with decode errors filled in)."""
+    decoded, outcomes = [], [None] * len(items)
+    for i, item in enumerate(items):
+        try:
+            decoded.append((i, decode_image(item['payload'])))
+        except Exception as e:
+            outcomes[i] = (False, {'error': f'Unreadable image: {e}'})
+    return decoded, outcomes
+
+def classify_job_batch(items: list, options: dict) -> list:
+    """Breed of every image of a job batch: one model batch, one scorer call."""
+    _job_model()
+    with _bulk_slot(), models.use() as model:
+        decoded, outcomes = _decode_items(items)
+        if not decoded:
+            return outcomes
+        keys = [image_hash(items[i]['payload']) for i, _ in decoded]
+        features = [embedding_cache.get(key, model.model_version) for key in keys]
+        missing = [j for j, f in enumerate(features) if f is None]
+        if missing:
+            embeddings = compute_embeddings([decoded[j][1] for j in missing], model)
+            for j, embedding in zip(missing, embeddings):
+                embedding_cache.put(keys[j], model.model_version, embedding)
+                features[j] = embedding
+        with stage('scoring'):
+            results = model.scorer.score(np.stack(features))
+        for (i, _), result in zip(decoded, results):
+            outcomes[i] = (True, result)
+        return outcomes
+
+def register_job_batch(items: list, options: dict) -> list:
+    """Register every muzzle photo of a job batch (embedded as one model batch)."""
+    _job_model()
+    with _bulk_slot(), models.use() as model:
+        decoded, outcomes = _decode_items(items)
+        fresh = []
+        for i, image in decoded:
+            photo, duplicate = find_photo_duplicate(items[i]['payload'], image)
+            if duplicate is not None:
+                outcomes[i] = (False, duplicate)
+            else:
+                fresh.append((i, image, photo))
+        if not fresh:
+            return outcomes
+        features = embed_muzzle_bytes([items[i]['payload'] for i, _, _ in fresh], model,
+                                      [image for _, image, _ in fresh])
+        if features is None:
+            raise RetryLater('model is not loaded')
+        version = muzzle_features_version(model)
+        # One at a time, so a batch registering the same animal twice is caught too
+        for (i, _, photo), embedding in zip(fresh, features):
+            meta = items[i]['meta']
+            body, status = store_registration(embedding, version, meta['listing_id'],
+                                              meta.get('animal_name', 'Unknown'),
+                                              meta.get('region'), photo)
+            outcomes[i] = (status == 200, body)
+        return outcomes
+
+job_workers = JobWorkers(job_store, {'classify': classify_job_batch, 'register': register_job_batch},
+                         interactive_gate)
+
+def _job_items_from_request(kind: str) -> list:
+    """
+    (name, image bytes, meta) items of a job submission: JSON
+    { "items": [{ "image": "<base64>", "name", "listing_id", "animal_name", "region" }] }
+    or multipart "files" (repeatable) and/or an "archive" (zip / tar.gz with an
+    optional manifest.json), plus an optional "manifest" form field
+    ({ file name: { "listing_id", "animal_name", "region" } }).
+    For registrations, listing_id defaults to the file name without extension.
+    """
+    data = request.get_json(silent=True)
+    if data is not None:
+        entries = data.get('items')
+        if not isinstance(entries, list):
+            raise JobError('Expected "items": [{"image": "<base64>", ...}]')
+        images, manifest = [], {}
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict) or 'image' not in entry:
+                raise JobError(f'Item {i} has no image')
+            name = entry.get('name') or f'item-{i}'
+            images.append((name, base64.b64decode(entry['image'])))
+            manifest[name] = {k: entry[k] for k in ('listing_id', 'animal_name', 'region') if k in entry}
+    else:
+        images = [(f.filename, f.read()) for f in request.files.getlist('files')]
+        manifest = {}
+        archive = request.files.get('archive')
+        if archive is not None:
+            archived, manifest = archive_items(archive.read(), archive.filename)
+            images += archived
+        try:
+            manifest.update(json.loads(request.form.get('manifest') or '{}'))
+        except ValueError as e:
+            raise JobError(f'Invalid manifest: {e}')
+    
+    items = []
+    for name, payload in images:
+        meta = dict(manifest.get(name) or manifest.get(os.path.basename(name)) or {})
+        if kind == 'register':
+            meta.setdefault('listing_id', os.path.splitext(os.path.basename(name))[0])
+        items.append((name, payload, meta))
+    return items
+
+def _job_view(job: dict) -> dict:
+    base = f"/api/jobs/{job['id']}"
+    return {**job, 'links': {'status': base, 'events': f'{base}/events', 'results': f'{base}/results'}}
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a bulk classification or muzzle registration job.
+    
+    Expects: "kind" ("classify" or "register", form field, JSON key or ?kind=)
+             and the images (see _job_items_from_request)
+    Returns: 202 with the job (id, status, total, progress) and links to poll
+             it, stream its progress (server-sent events) and download results
+    """
+    data = request.get_json(silent=True) or {}
+    kind = request.form.get('kind') or data.get('kind') or request.args.get('kind')
+    if kind not in job_workers.handlers:
+        return jsonify({'error': f"kind must be one of: {', '.join(job_workers.handlers)}"}), 400
+    try:
+        job = job_store.create(kind, _job_items_from_request(kind))
+    except JobError as e:
+        return jsonify({'error': str(e)}), e.status
+    job_workers.notify()
+    print(f"📥 Job {job['id']}: {kind} x {job['total']}")
+    return jsonify(_job_view(job)), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Progress of a job (done, failed, total, status)."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_view(job))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel the unprocessed part of a job; results so far stay downloadable."""
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_view(job_store.cancel(job_id)))
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: 'progress' whenever the job advances, then 'end'."""
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        last, quiet = None, 0
+        while True:
+            job = job_store.get(job_id)
+            if job is None:
+                return
+            state = (job['status'], job['done'], job['failed'])
+            if state != last:
+                last, quiet = state, 0
+                yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+            elif quiet >= 15:
+                quiet = 0
+                yield ": keep-alive\n\n"
+            if job['status'] in ('done', 'cancelled'):
+                yield f"event: end\ndata: {json.dumps({'status': job['status']})}\n\n"
+                return
+            quiet += 1
+            time.sleep(1)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """
+    Results as newline-delimited JSON, one {index, name, status, result}
+    line per processed item (also while the job is still running).
+    Query: ?status=failed to download only the failures.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    lines = (json.dumps(row) + '\n' for row in job_store.results(job_id, request.args.get('status')))
+    return Response(lines, mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename=job-{job_id}.ndjson',
+        'X-Job-Status': job['status'],
+    })
+
+
+# ============== ADMIN: PROFILING ==============
+
+def _admin_denied():
+    """Return an error response unless the admin token is valid."""
+    if not profiling.admin_enabled():
+        return jsonify({'error': 'Not found'}), 404
+    if not profiling.check_admin_token(request.headers.get(profiling.ADMIN_TOKEN_HEADER)):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+@app.route('/admin/profile/start', methods=['POST'])
+def admin_profile_start():
+    """
+    Start a time-bounded sampling profile of this worker.
+    
+    Query: ?seconds=30&interval_ms=5
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        seconds = float(request.args.get('seconds', 30))
+        interval_ms = float(request.args.get('interval_ms', profiling.SAMPLE_INTERVAL_MS))
+        session_info = profiling.start_profile(seconds, interval_ms).status()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), **profiling.profile_status()}), 409
+    print(f"🔬 Worker profile started for {session_info['seconds']}s")
+    return jsonify(session_info)
+
+
+@app.route('/admin/profile/stop', methods=['POST'])
+def admin_profile_stop():
+    """Stop the worker profile and return collapsed stacks (text/plain)."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    stopped = profiling.stop_profile()
+    if stopped is None:
+        return jsonify({'error': 'No profile has been started in this worker'}), 404
+    profile, collapsed = stopped
+    return Response(collapsed, mimetype='text/plain',
+                    headers={'X-Profile-Path': profile.path or ''})
+
+
+@app.route('/admin/profile/status', methods=['GET'])
+def admin_profile_status():
+    """Report whether a worker profile is running."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(profiling.profile_status())
+
+
+# ============== ADMIN: MODEL HOT RELOAD ==============
+
+@app.route('/admin/model/reload', methods=['POST'])
+def admin_model_reload():
+    """
+    Load a new model/prototypes version in the background, warm it up and
+    swap it in atomically. Only affects the worker serving this request;
+    set MOOMINGLE_MODEL_POLL_SECONDS to have every worker follow the hub.
+    
+    Expects JSON (all optional): { "revision": "<hf revision>" }
+                                 or { "model_path": "...", "prototypes_path": "..." }
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    if bool(data.get('model_path')) != bool(data.get('prototypes_path')):
+        return jsonify({'error': 'model_path and prototypes_path go together'}), 400
+    
+    started = models.reload_async(
+        revision=data.get('revision'),
+        model_path=data.get('model_path'),
+        prototypes_path=data.get('prototypes_path')
+    )
+    if not started:
+        return jsonify({'error': 'A model load is already running', **models.info()}), 409
+    return jsonify({'accepted': True, **models.info()}), 202
+
+
+@app.route('/admin/model/status', methods=['GET'])
+def admin_model_status():
+    """Current model version and state of the last (re)load."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(models.info())
+
+
+# ============== ADMIN: MUZZLE SNAPSHOT ==============
+
+@app.route('/admin/muzzle/snapshot', methods=['POST'])
+def admin_muzzle_snapshot():
+    """Write this worker's muzzle registry to MOOMINGLE_MUZZLE_SNAPSHOT now."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if not muzzle_sync.snapshot_path:
+        return jsonify({'error': 'Set MOOMINGLE_MUZZLE_SNAPSHOT (not available with shards)'}), 409
+    size = muzzle_sync.save()
+    return jsonify({'path': muzzle_sync.snapshot_path, 'bytes': size, 'records': len(muzzle_store)})
+
+
+# Pre-load model on startup. MOOMINGLE_PRELOAD_MODEL=background (default) loads it
+# in a thread so the worker serves health checks right away; 1 blocks the import
+# until it is loaded; 0 skips it (e.g. for offline benchmarks)
 print("Starting MooMingle Breed Classifier API...")
-load_model()
+PRELOAD_MODEL = os.environ.get('MOOMINGLE_PRELOAD_MODEL', 'background')
+if PRELOAD_MODEL == 'background':
+    models.reload_async(only_if_empty=True)
+elif PRELOAD_MODEL != '0':
+    load_model()
+
+MODEL_POLL_SECONDS = float(os.environ.get('MOOMINGLE_MODEL_POLL_SECONDS', '0'))
+if MODEL_POLL_SECONDS > 0:
+    models.watch_hub(MODEL_POLL_SECONDS)
+
+muzzle_sync.warm_start()
+
+listing_indexer.warm_start()
+if listing_indexer.client is not None and LISTING_SYNC_SECONDS > 0:
+    listing_indexer.start(LISTING_SYNC_SECONDS)
+
+# Resume queued bulk jobs; otherwise the workers start with the first submission
+if job_store.exists():
+    job_workers.start()
+if muzzle_sync.client is not None and MUZZLE_SYNC_SECONDS > 0:
+    muzzle_sync.start(MUZZLE_SYNC_SECONDS)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
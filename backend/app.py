@@ -1,88 +1,70 @@
 """
 Cattle & Buffalo Breed Classifier API
 Wraps vishnuamar/cattle-breed-classifier for use with Moomingle app.
+
+Requests go through Gradio's queue. In batched mode (the default) the queue
+hands up to MOOMINGLE_GRADIO_MAX_BATCH waiting uploads to predict_batch(),
+which classifies them with one session.run() and the vectorized prototype
+scorer shared with api.py (scoring.py).
 """
 
+import os
+import threading
+
 import gradio as gr
-from huggingface_hub import hf_hub_download
-import onnxruntime as ort
-import numpy as np
-import json
 from PIL import Image
-from torchvision import transforms
 
-# Global model state
-session = None
-prototypes = None
+import preprocessing
+from model_registry import ModelRegistry
 
 BUFFALO_BREEDS = ['Bhadawari', 'Jaffarbadi', 'Mehsana', 'Murrah', 'Surti']
 CATTLE_BREEDS = ['Gir', 'Kankrej', 'Ongole', 'Sahiwal', 'Tharparkar']
+ANIMAL_TYPES = {**{b: 'Buffalo' for b in BUFFALO_BREEDS}, **{b: 'Cattle' for b in CATTLE_BREEDS}}
+
+# Queue / batching settings
+BATCHED = os.environ.get('MOOMINGLE_GRADIO_BATCH', '1') == '1'
+MAX_BATCH_SIZE = int(os.environ.get('MOOMINGLE_GRADIO_MAX_BATCH', '16'))
+CONCURRENCY_LIMIT = int(os.environ.get('MOOMINGLE_GRADIO_CONCURRENCY', '2'))  # batches run at once
+QUEUE_SIZE = int(os.environ.get('MOOMINGLE_GRADIO_QUEUE_SIZE', '256'))        # waiting uploads
+
+# Global model state (same loader, warm-up and scorer as api.py)
+models = ModelRegistry(animal_types=ANIMAL_TYPES)
+batch_stats = {'batches': 0, 'images': 0, 'largest': 0}
+_stats_lock = threading.Lock()
 
 def load_model():
-    """Download and load the ONNX model from Hugging Face."""
-    global session, prototypes
-    
+    """Download and load the ONNX model from Hugging Face (once)."""
     print("📥 Downloading model from Hugging Face...")
-    model_path = hf_hub_download("vishnuamar/cattle-breed-classifier", "model.onnx")
-    prototypes_path = hf_hub_download("vishnuamar/cattle-breed-classifier", "prototypes.json")
-    
-    session = ort.InferenceSession(model_path)
-    with open(prototypes_path, 'r') as f:
-        prototypes = json.load(f)
-    
-    print("✅ Model ready!")
+    return models.reload(only_if_empty=True)
 
-def classify_breed(image: Image.Image) -> dict:
+def classify_batch(images: list) -> list:
     """
-    Classify the breed of cattle/buffalo in the image.
-    
+    Classify several images with one model call.
+
     Returns:
-        dict with breed, confidence, animal_type, and all_scores
+        one dict per image with breed, confidence, animal_type, all_scores,
+        margin and status (see scoring.py)
     """
-    global session, prototypes
-    
-    if session is None:
-        load_model()
-    
-    # Preprocess image
-    image = image.convert('RGB')
-    transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    input_data = transform(image).unsqueeze(0).numpy()
-    
-    # Run inference
-    features = session.run(None, {'input': input_data})[0][0]
-    
-    # Calculate similarities with prototypes
-    similarities = {}
-    for breed, prototype in prototypes['prototypes'].items():
-        similarity = float(np.dot(features, np.array(prototype)))
-        similarities[breed] = round(similarity, 4)
-    
-    # Get best match
-    predicted_breed = max(similarities, key=similarities.get)
-    confidence = similarities[predicted_breed]
-    animal_type = 'Buffalo' if predicted_breed in BUFFALO_BREEDS else 'Cattle'
-    
-    return {
-        'breed': predicted_breed,
-        'confidence': confidence,
-        'animal_type': animal_type,
-        'all_scores': similarities
-    }
+    model = models.current() or load_model()
+    if model is None:
+        raise RuntimeError('Model is not available, please try again later')
+
+    features = model.run(preprocessing.to_batch(images))
+    with _stats_lock:
+        batch_stats['batches'] += 1
+        batch_stats['images'] += len(images)
+        batch_stats['largest'] = max(batch_stats['largest'], len(images))
+    return model.scorer.score(features)
+
+def classify_breed(image: Image.Image) -> dict:
+    """Classify the breed of cattle/buffalo in one image."""
+    return classify_batch([image])[0]
+
+def format_result(result: dict) -> str:
+    """Markdown for one classification result."""
+    if result['status'] == 'rejected':
+        return "## 🐄 Classification Result\n\nThis does not look like a cow or buffalo. Please try another photo."
 
-def predict(image):
-    """Gradio interface function."""
-    if image is None:
-        return "Please upload an image"
-    
-    result = classify_breed(image)
-    
-    # Format output for display
     output = f"""
 ## 🐄 Classification Result
 
@@ -95,19 +77,43 @@ def predict(image):
     for breed, score in sorted(result['all_scores'].items(), key=lambda x: -x[1]):
         bar = "█" * int(score * 20) if score > 0 else ""
         output += f"- {breed}: {score:.2%} {bar}\n"
-    
+
     return output
 
+def predict_batch(images: list) -> list:
+    """Batched Gradio function: a list of queued uploads in, one Markdown list out."""
+    present = [i for i, image in enumerate(images) if image is not None]
+    outputs = ["Please upload an image"] * len(images)
+    if present:
+        results = classify_batch([images[i] for i in present])
+        for i, result in zip(present, results):
+            outputs[i] = format_result(result)
+    return [outputs]
+
+def predict(image):
+    """Gradio interface function (unbatched mode)."""
+    return predict_batch([image])[0][0]
+
+def build_demo(batched: bool = BATCHED) -> gr.Interface:
+    """The Gradio interface, with its request queue."""
+    demo = gr.Interface(
+        fn=predict_batch if batched else predict,
+        inputs=gr.Image(type="pil", label="Upload Cattle/Buffalo Image"),
+        outputs=gr.Markdown(label="Classification Result"),
+        title="🐄 Cattle & Buffalo Breed Classifier",
+        description="Upload an image of cattle or buffalo to identify its breed. Supports 10 breeds: Bhadawari, Jaffarbadi, Mehsana, Murrah, Surti (Buffalo) and Gir, Kankrej, Ongole, Sahiwal, Tharparkar (Cattle).",
+        examples=[],
+        flagging_mode="never",
+        batch=batched,
+        max_batch_size=MAX_BATCH_SIZE,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        api_name="predict",  # same endpoint in both modes
+    )
+    # Uploads beyond the queue size are turned away instead of piling up
+    return demo.queue(max_size=QUEUE_SIZE)
+
 # Create Gradio interface
-demo = gr.Interface(
-    fn=predict,
-    inputs=gr.Image(type="pil", label="Upload Cattle/Buffalo Image"),
-    outputs=gr.Markdown(label="Classification Result"),
-    title="🐄 Cattle & Buffalo Breed Classifier",
-    description="Upload an image of cattle or buffalo to identify its breed. Supports 10 breeds: Bhadawari, Jaffarbadi, Mehsana, Murrah, Surti (Buffalo) and Gir, Kankrej, Ongole, Sahiwal, Tharparkar (Cattle).",
-    examples=[],
-    allow_flagging="never",
-)
+demo = build_demo()
 
 if __name__ == "__main__":
     load_model()  # Pre-load for faster first request
@@ -0,0 +1,747 @@
+#!/usr/bin/env python3
+"""
+MooMingle Inference Benchmark Suite
+===================================
+Reproducible, offline benchmarks for the breed classifier / muzzle API.
+
+Synthetic cattle-like images are generated from a fixed seed, and the ONNX
+model is replaced by a deterministic stub session unless a real model is
+given with --model/--prototypes. Results are printed as JSON.
+
+Usage:
+    python benchmark.py                                   # all suites, stub model
+    python benchmark.py --suite classify --suite http     # selected suites
+    python benchmark.py --model model.onnx --prototypes prototypes.json
+    python benchmark.py --output bench.json               # save results
+    python benchmark.py --baseline bench.json             # fail on p95 regressions
+
+Suites:
+    classify   classify_breed() on single images
+    muzzle     extract_muzzle_features() on single images
+    registry   /api/muzzle/verify against registries of different sizes
+    shards     muzzle search scatter-gathered over local shard processes
+               (only when selected)
+    snapshot   registry warm start: snapshot save/mmap load vs rebuilding, and
+               muzzle_prints sync from a local PostgREST stub, paged vs row by row
+               (only when selected)
+    similar    /listings/similar index: filtered IVF scan vs exact scan and vs
+               post-filtering ANN candidates (recall@k, latency; only when selected)
+    store      muzzle store encodings (float32/float16/pq): memory per animal,
+               recall@k and search latency
+    http       /predict and muzzle endpoints over real HTTP with concurrent clients
+    gradio     app.py behind Gradio's queue, unbatched vs batched, with concurrent
+               gradio_client clients (only when selected; needs gradio)
+    yolo       server.py detector: ONNX vs ultralytics startup, RSS and per-image
+               latency (only when selected; needs --yolo-onnx and/or --yolo-weights)
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# api.py downloads the model at import time unless told otherwise
+os.environ.setdefault('MOOMINGLE_PRELOAD_MODEL', '0')
+os.environ.setdefault('MOOMINGLE_RATE_LIMIT', '0')  # the suites drive the API far above any client limit
+
+import api  # noqa: E402
+import postgrest_stub  # noqa: E402
+from model_registry import ModelVersion  # noqa: E402
+from muzzle_shards import ShardedMuzzleStore, launch  # noqa: E402
+from muzzle_snapshot import (  # noqa: E402
+    SYNC_PAGE_SIZE, MuzzlePrintsClient, MuzzleSync, load_snapshot, row_to_record, save_snapshot
+)
+from listing_index import ListingIndex  # noqa: E402
+from muzzle_store import MuzzleStore, normalize  # noqa: E402
+from synthetic import encode_image, synthetic_cattle_image  # noqa: E402
+
+ALL_SUITES = ['classify', 'muzzle', 'registry', 'http', 'store']
+DEFAULT_REGISTRY_SIZES = [100, 1000, 10000]
+DEFAULT_STORE_SIZES = [10000, 100000]
+STORE_CONFIGS = [  # (encoding, keep_float32 for re-ranking)
+    ('float32', True),
+    ('float16', False),
+    ('float16', True),
+    ('pq', False),
+    ('pq', True),
+]
+
+
+# =============================================================================
+# MODEL STUB
+# =============================================================================
+
+class _StubInput:
+    name = 'input'
+    shape = ['batch', 3, 224, 224]
+    type = 'tensor(float)'
+
+
+class StubSession:
+    """
+    Deterministic stand-in for ort.InferenceSession.
+
+    Average-pools the input to 8x8 and projects it onto a fixed random basis,
+    returning L2-normalized embeddings, so similar images give similar
+    vectors. latency_ms adds a fixed per-image delay to emulate model cost,
+    call_latency_ms a per-run() delay (the fixed cost batching amortizes).
+    """
+
+    def __init__(self, dim: int = 512, latency_ms: float = 0.0, seed: int = 0,
+                 call_latency_ms: float = 0.0):
+        rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.call_latency_ms = call_latency_ms
+        self.projection = rng.standard_normal((3 * 8 * 8, dim)).astype(np.float32)
+
+    def get_inputs(self):
+        return [_StubInput()]
+
+    def run(self, output_names, feed):
+        batch = np.asarray(feed['input'], dtype=np.float32)
+        n, c, h, w = batch.shape
+        pooled = batch.reshape(n, c, 8, h // 8, 8, w // 8).mean(axis=(3, 5)).reshape(n, -1)
+        features = pooled @ self.projection
+        features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-12
+        if self.latency_ms or self.call_latency_ms:
+            time.sleep((self.call_latency_ms + self.latency_ms * n) / 1000.0)
+        return [features]
+
+
+def stub_prototypes(dim: int = 512, seed: int = 1) -> dict:
+    """Random unit-vector prototypes for every supported breed."""
+    rng = np.random.default_rng(seed)
+    protos = {}
+    for breed in api.ALL_BREEDS:
+        vector = rng.standard_normal(dim)
+        protos[breed] = (vector / np.linalg.norm(vector)).tolist()
+    return {'prototypes': protos}
+
+
+def install_model(args):
+    """Point the api module at the stub or at a local ONNX model."""
+    if args.model:
+        version = api.models.install(api.models.load_files(args.model, args.prototypes))
+        return {'kind': 'onnx', 'path': args.model, 'version': version.tag}
+
+    api.models.install(ModelVersion(
+        StubSession(dim=args.dim, latency_ms=args.stub_latency_ms,
+                    call_latency_ms=args.stub_call_latency_ms),
+        stub_prototypes(dim=args.dim),
+        model_version=f'stub-{args.dim}',
+        prototypes_version='stub',
+        animal_types=api.ANIMAL_TYPES,
+        source='stub',
+    ))
+    return {'kind': 'stub', 'dim': args.dim, 'latency_ms': args.stub_latency_ms,
+            'call_latency_ms': args.stub_call_latency_ms}
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def rss_mb() -> dict:
+    """Current and peak resident set size of this process, in MB."""
+    current = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak_mb = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    return {
+        'rss_mb': round(current, 1) if current is not None else None,
+        'peak_rss_mb': round(peak_mb, 1),
+    }
+
+
+def summarize(latencies, wall_seconds: float, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (ms) for one measurement."""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if ms.size == 0:
+        return {'count': 0, 'errors': errors}
+    return {
+        'count': int(ms.size),
+        'errors': errors,
+        'throughput_rps': round(ms.size / wall_seconds, 2) if wall_seconds > 0 else None,
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        **rss_mb(),
+    }
+
+
+def measure(fn, inputs, concurrency: int = 1, warmup: int = 3) -> dict:
+    """Call fn on every input (optionally from a thread pool) and summarize."""
+    for item in inputs[:warmup]:
+        fn(item)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(item):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for item in inputs:
+            timed(item)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, inputs))
+    wall = time.perf_counter() - start
+
+    return summarize(latencies, wall, errors)
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+# =============================================================================
+# SUITES
+# =============================================================================
+
+def bench_classify(args, images):
+    log("🐮 classify_breed()")
+    return measure(api.classify_breed, images)
+
+
+def bench_muzzle(args, images):
+    log("👃 extract_muzzle_features()")
+    return measure(api.extract_muzzle_features, images)
+
+
+def _fill_registry(size: int, dim: int, seed: int = 7):
+    """Replace the muzzle database with `size` random registrations."""
+    rng = np.random.default_rng(seed)
+    features = rng.standard_normal((size, dim)).astype(np.float32)
+    features /= np.linalg.norm(features, axis=1, keepdims=True)
+    api.muzzle_store.clear()
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    version = api.muzzle_features_version(api.models.current())
+    for i in range(size):
+        api.muzzle_store.add(
+            f'MZL-BENCH{i:08d}', features[i], version,
+            listing_id=f'listing-{i}',
+            animal_name=f'Bench {i}',
+            registered_at=now,
+            status='verified',
+        )
+
+
+def bench_registry(args, images):
+    client = api.app.test_client()
+    payloads = [{'image': base64.b64encode(encode_image(img)).decode()} for img in images]
+    dim = len(np.ravel(api.extract_muzzle_features(images[0])))
+
+    results = {}
+    for size in args.registry_sizes:
+        log(f"📚 muzzle registry, {size} records")
+        _fill_registry(size, dim)
+
+        def verify(payload):
+            response = client.post('/api/muzzle/verify', json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(response.status_code)
+
+        results[str(size)] = measure(verify, payloads)
+
+    api.muzzle_store.clear()
+    return results
+
+
+def _synthetic_muzzles(size: int, dim: int, queries: int, seed: int = 11):
+    """
+    Clustered unit embeddings (animals of a breed look alike) and queries
+    that are noisy re-captures of registered animals.
+    """
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((64, dim)))
+    animals = normalize(centers[rng.integers(0, 64, size)]
+                        + rng.standard_normal((size, dim)).astype(np.float32) / np.sqrt(dim))
+    picked = rng.choice(size, queries, replace=False)
+    noisy = normalize(animals[picked] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim))
+    return animals, noisy
+
+
+def bench_store(args, images):
+    results = {}
+    k = args.store_k
+    for size in args.store_sizes:
+        animals, queries = _synthetic_muzzles(size, args.dim, args.store_queries)
+        exact = np.argsort(-(queries @ animals.T), axis=1)[:, :k]
+        for encoding, keep_float32 in STORE_CONFIGS:
+            name = f'{encoding}+rerank' if keep_float32 and encoding != 'float32' else encoding
+            log(f"🗜️ muzzle store {name}, {size} animals")
+            store = MuzzleStore(encoding=encoding, keep_float32=keep_float32)
+            for i, vector in enumerate(animals):
+                store.add(str(i), vector, 'bench')
+
+            found = [[int(muzzle_id) for muzzle_id, _ in store.search(q, 'bench', k=k)] for q in queries]
+            summary = measure(lambda q: store.search(q, 'bench', k=k), list(queries))
+            stats = store.stats()
+            summary.update({
+                'bytes_per_animal': stats['bytes_per_record'],
+                # pq below MOOMINGLE_PQ_TRAIN_SIZE animals is still a float32 scan
+                'searched': stats['searched']['bench'],
+                'recall@1': round(float(np.mean([f[:1] == list(e[:1]) for f, e in zip(found, exact)])), 4),
+                f'recall@{k}': round(float(np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)])), 4),
+            })
+            results[f'{name}@{size}'] = summary
+    return results
+
+
+def bench_similar(args, images):
+    """
+    Filtered similar-listing search (buffalo, price <= median, active: about
+    1 in 10 listings) three ways: exact scan of every listing, the IVF index
+    with the filters applied inside the scan, and the IVF index unfiltered
+    with its top 10*k candidates filtered afterwards.
+    """
+    results = {}
+    k = args.store_k
+    rng = np.random.default_rng(args.seed)
+    for size in args.similar_sizes:
+        vectors, queries = _synthetic_muzzles(size, args.dim, args.store_queries)
+        types = rng.choice(['cattle', 'buffalo'], size, p=[0.6, 0.4])
+        prices = rng.integers(10000, 90000, size).astype(np.float32)
+        active = rng.random(size) < 0.8
+        max_price = float(np.median(prices))
+        log(f"🔎 similar listings, {size} listings")
+        index = ListingIndex()
+        for i in range(size):
+            index.upsert(str(i), vectors[i], 'bench', animal_type=types[i], price=float(prices[i]),
+                         active=bool(active[i]))
+        index.maybe_train()
+
+        passes = (types == 'buffalo') & (prices <= max_price) & active
+        stored = vectors.astype(np.float16)
+
+        def exact(q):
+            scores = stored.astype(np.float32) @ q
+            scores[~passes] = -np.inf
+            return np.argsort(-scores)[:k]
+
+        def filtered(q):
+            return index.search(q, k, animal_type='buffalo', max_price=max_price)[0]
+
+        def post_filtered(q):
+            found, _ = index.search(q, 10 * k, active_only=False)
+            return [(i, s) for i, s in found if passes[int(i)]][:k]
+
+        truth = [set(exact(q).tolist()) for q in queries]
+        for name, fn in (('exact', None), ('ivf_filtered', filtered), ('ivf_postfilter', post_filtered)):
+            summary = measure(fn or exact, list(queries))
+            if fn is not None:
+                found = [{int(i) for i, _ in fn(q)} for q in queries]
+                summary[f'recall@{k}'] = round(float(np.mean([len(f & t) / k for f, t in zip(found, truth)])), 4)
+            results[f'{name}@{size}'] = summary
+        results[f'ivf_filtered@{size}']['mean_scanned'] = index.stats()['mean_scanned']
+        results[f'selectivity@{size}'] = round(float(passes.mean()), 4)
+    return results
+
+
+def bench_shards(args, images):
+    """Same registry searched in-process and over 1..N local shard processes."""
+    animals, queries = _synthetic_muzzles(args.shard_registry_size, args.dim, args.store_queries)
+    records = [(f'MZL-{i:08d}', vector, 'bench', {'listing_id': f'listing-{i}'})
+               for i, vector in enumerate(animals)]
+    results = {}
+
+    log(f"🧩 in-process store, {len(records)} animals")
+    local = MuzzleStore()
+    local.add_many(records)
+    for concurrency in args.concurrency:
+        results[f'local@{concurrency}'] = measure(lambda q: local.search(q, 'bench', k=10),
+                                                  list(queries), concurrency)
+
+    for count in args.shard_counts:
+        log(f"🧩 {count} shard processes, {len(records)} animals")
+        processes, urls = launch(count, args.shard_base_port)
+        try:
+            store = ShardedMuzzleStore(urls)
+            store.add_many(records)
+            for concurrency in args.concurrency:
+                results[f'shards{count}@{concurrency}'] = measure(
+                    lambda q: store.search(q, 'bench', k=10), list(queries), concurrency)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+    return results
+
+
+def bench_snapshot(args, images):
+    """Time to a searchable registry: rebuild vs snapshot vs pulling muzzle_prints."""
+    size = args.snapshot_size
+    animals, queries = _synthetic_muzzles(size, args.dim, 1)
+    records = [(f'MZL-{i:08d}', vector, 'bench', {'listing_id': f'listing-{i}', 'animal_name': f'Animal {i}'})
+               for i, vector in enumerate(animals)]
+    path = os.path.join(os.environ.get('TMPDIR', '/tmp'), f'moomingle-bench-{os.getpid()}.snap')
+    results = {'records': size, 'dim': args.dim}
+    try:
+        log(f"📦 snapshot of {size} animals")
+        start = time.perf_counter()
+        store = MuzzleStore()
+        store.add_many(records)
+        results['rebuild_s'] = round(time.perf_counter() - start, 3)
+
+        start = time.perf_counter()
+        results['snapshot_bytes'] = save_snapshot(store, path)
+        results['save_s'] = round(time.perf_counter() - start, 3)
+
+        start = time.perf_counter()
+        restored = MuzzleStore()
+        load_snapshot(restored, path)
+        results['load_s'] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        restored.search(queries[0], 'bench')
+        results['first_search_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    log(f"📦 muzzle_prints sync, {size} rows, {args.snapshot_latency_ms}ms per request")
+    stub = postgrest_stub.start(latency_ms=args.snapshot_latency_ms)
+    try:
+        postgrest_stub.seed_muzzle_prints(stub, size, args.dim)
+        client = MuzzlePrintsClient(stub.url, 'bench')
+        start = time.perf_counter()
+        synced = MuzzleSync(MuzzleStore(), client).sync_once()
+        elapsed = time.perf_counter() - start
+        results['sync_paged'] = {'page_size': SYNC_PAGE_SIZE, 'rows_per_s': round(synced / elapsed, 1),
+                                 'total_s': round(elapsed, 3)}
+
+        # One request per row (the naive loader): sampled, then extrapolated
+        sample = min(size, 200)
+        naive = MuzzleStore()
+        start = time.perf_counter()
+        for (rows, _), _ in zip(client.pages(None, limit=1), range(sample)):
+            naive.add_many(row_to_record(row) for row in rows)
+        elapsed = time.perf_counter() - start
+        results['sync_row_by_row'] = {'rows_per_s': round(sample / elapsed, 1),
+                                      'estimated_total_s': round(elapsed * size / sample, 2)}
+    finally:
+        stub.shutdown()
+    return results
+
+
+def _multipart(field: str, filename: str, content: bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def _post(url: str, body: bytes, content_type: str):
+    req = urllib.request.Request(url, data=body, method='POST',
+                                 headers={'Content-Type': content_type})
+    with urllib.request.urlopen(req, timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def bench_http(args, images):
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    jpegs = [encode_image(img) for img in images]
+    _fill_registry(args.http_registry_size,
+                   len(np.ravel(api.extract_muzzle_features(images[0]))))
+
+    def predict(jpeg):
+        body, content_type = _multipart('file', 'cow.jpg', jpeg)
+        _post(f'{base_url}/predict', body, content_type)
+
+    def verify(jpeg):
+        body = json.dumps({'image': base64.b64encode(jpeg).decode()}).encode()
+        _post(f'{base_url}/api/muzzle/verify', body, 'application/json')
+
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            log(f"🌐 HTTP load, {concurrency} concurrent clients")
+            results[f'predict@{concurrency}'] = measure(predict, jpegs, concurrency)
+            results[f'verify@{concurrency}'] = measure(verify, jpegs, concurrency)
+    finally:
+        server.shutdown()
+        api.muzzle_store.clear()
+    return results
+
+
+# One simulated user per process, so client-side work does not share the
+# server's GIL: a warm-up call, then every image once. Prints its timings.
+GRADIO_CLIENT = """
+import json, sys, time
+from gradio_client import Client
+try:
+    from gradio_client import handle_file
+except ImportError:  # gradio_client < 1.0 takes plain paths
+    handle_file = str
+client = Client(sys.argv[1], verbose=False)
+client.predict(handle_file(sys.argv[2]), api_name='/predict')
+latencies, errors, start = [], 0, time.time()
+for path in sys.argv[2:]:
+    began = time.perf_counter()
+    try:
+        client.predict(handle_file(path), api_name='/predict')
+    except Exception:
+        errors += 1
+        continue
+    latencies.append(time.perf_counter() - began)
+print(json.dumps({'latencies': latencies, 'errors': errors, 'start': start, 'end': time.time()}))
+"""
+
+
+def bench_gradio(args, images):
+    """The Space demo under load: one event per upload vs queue batching."""
+    try:
+        import app
+    except ImportError:
+        log("⚠️ gradio suite skipped: pip install gradio")
+        return {}
+
+    import tempfile
+    app.models.install(api.models.current())
+    workdir = tempfile.mkdtemp(prefix='moomingle-gradio-')
+    paths = []
+    for i, image in enumerate(images):
+        paths.append(os.path.join(workdir, f'cow-{i}.jpg'))
+        with open(paths[-1], 'wb') as f:
+            f.write(encode_image(image))
+
+    results = {}
+    for batched in (False, True):
+        mode = 'batched' if batched else 'unbatched'
+        demo = app.build_demo(batched)
+        demo.launch(prevent_thread_lock=True, quiet=True)
+        try:
+            for clients in args.gradio_clients:
+                log(f"🎛️  Gradio {mode}, {clients} concurrent clients x {len(paths)} uploads")
+                app.batch_stats.update(batches=0, images=0, largest=0)
+                procs = [subprocess.Popen([sys.executable, '-c', GRADIO_CLIENT, demo.local_url, *paths],
+                                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                         for _ in range(clients)]
+                runs = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+                wall = max(r['end'] for r in runs) - min(r['start'] for r in runs)
+                summary = summarize([t for r in runs for t in r['latencies']], wall,
+                                    sum(r['errors'] for r in runs))
+                stats = dict(app.batch_stats)
+                summary['mean_batch'] = round(stats['images'] / max(stats['batches'], 1), 2)
+                summary['largest_batch'] = stats['largest']
+                results[f'{mode}@{clients}'] = summary
+        finally:
+            demo.close()
+    return results
+
+
+def bench_yolo(args, images):
+    """Each backend in a fresh process, so startup time and RSS are comparable."""
+    backends = [('onnx', args.yolo_onnx), ('ultralytics', args.yolo_weights)]
+    results = {}
+    for backend, model in backends:
+        if not model:
+            continue
+        log(f"🎯 YOLO {backend} ({model})")
+        output = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yolo_onnx.py'),
+             'bench', '--backend', backend, '--model', model,
+             '--images', str(len(images)), '--seed', str(args.seed)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results[backend] = json.loads(output.strip().splitlines()[-1])
+    if not results:
+        log("⚠️ yolo suite skipped: pass --yolo-onnx and/or --yolo-weights")
+    return results
+
+
+SUITES = {
+    'classify': bench_classify,
+    'muzzle': bench_muzzle,
+    'registry': bench_registry,
+    'http': bench_http,
+    'store': bench_store,
+    'similar': bench_similar,
+    'shards': bench_shards,
+    'snapshot': bench_snapshot,
+    'gradio': bench_gradio,
+    'yolo': bench_yolo,
+}
+
+
+# =============================================================================
+# REGRESSION CHECK
+# =============================================================================
+
+def _flatten(results: dict, prefix: str = ''):
+    """Yield (name, summary) for every leaf measurement in a results tree."""
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict) and 'p95_ms' in value:
+            yield name, value
+        elif isinstance(value, dict):
+            yield from _flatten(value, f'{name}.')
+
+
+def compare_to_baseline(results: dict, baseline: dict, max_regression: float):
+    """Return a list of measurements whose p95 got worse than allowed."""
+    previous = dict(_flatten(baseline.get('suites', {})))
+    regressions = []
+    for name, current in _flatten(results['suites']):
+        before = previous.get(name)
+        if not before or not before.get('p95_ms'):
+            continue
+        ratio = current['p95_ms'] / before['p95_ms']
+        if ratio > 1 + max_regression:
+            regressions.append({
+                'measurement': name,
+                'baseline_p95_ms': before['p95_ms'],
+                'current_p95_ms': current['p95_ms'],
+                'ratio': round(ratio, 3),
+            })
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# =============================================================================
+# CLI ENTRY POINT
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the MooMingle inference service',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--suite', action='append', choices=list(SUITES),
+                        help='Suite to run (repeatable, default: all)')
+    parser.add_argument('--images', type=int, default=50,
+                        help='Number of synthetic images per measurement')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--model', help='Local ONNX model (default: stub session)')
+    parser.add_argument('--prototypes', help='prototypes.json for --model')
+    parser.add_argument('--dim', type=int, default=512, help='Stub embedding size')
+    parser.add_argument('--stub-latency-ms', type=float, default=0.0,
+                        help='Per-image delay added by the stub session')
+    parser.add_argument('--stub-call-latency-ms', type=float, default=0.0,
+                        help='Per-call delay added by the stub session (fixed cost of one run())')
+    parser.add_argument('--registry-sizes', type=int, nargs='+',
+                        default=DEFAULT_REGISTRY_SIZES)
+    parser.add_argument('--http-registry-size', type=int, default=1000)
+    parser.add_argument('--store-sizes', type=int, nargs='+', default=DEFAULT_STORE_SIZES)
+    parser.add_argument('--store-k', type=int, default=10, help='k for recall@k in the store suite')
+    parser.add_argument('--store-queries', type=int, default=200)
+    parser.add_argument('--similar-sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--shard-counts', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shard-registry-size', type=int, default=20000)
+    parser.add_argument('--shard-base-port', type=int, default=7301)
+    parser.add_argument('--snapshot-size', type=int, default=20000)
+    parser.add_argument('--snapshot-latency-ms', type=float, default=5.0,
+                        help='Simulated PostgREST round trip for the snapshot suite')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--gradio-clients', type=int, nargs='+', default=[1, 8, 32],
+                        help='Concurrent clients for the gradio suite')
+    parser.add_argument('--embedding-cache', action='store_true',
+                        help='Keep the per-image embedding cache on (measures cache hits)')
+    parser.add_argument('--yolo-onnx', help='Exported YOLO .onnx for the yolo suite')
+    parser.add_argument('--yolo-weights', help='YOLO .pt weights for the yolo suite')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--baseline', help='Previous results to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed p95 slowdown vs. baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    if args.model and not args.prototypes:
+        parser.error('--model requires --prototypes')
+
+    model_info = install_model(args)
+    if not args.embedding_cache:
+        # Synthetic images repeat across measurements; measure real inference
+        api.embedding_cache.max_size = 0
+    log(f"🖼️  Generating {args.images} synthetic images (seed {args.seed})...")
+    images = [synthetic_cattle_image(args.seed + i) for i in range(args.images)]
+
+    results = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'images': args.images,
+            'seed': args.seed,
+            'model': model_info,
+        },
+        'suites': {},
+    }
+
+    for name in args.suite or ALL_SUITES:
+        results['suites'][name] = SUITES[name](args, images)
+
+    results['meta'].update(rss_mb())
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.max_regression)
+        results['regressions'] = regressions
+        if regressions:
+            log(f"❌ {len(regressions)} p95 regressions vs {args.baseline}")
+            exit_code = 1
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"✅ Results written to {args.output}")
+    print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Detect-then-crop cascade for muzzle embeddings.
+
+Stage 1 runs a YOLO detector exported to ONNX (the same kind of model that
+server.py serves, through yolo_onnx.OnnxYolo) on a batch of photos and
+picks one region per photo:
+
+- muzzle: a box of a 'muzzle'/'nose' class, if the detector has one
+- animal: otherwise the best 'cow' box (COCO detectors see buffaloes as cows)
+- full:   nothing useful found, or the box already fills the photo
+
+Stage 2 crops that region from the original image at native resolution
+(square, with a margin) so the 224x224 embedding input is spent on the
+animal instead of the background. Crop boxes are cached per image hash, so
+repeated calls with the same photo skip detection.
+
+Enabled by pointing MOOMINGLE_DETECTOR_ONNX at an exported detector.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+from embeddings import EmbeddingCache
+from model_registry import file_digest
+
+DETECTOR_PATH = os.environ.get('MOOMINGLE_DETECTOR_ONNX')
+ANIMAL_CLASSES = set(os.environ.get('MOOMINGLE_ANIMAL_CLASSES', 'cow').split(','))
+MUZZLE_CLASSES = set(os.environ.get('MOOMINGLE_MUZZLE_CLASSES', 'muzzle,nose').split(','))
+DETECTOR_CONF = float(os.environ.get('MOOMINGLE_DETECTOR_CONF', '0.25'))
+CROP_MARGIN = float(os.environ.get('MOOMINGLE_CROP_MARGIN', '0.1'))
+CROP_CACHE_SIZE = int(os.environ.get('MOOMINGLE_CROP_CACHE_SIZE', '4096'))
+MAX_CROP_AREA = 0.9  # Boxes covering more of the photo than this are not worth cropping
+MIN_CROP_PIXELS = 64
+
+REGIONS = ('full', 'animal', 'muzzle')
+
+
+def square_box(box, image_size, margin: float = CROP_MARGIN):
+    """Grow a box by `margin`, make it square and clamp it to the image."""
+    width, height = image_size
+    x1, y1, x2, y2 = box
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * margin)
+    side = min(max(side, MIN_CROP_PIXELS), width, height)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left = min(max(cx - side / 2, 0), width - side)
+    top = min(max(cy - side / 2, 0), height - side)
+    return int(left), int(top), int(left + side), int(top + side)
+
+
+class CropCascade:
+    """Batched detector + per-image-hash cache of crop boxes."""
+
+    def __init__(self, detector, version: str, cache_size: int = CROP_CACHE_SIZE):
+        self.detector = detector
+        self.version = version
+        self.boxes = EmbeddingCache(cache_size)
+        self.detected = 0
+
+    @classmethod
+    def from_env(cls):
+        """The cascade configured by MOOMINGLE_DETECTOR_ONNX, or None."""
+        if not DETECTOR_PATH:
+            return None
+        try:
+            from yolo_onnx import OnnxYolo
+            cascade = cls(OnnxYolo(DETECTOR_PATH), version=file_digest(DETECTOR_PATH)[:12])
+        except Exception as e:
+            print(f"⚠️ Crop detector unavailable, using full images: {e}")
+            return None
+        print(f"✂️ Crop cascade enabled ({DETECTOR_PATH}, {cascade.version})")
+        return cascade
+
+    def pick_region(self, detections: list, image_size):
+        """(region, box) for one image from its ranked detections."""
+        for classes, region in ((MUZZLE_CLASSES, 'muzzle'), (ANIMAL_CLASSES, 'animal')):
+            best = next((d for d in detections if d['name'] in classes), None)
+            if best is None:
+                continue
+            x1, y1, x2, y2 = best['box']
+            if (x2 - x1) * (y2 - y1) >= MAX_CROP_AREA * image_size[0] * image_size[1]:
+                return 'full', None
+            return region, (x1, y1, x2, y2)
+        return 'full', None
+
+    def locate(self, images, keys) -> list:
+        """
+        (region, box) for every image. Cached boxes are reused; all misses go
+        through the detector in one batch.
+        """
+        located = [None] * len(images)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.boxes.get(key, self.version)
+            if cached is None:
+                missing.append(i)
+            else:
+                region = REGIONS[int(cached[4])]
+                located[i] = (region, tuple(cached[:4]) if region != 'full' else None)
+
+        if missing:
+            detections = self.detector.predict([images[i] for i in missing],
+                                               conf_threshold=DETECTOR_CONF)
+            self.detected += len(missing)
+            for i, found in zip(missing, detections):
+                region, box = self.pick_region(found, images[i].size)
+                located[i] = (region, box)
+                self.boxes.put(keys[i], self.version,
+                               np.array([*(box or (0, 0, 0, 0)), REGIONS.index(region)]))
+        return located
+
+    def crop(self, images, keys) -> list:
+        """Crop every image to its region. Returns [(image, region), ...]."""
+        crops = []
+        for image, (region, box) in zip(images, self.locate(images, keys)):
+            if box is None:
+                crops.append((image, region))
+            else:
+                crops.append((image.crop(square_box(box, image.size)), region))
+        return crops
+
+    def stats(self) -> dict:
+        return {'version': self.version, 'detected': self.detected, 'box_cache': self.boxes.stats()}
@@ -0,0 +1,148 @@
+"""
+Persistent embeddings: (image hash, model version) -> float32 vector in SQLite.
+
+The in-memory EmbeddingCache (embeddings.py) reads through to this store
+on a miss. It is filled ahead of time by the import precompute stage
+(data_import/precompute.py embeds the photos of imported listings) and by
+the listing index sync, so the first classification or similarity lookup
+of a listing photo skips inference, also after a restart. The file can be
+shared by all gunicorn workers (WAL, one connection per thread).
+
+Usage:
+    python embedding_store.py info embeddings.sqlite3
+    python embedding_store.py prune embeddings.sqlite3 --keep 3f1c9a0b7d2e
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_STORE = os.environ.get('MOOMINGLE_EMBEDDING_STORE')
+_MAX_VARIABLES = 500    # keys per IN (...) query, under SQLite's parameter limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    image_hash TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    embedding BLOB NOT NULL,        -- little-endian float32
+    created_at REAL NOT NULL,
+    PRIMARY KEY (image_hash, model_version)
+) WITHOUT ROWID;
+"""
+
+
+class EmbeddingStore:
+    """Embeddings in SQLite (WAL), one connection per thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.errors = 0
+        self.last_error = None
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._ready = False
+
+    @classmethod
+    def from_env(cls):
+        """Store at MOOMINGLE_EMBEDDING_STORE, or None when it is not set."""
+        return cls(EMBEDDING_STORE) if EMBEDDING_STORE else None
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._ready:
+                    db.executescript(SCHEMA)
+                    self._ready = True
+            self._local.db = db
+        return db
+
+    def get(self, key: str, model_version: str):
+        """The stored embedding, or None (also when the store cannot be read)."""
+        try:
+            row = self._db().execute('SELECT embedding FROM embeddings WHERE image_hash = ? AND model_version = ?',
+                                     (key, model_version)).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            self.last_error = str(e)
+            return None
+        return np.frombuffer(row[0], dtype='<f4') if row else None
+
+    def get_many(self, keys: list, model_version: str) -> dict:
+        """{image hash: embedding} of the keys that are stored."""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        db = self._db()
+        for start in range(0, len(keys), _MAX_VARIABLES):
+            chunk = keys[start:start + _MAX_VARIABLES]
+            rows = db.execute(f'SELECT image_hash, embedding FROM embeddings WHERE model_version = ? '
+                              f'AND image_hash IN ({",".join("?" * len(chunk))})', [model_version, *chunk])
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype='<f4')
+        return found
+
+    def put_many(self, items: list, model_version: str) -> int:
+        """Store (image hash, embedding) pairs in one transaction. Returns how many."""
+        now = time.time()
+        rows = [(key, model_version, np.ascontiguousarray(np.ravel(features), dtype='<f4').tobytes(), now)
+                for key, features in items]
+        if not rows:
+            return 0
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('INSERT OR REPLACE INTO embeddings (image_hash, model_version, embedding, created_at) '
+                           'VALUES (?, ?, ?, ?)', rows)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def versions(self) -> dict:
+        """{model version: stored embeddings}"""
+        rows = self._db().execute('SELECT model_version, COUNT(*) FROM embeddings GROUP BY model_version')
+        return dict(rows.fetchall())
+
+    def drop_other_versions(self, keep: list) -> int:
+        """Delete the embeddings of every model version not in `keep`. Returns how many."""
+        db = self._db()
+        cursor = db.execute(f'DELETE FROM embeddings WHERE model_version NOT IN ({",".join("?" * len(keep))})',
+                            list(keep))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        return {'path': self.path, 'errors': self.errors, 'last_error': self.last_error}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or prune a persistent embedding store')
+    parser.add_argument('command', choices=['info', 'prune'])
+    parser.add_argument('path', nargs='?', default=EMBEDDING_STORE)
+    parser.add_argument('--keep', nargs='+', default=[], help='Model versions kept by prune')
+    args = parser.parse_args(argv)
+    if not args.path or not os.path.exists(args.path):
+        parser.error(f'No embedding store at {args.path!r}')
+    if args.command == 'prune' and not args.keep:
+        parser.error('prune needs --keep <model_version> ...')
+
+    store = EmbeddingStore(args.path)
+    if args.command == 'prune':
+        print(f"🧹 Dropped {store.drop_other_versions(args.keep)} embeddings")
+    versions = store.versions()
+    print(f"📦 {args.path}: {sum(versions.values())} embeddings, {os.path.getsize(args.path) / 2**20:.1f} MB")
+    for version, count in sorted(versions.items()):
+        print(f"   {version}: {count}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
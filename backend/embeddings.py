@@ -0,0 +1,148 @@
+"""
+Embedding helpers for the MooMingle backend.
+
+- Compact wire format for feature vectors (float16/float32, raw or base64)
+- Thread-safe LRU cache of embeddings keyed by image hash + model version,
+  so one inference can serve classify, register and verify calls. It can
+  read through to a persistent EmbeddingStore (embedding_store.py).
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SUPPORTED_DTYPES = {
+    'float16': np.dtype('<f2'),
+    'float32': np.dtype('<f4'),
+}
+DEFAULT_DTYPE = 'float16'
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get('MOOMINGLE_EMBEDDING_CACHE_SIZE', '1024'))
+
+
+class EmbeddingError(ValueError):
+    """A client-supplied embedding could not be used."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def image_hash(image_bytes: bytes) -> str:
+    """Content hash used as cache key for uploaded images."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def encode_embedding(features: np.ndarray, dtype: str = DEFAULT_DTYPE) -> bytes:
+    """Serialize a feature vector as little-endian float16/float32 bytes."""
+    if dtype not in SUPPORTED_DTYPES:
+        raise EmbeddingError(f"Unsupported dtype '{dtype}'. Use one of: {', '.join(SUPPORTED_DTYPES)}")
+    return np.ascontiguousarray(np.ravel(features), dtype=SUPPORTED_DTYPES[dtype]).tobytes()
+
+
+def decode_embedding(data, dtype: str = DEFAULT_DTYPE, expected_dim: int = None) -> np.ndarray:
+    """
+    Parse an embedding sent by a client: raw bytes, a base64 string or a
+    plain list of numbers. Returns a float32 vector.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise EmbeddingError(f"Unsupported dtype '{dtype}'. Use one of: {', '.join(SUPPORTED_DTYPES)}")
+
+    if isinstance(data, (list, tuple)):
+        features = np.asarray(data, dtype=np.float32)
+    else:
+        if isinstance(data, str):
+            try:
+                data = base64.b64decode(data, validate=True)
+            except (binascii.Error, ValueError):
+                raise EmbeddingError('Embedding is not valid base64')
+        itemsize = SUPPORTED_DTYPES[dtype].itemsize
+        if len(data) == 0 or len(data) % itemsize:
+            raise EmbeddingError(f'Embedding byte length {len(data)} is not a multiple of {itemsize} ({dtype})')
+        features = np.frombuffer(data, dtype=SUPPORTED_DTYPES[dtype]).astype(np.float32)
+
+    if features.ndim != 1:
+        raise EmbeddingError('Embedding must be a flat vector')
+    if expected_dim is not None and features.shape[0] != expected_dim:
+        raise EmbeddingError(f'Embedding has {features.shape[0]} dimensions, expected {expected_dim}')
+    if not np.all(np.isfinite(features)):
+        raise EmbeddingError('Embedding contains NaN or infinite values')
+    return features
+
+
+class EmbeddingCache:
+    """
+    LRU cache of (image hash, model version) -> float32 embedding. Misses
+    are looked up in `store` (an EmbeddingStore) when one is given.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, store=None):
+        self.max_size = max_size
+        self.store = store
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get(self, key: str, model_version: str):
+        with self._lock:
+            features = self._items.get((key, model_version))
+            if features is not None:
+                self._items.move_to_end((key, model_version))
+                self.hits += 1
+                return features
+            if self.store is None:
+                self.misses += 1
+                return None
+        features = self.store.get(key, model_version)
+        if features is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        self.put(key, model_version, features)
+        with self._lock:
+            self.hits += 1
+            self.store_hits += 1
+        return features
+
+    def put(self, key: str, model_version: str, features: np.ndarray):
+        if self.max_size <= 0:
+            return
+        features = np.array(features, dtype=np.float32)
+        features.setflags(write=False)
+        with self._lock:
+            self._items[(key, model_version)] = features
+            self._items.move_to_end((key, model_version))
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def drop_version(self, model_version: str) -> int:
+        """Forget all embeddings of one model version. Returns how many were dropped."""
+        with self._lock:
+            stale = [key for key in self._items if key[1] == model_version]
+            for key in stale:
+                del self._items[key]
+            return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'store': self.store.stats() if self.store is not None else None,
+            }
@@ -0,0 +1,101 @@
+"""
+Frame quality scoring for burst / clip muzzle captures.
+
+A moving animal gives many blurred or badly exposed frames. Every frame of
+a burst is scored cheaply, without the embedding model, on a small
+grayscale copy; all frames are scored together as one N x S x S array:
+
+- sharpness: variance of the Laplacian (blur removes high frequencies)
+- exposure:  how far mean brightness is from mid-grey, and how many pixels
+             are clipped to black or white
+- region:    how much of the frame the detected muzzle/animal covers (only
+             with the crop cascade; see cascade.py)
+
+Only the best few frames are embedded, as one batch. aggregate() then
+merges their embeddings into a single template.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+SCORE_SIZE = 160  # Frames are scored at this size (square, grayscale)
+MAX_FRAMES = int(os.environ.get('MOOMINGLE_BURST_MAX_FRAMES', '32'))
+TOP_FRAMES = int(os.environ.get('MOOMINGLE_BURST_TOP_FRAMES', '3'))
+MIN_AGREEMENT = float(os.environ.get('MOOMINGLE_BURST_MIN_AGREEMENT', '0.8'))
+CLIPPED_LOW, CLIPPED_HIGH = 8 / 255, 247 / 255
+REGION_WEIGHTS = {'muzzle': 1.0, 'animal': 0.8, 'full': 0.5}
+
+
+def clip_frames(image: Image.Image, max_frames: int = MAX_FRAMES) -> list:
+    """
+    Frames of an animated image (GIF, WebP, APNG, multi-page TIFF), evenly
+    sampled down to max_frames. A still image gives one frame.
+    """
+    count = getattr(image, 'n_frames', 1)
+    wanted = set(np.linspace(0, count - 1, min(count, max_frames)).round().astype(int).tolist())
+    return [frame.convert('RGB') for i, frame in enumerate(ImageSequence.Iterator(image)) if i in wanted]
+
+
+def gray_stack(images: list, size: int = SCORE_SIZE) -> np.ndarray:
+    """N x size x size grayscale frames in [0, 1]."""
+    stack = np.empty((len(images), size, size), dtype=np.float32)
+    for i, image in enumerate(images):
+        small = image.convert('L').resize((size, size), Image.BILINEAR)
+        stack[i] = np.asarray(small, dtype=np.float32)
+    return stack / 255.0
+
+
+def sharpness(stack: np.ndarray) -> np.ndarray:
+    """Variance of the 4-neighbour Laplacian of every frame."""
+    laplacian = (4 * stack[:, 1:-1, 1:-1] - stack[:, :-2, 1:-1] - stack[:, 2:, 1:-1]
+                 - stack[:, 1:-1, :-2] - stack[:, 1:-1, 2:])
+    return laplacian.reshape(len(stack), -1).var(axis=1)
+
+
+def exposure(stack: np.ndarray) -> np.ndarray:
+    """1.0 for a well exposed frame, towards 0 for dark, blown-out or clipped ones."""
+    pixels = stack.reshape(len(stack), -1)
+    balance = 1 - 2 * np.abs(pixels.mean(axis=1) - 0.5)
+    clipped = ((pixels <= CLIPPED_LOW) | (pixels >= CLIPPED_HIGH)).mean(axis=1)
+    return np.clip(balance, 0, 1) * (1 - clipped)
+
+
+def image_quality(images: list) -> dict:
+    """Sharpness, exposure and their combined score (0..1, relative to the burst)."""
+    stack = gray_stack(images)
+    sharp = sharpness(stack)
+    expo = exposure(stack)
+    relative = np.sqrt(sharp / max(float(sharp.max()), 1e-12))
+    return {'sharpness': sharp, 'exposure': expo, 'score': relative * expo}
+
+
+def region_weight(located: list, sizes: list) -> np.ndarray:
+    """Weight per frame from its detected (region, box): muzzle > animal > nothing,
+    scaled up with the share of the frame the box covers."""
+    weights = np.empty(len(located), dtype=np.float32)
+    for i, ((region, box), (width, height)) in enumerate(zip(located, sizes)):
+        coverage = 1.0
+        if box is not None:
+            area = (box[2] - box[0]) * (box[3] - box[1]) / (width * height)
+            coverage = min(1.0, 0.5 + np.sqrt(max(area, 0.0)))
+        weights[i] = REGION_WEIGHTS[region] * coverage
+    return weights
+
+
+def aggregate(embeddings, weights=None, min_agreement: float = MIN_AGREEMENT) -> tuple:
+    """
+    One template from several embeddings of the same animal: the weighted
+    mean direction of the frames that agree with the medoid (the frame most
+    similar to all others). A frame of the wrong animal or a bad crop is
+    left out instead of dragging the template off. Returns (template, kept indices).
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    weights = np.ones(len(vectors), dtype=np.float32) if weights is None else np.asarray(weights, np.float32)
+    similarity = vectors @ vectors.T
+    medoid = int(similarity.sum(axis=1).argmax())
+    kept = np.flatnonzero(similarity[medoid] >= min_agreement)
+    template = (vectors[kept] * np.maximum(weights[kept], 1e-6)[:, None]).sum(axis=0)
+    return template / max(float(np.linalg.norm(template)), 1e-12), kept.tolist()
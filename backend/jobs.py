@@ -0,0 +1,463 @@
+"""
+Bulk jobs: persistent queue + worker pool for large classification and
+muzzle registration workloads.
+
+A job is a list of images (uploaded files, a zip/tar archive or base64 JSON)
+stored in a local SQLite database, so a restart resumes where it stopped.
+Worker threads claim items in batches of MOOMINGLE_JOB_BATCH, hand each
+batch to the handler for the job kind (one model batch per claim; see
+api.py) and record one JSON result per item.
+
+Interactive requests come first: api.py marks /predict, /embed and the
+muzzle endpoints on the InteractiveGate, and workers only claim the next
+batch once no interactive request is in flight (or after waiting
+MOOMINGLE_JOB_YIELD_MS, so bulk work is never starved). Claims are leases:
+items of a worker that died are claimed again after MOOMINGLE_JOB_LEASE_S,
+which also makes the queue safe to share between gunicorn workers.
+"""
+
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+JOBS_DB = os.environ.get('MOOMINGLE_JOBS_DB', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('MOOMINGLE_JOB_WORKERS', '1'))
+JOB_BATCH_SIZE = int(os.environ.get('MOOMINGLE_JOB_BATCH', '16'))
+JOB_MAX_ITEMS = int(os.environ.get('MOOMINGLE_JOB_MAX_ITEMS', '10000'))
+# Archives are unpacked in memory: cap each member and the total as stored
+# in the archive headers, so a small zip bomb is refused before it inflates
+ARCHIVE_MAX_FILE_BYTES = int(float(os.environ.get('MOOMINGLE_ARCHIVE_MAX_FILE_MB', '32')) * 2 ** 20)
+ARCHIVE_MAX_BYTES = int(float(os.environ.get('MOOMINGLE_ARCHIVE_MAX_MB', '1024')) * 2 ** 20)
+JOB_YIELD_S = float(os.environ.get('MOOMINGLE_JOB_YIELD_MS', '2000')) / 1000
+JOB_LEASE_S = float(os.environ.get('MOOMINGLE_JOB_LEASE_S', '600'))
+JOB_RETENTION_S = float(os.environ.get('MOOMINGLE_JOB_RETENTION_HOURS', '72')) * 3600
+POLL_S = 1.0
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+MANIFEST = 'manifest.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,           -- queued | running | done | cancelled
+    options TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    meta TEXT,
+    payload BLOB,                   -- dropped once the item is processed
+    status TEXT NOT NULL,           -- pending | running | done | failed | cancelled
+    claimed_at REAL,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_job_items_pending ON job_items(status, job_id, idx);
+"""
+
+
+class JobError(Exception):
+    """A job submission that cannot be accepted (bad archive, too many items...)."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class RetryLater(Exception):
+    """Raised by a handler when the batch cannot run now (e.g. no model yet)."""
+
+
+# =============================================================================
+# SUBMISSIONS
+# =============================================================================
+
+def archive_items(data: bytes, filename: str = '') -> tuple:
+    """
+    Images of a zip or tar(.gz) archive, in name order, and its optional
+    manifest.json ({file name: {listing_id, animal_name, region}}).
+    Members are checked against JOB_MAX_ITEMS, ARCHIVE_MAX_FILE_BYTES and
+    ARCHIVE_MAX_BYTES by their declared sizes before any is read (zipfile
+    never inflates a member past its declared size).
+    Returns ([(name, bytes), ...], manifest).
+    """
+    files = {}
+    try:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = [(info, info.filename, info.file_size) for info in archive.infolist()
+                           if not info.is_dir() and _wanted(info.filename)]
+                _check_members(members, filename)
+                for info, name, _ in members:
+                    files[name] = archive.read(info)
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                members = [(member, member.name, member.size) for member in archive.getmembers()
+                           if member.isfile() and _wanted(member.name)]
+                _check_members(members, filename)
+                for member, name, _ in members:
+                    files[name] = archive.extractfile(member).read()
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise JobError(f"Unreadable archive {filename}: {e}")
+
+    manifest = {}
+    for name in [n for n in files if os.path.basename(n) == MANIFEST]:
+        try:
+            manifest.update(json.loads(files.pop(name)))
+        except ValueError as e:
+            raise JobError(f"Invalid {MANIFEST}: {e}")
+    images = sorted((name, content) for name, content in files.items()
+                    if name.lower().endswith(IMAGE_EXTENSIONS))
+    return images, manifest
+
+
+def _check_members(members: list, filename: str):
+    """Refuse (413) an archive with too many, too large or too much content."""
+    images = sum(os.path.basename(name) != MANIFEST for _, name, _ in members)
+    if images > JOB_MAX_ITEMS:
+        raise JobError(f'Too many images in {filename} ({images}), the limit is {JOB_MAX_ITEMS}', 413)
+    for _, name, size in members:
+        if size > ARCHIVE_MAX_FILE_BYTES:
+            raise JobError(f'{name} in {filename} is {size} bytes uncompressed, '
+                           f'the limit is {ARCHIVE_MAX_FILE_BYTES}', 413)
+    total = sum(size for _, _, size in members)
+    if total > ARCHIVE_MAX_BYTES:
+        raise JobError(f'{filename} is {total} bytes uncompressed, the limit is {ARCHIVE_MAX_BYTES}', 413)
+
+
+def _wanted(name: str) -> bool:
+    base = os.path.basename(name)
+    return bool(base) and not base.startswith('.') and '__MACOSX' not in name \
+        and (base == MANIFEST or name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+# =============================================================================
+# QUEUE
+# =============================================================================
+
+class JobStore:
+    """Jobs and their items in SQLite (WAL), one connection per thread."""
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._ready = False
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._ready:
+                    db.executescript(SCHEMA)
+                    self._ready = True
+            self._local.db = db
+        return db
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def create(self, kind: str, items: list, options: dict = None) -> dict:
+        """Queue a job of (name, payload bytes, meta dict) items."""
+        if not items:
+            raise JobError('The job has no images')
+        if len(items) > JOB_MAX_ITEMS:
+            raise JobError(f'Too many images ({len(items)}), the limit is {JOB_MAX_ITEMS}', 413)
+        job_id = uuid.uuid4().hex
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT INTO jobs (id, kind, status, options, total, created_at) '
+                       'VALUES (?, ?, ?, ?, ?, ?)',
+                       (job_id, kind, 'queued', json.dumps(options or {}), len(items), time.time()))
+            db.executemany('INSERT INTO job_items (job_id, idx, name, meta, payload, status) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           [(job_id, i, name, json.dumps(meta or {}), payload, 'pending')
+                            for i, (name, payload, meta) in enumerate(items)])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict:
+        row = self._db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        job['progress'] = round((job['done'] + job['failed']) / job['total'], 4) if job['total'] else 1.0
+        return job
+
+    def claim(self, limit: int, kinds: list) -> tuple:
+        """
+        Lease up to `limit` pending items of the oldest unfinished job (items
+        whose lease expired count as pending). Returns (job, items) or (None, []).
+        """
+        db = self._db()
+        now = time.time()
+        marks = ','.join('?' * len(kinds))
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                f"SELECT i.job_id FROM job_items i JOIN jobs j ON j.id = i.job_id "
+                f"WHERE j.kind IN ({marks}) AND (i.status = 'pending' OR "
+                f"(i.status = 'running' AND i.claimed_at < ?)) "
+                f"ORDER BY j.created_at LIMIT 1", (*kinds, now - JOB_LEASE_S)
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None, []
+            job_id = row['job_id']
+            items = db.execute(
+                "SELECT idx, name, meta, payload FROM job_items WHERE job_id = ? AND "
+                "(status = 'pending' OR (status = 'running' AND claimed_at < ?)) ORDER BY idx LIMIT ?",
+                (job_id, now - JOB_LEASE_S, limit)
+            ).fetchall()
+            db.executemany("UPDATE job_items SET status = 'running', claimed_at = ? WHERE job_id = ? AND idx = ?",
+                           [(now, job_id, item['idx']) for item in items])
+            db.execute("UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) "
+                       "WHERE id = ? AND status = 'queued'", (now, job_id))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return self.get(job_id), [
+            {'idx': item['idx'], 'name': item['name'], 'meta': json.loads(item['meta']),
+             'payload': item['payload']} for item in items
+        ]
+
+    def complete(self, job_id: str, results: list):
+        """Store (idx, ok, result) of processed items and update the job's counters."""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                "UPDATE job_items SET status = ?, result = ?, payload = NULL "
+                "WHERE job_id = ? AND idx = ? AND status = 'running'",
+                [('done' if ok else 'failed', json.dumps(result), job_id, idx) for idx, ok, result in results]
+            )
+            self._refresh(db, job_id)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def release(self, job_id: str, indices: list):
+        """Put leased items back (the batch could not run now)."""
+        self._db().executemany(
+            "UPDATE job_items SET status = 'pending', claimed_at = NULL "
+            "WHERE job_id = ? AND idx = ? AND status = 'running'",
+            [(job_id, idx) for idx in indices]
+        )
+
+    def cancel(self, job_id: str) -> dict:
+        """Drop the items not processed yet; finished results are kept."""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute("UPDATE job_items SET status = 'cancelled', payload = NULL "
+                       "WHERE job_id = ? AND status IN ('pending', 'running')", (job_id,))
+            db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                       "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return self.get(job_id)
+
+    def results(self, job_id: str, status: str = None):
+        """Yield {index, name, status, result} for every processed item, in order."""
+        query = "SELECT idx, name, status, result FROM job_items WHERE job_id = ? AND result IS NOT NULL"
+        params = [job_id]
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        for row in self._db().execute(query + ' ORDER BY idx', params):
+            yield {'index': row['idx'], 'name': row['name'], 'status': row['status'],
+                   'result': json.loads(row['result'])}
+
+    def purge(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        """Delete finished jobs older than the retention period. Returns jobs deleted."""
+        db = self._db()
+        cutoff = time.time() - older_than_s
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            old = [r['id'] for r in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'cancelled') AND finished_at < ?", (cutoff,))]
+            db.executemany('DELETE FROM job_items WHERE job_id = ?', [(i,) for i in old])
+            db.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in old])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return len(old)
+
+    def counts(self) -> dict:
+        rows = self._db().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    @staticmethod
+    def _refresh(db, job_id: str):
+        counts = dict(db.execute(
+            "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        unfinished = counts.get('pending', 0) + counts.get('running', 0)
+        db.execute(
+            "UPDATE jobs SET done = ?, failed = ?, "
+            "status = CASE WHEN ? = 0 AND status != 'cancelled' THEN 'done' ELSE status END, "
+            "finished_at = CASE WHEN ? = 0 THEN COALESCE(finished_at, ?) ELSE finished_at END "
+            "WHERE id = ?",
+            (counts.get('done', 0), counts.get('failed', 0), unfinished, unfinished, time.time(), job_id)
+        )
+
+
+# =============================================================================
+# PRIORITY + WORKERS
+# =============================================================================
+
+class InteractiveGate:
+    """Counts in-flight interactive requests; bulk workers wait for a quiet moment."""
+
+    def __init__(self):
+        self._active = 0
+        self._cond = threading.Condition()
+        self.deferred = 0   # batches that waited for interactive traffic
+        self.forced = 0     # batches that ran anyway after JOB_YIELD_S
+
+    def enter(self):
+        with self._cond:
+            self._active += 1
+
+    def leave(self):
+        with self._cond:
+            self._active -= 1
+            if self._active == 0:
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout: float = JOB_YIELD_S) -> bool:
+        """Block until no interactive request is running. False if timed out."""
+        with self._cond:
+            if self._active == 0:
+                return True
+            self.deferred += 1
+            idle = self._cond.wait_for(lambda: self._active == 0, timeout)
+            if not idle:
+                self.forced += 1
+            return idle
+
+    def stats(self) -> dict:
+        return {'interactive_inflight': self._active, 'deferred_batches': self.deferred,
+                'forced_batches': self.forced}
+
+
+class JobWorkers:
+    """
+    Worker threads running `handlers[kind](items, options)`, which returns
+    one (ok, result) per item, for leased batches of queued items.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, gate: InteractiveGate = None,
+                 workers: int = JOB_WORKERS, batch_size: int = JOB_BATCH_SIZE):
+        self.store = store
+        self.handlers = handlers
+        self.gate = gate or InteractiveGate()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Start the workers (once). False if already running or disabled."""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return False
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f'moomingle-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        purged = self.store.purge()
+        if purged:
+            print(f"🧹 Purged {purged} old jobs")
+        print(f"🧵 {self.workers} job workers started ({self.store.path})")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self):
+        """Wake idle workers (a job was submitted)."""
+        self.start()
+        self._wake.set()
+
+    def run_once(self) -> int:
+        """Claim and process one batch. Returns items processed (0 if none queued)."""
+        self.gate.wait_idle()
+        job, items = self.store.claim(self.batch_size, list(self.handlers))
+        if job is None:
+            return 0
+        try:
+            outcomes = self.handlers[job['kind']](items, job['options'])
+        except RetryLater as e:
+            self.store.release(job['id'], [item['idx'] for item in items])
+            print(f"⏳ Job {job['id']} paused: {e}")
+            self._stop.wait(POLL_S * 5)
+            return 0
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Job {job['id']} batch failed: {e}")
+            outcomes = [(False, {'error': str(e)})] * len(items)
+        self.store.complete(job['id'], [(item['idx'], ok, result)
+                                        for item, (ok, result) in zip(items, outcomes)])
+        self.batches += 1
+        self.processed += len(items)
+        return len(items)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"⚠️ Job queue error: {e}")
+            self._wake.wait(POLL_S)
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        return {
+            'workers': len(self._threads),
+            'batch_size': self.batch_size,
+            'batches': self.batches,
+            'processed': self.processed,
+            'errors': self.errors,
+            'jobs': self.store.counts() if self.store.exists() else {},
+            **self.gate.stats(),
+        }
@@ -0,0 +1,610 @@
+#!/usr/bin/env python3
+"""
+Similar-listing search over listing photo embeddings.
+
+Every listing's image_url is embedded with the breed model (the same
+embedding space as /embed) and kept in an IVF index: k-means centroids
+split the listings into partitions, and a query only scans the partitions
+nearest to it. Each partition stores, next to its float16 vectors, the
+columns the app filters on - animal_type (as a small code), price and
+whether the listing is active - so filters are applied inside the scan:
+rows that fail them are masked out before any similarity is computed, and
+further partitions are probed until k matches are found. Nothing is
+post-filtered from an oversized candidate list.
+
+ListingIndexer keeps the index current: it pages through listings by
+(updated_at, id) over PostgREST (see migrations/add_listing_updated_at.sql),
+re-embeds listings whose image_url is new or changed - downloaded
+concurrently and embedded in batches - and only updates the filter columns
+of the others. Photos are passed to the embed callback with their content
+hash, so embeddings computed earlier (e.g. by the import precompute stage)
+are reused. Listings whose photo could not be downloaded are kept aside and
+retried on every sync. Hard-deleted listings leave no changed row behind, so
+every RECONCILE_SECONDS the sync also reads all listing ids and drops the
+ones that are gone. The index, its cursor and the listings to retry are
+saved to one .npz file.
+
+Usage:
+    python listing_index.py info listings.npz
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from muzzle_snapshot import MuzzlePrintsClient
+from muzzle_store import normalize
+
+NLIST = int(os.environ.get('MOOMINGLE_LISTING_NLIST', '0'))  # 0 = sqrt(listings)
+NPROBE = int(os.environ.get('MOOMINGLE_LISTING_NPROBE', '8'))
+TRAIN_MIN = int(os.environ.get('MOOMINGLE_LISTING_TRAIN_MIN', '1024'))  # exact scan below this
+RETRAIN_GROWTH = 4  # re-cluster once the index is this many times its size at training
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 32768
+EMBED_BATCH = int(os.environ.get('MOOMINGLE_LISTING_BATCH', '32'))
+FETCH_WORKERS = int(os.environ.get('MOOMINGLE_LISTING_FETCH_WORKERS', '8'))
+FETCH_TIMEOUT = float(os.environ.get('MOOMINGLE_LISTING_FETCH_TIMEOUT_S', '15'))
+PAGE_SIZE = int(os.environ.get('MOOMINGLE_LISTING_SYNC_PAGE', '500'))
+ID_PAGE_SIZE = 10000
+RECONCILE_SECONDS = float(os.environ.get('MOOMINGLE_LISTING_RECONCILE_SECONDS', '3600'))
+LISTING_COLUMNS = ('id', 'image_url', 'animal_type', 'price', 'status', 'updated_at')
+ANIMAL_TYPE_ALIASES = {'cow': 'cattle'}
+
+
+def animal_type_key(value) -> str:
+    """'Cattle', 'cow', ' cattle ' -> 'cattle' (None -> '')."""
+    key = (value or '').strip().lower()
+    return ANIMAL_TYPE_ALIASES.get(key, key)
+
+
+class _Partition:
+    """One inverted list: vectors and filter columns, with swap-delete."""
+
+    def __init__(self, dim: int):
+        self.ids = []
+        self.vectors = np.empty((16, dim), dtype=np.float16)
+        self.types = np.empty(16, dtype=np.uint8)
+        self.prices = np.empty(16, dtype=np.float32)
+        self.active = np.empty(16, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, listing_id: str, vector, type_code: int, price: float, active: bool) -> int:
+        row = len(self.ids)
+        if row == len(self.vectors):
+            for name in ('vectors', 'types', 'prices', 'active'):
+                column = getattr(self, name)
+                grown = np.empty((2 * len(column),) + column.shape[1:], dtype=column.dtype)
+                grown[:row] = column[:row]
+                setattr(self, name, grown)
+        self.ids.append(listing_id)
+        self.vectors[row] = vector
+        self.set_attributes(row, type_code, price, active)
+        return row
+
+    def set_attributes(self, row: int, type_code: int, price: float, active: bool):
+        self.types[row] = type_code
+        self.prices[row] = np.nan if price is None else price
+        self.active[row] = active
+
+    def remove(self, row: int) -> str:
+        """Move the last row into `row`. Returns the id of the moved row (or None)."""
+        last = len(self.ids) - 1
+        moved = None
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            for column in (self.vectors, self.types, self.prices, self.active):
+                column[row] = column[last]
+        self.ids.pop()
+        return moved
+
+
+class ListingIndex:
+    """IVF index of listing embeddings with in-scan attribute filters."""
+
+    def __init__(self, nlist: int = NLIST, nprobe: int = NPROBE):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.searches = 0
+        self.scanned = 0
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.model_version = None
+        self.dim = None
+        self.centroids = None          # None = not clustered, one partition
+        self.trained_size = 0
+        self.partitions = []
+        self.rows = {}                 # listing_id -> (partition, row)
+        self.image_urls = {}           # listing_id -> image_url it was embedded from
+        self.type_codes = {'': 0}      # animal_type key -> uint8 code
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, listing_id):
+        return listing_id in self.rows
+
+    def _type_code(self, animal_type) -> int:
+        key = animal_type_key(animal_type)
+        if key not in self.type_codes:
+            if len(self.type_codes) == 256:
+                raise ValueError('Too many distinct animal types')
+            self.type_codes[key] = len(self.type_codes)
+        return self.type_codes[key]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return (vectors @ self.centroids.T).argmax(axis=1)
+
+    def upsert(self, listing_id: str, vector, model_version: str, image_url: str = None,
+               animal_type: str = None, price: float = None, active: bool = True):
+        """Add or replace a listing's embedding and filter columns."""
+        vector = normalize(vector)
+        with self._lock:
+            if self.model_version is None:
+                self.model_version, self.dim = model_version, len(vector)
+                self.partitions = [_Partition(self.dim)]
+            elif model_version != self.model_version:
+                raise ValueError(f"Embedding of model '{model_version}' in an index of '{self.model_version}'")
+            self.remove(listing_id)
+            partition = int(self._assign(vector[None])[0])
+            row = self.partitions[partition].append(listing_id, vector, self._type_code(animal_type),
+                                                    price, active)
+            self.rows[listing_id] = (partition, row)
+            self.image_urls[listing_id] = image_url
+
+    def update_attributes(self, listing_id: str, animal_type: str = None, price: float = None,
+                          active: bool = True) -> bool:
+        """Change the filter columns of an indexed listing. False if it is not indexed."""
+        with self._lock:
+            if listing_id not in self.rows:
+                return False
+            partition, row = self.rows[listing_id]
+            self.partitions[partition].set_attributes(row, self._type_code(animal_type), price, active)
+            return True
+
+    def remove(self, listing_id: str) -> bool:
+        with self._lock:
+            location = self.rows.pop(listing_id, None)
+            if location is None:
+                return False
+            self.image_urls.pop(listing_id, None)
+            partition, row = location
+            moved = self.partitions[partition].remove(row)
+            if moved is not None:
+                self.rows[moved] = (partition, row)
+            return True
+
+    def vector(self, listing_id: str):
+        """The stored (float32) embedding of a listing, or None."""
+        with self._lock:
+            location = self.rows.get(listing_id)
+            if location is None:
+                return None
+            partition, row = location
+            return self.partitions[partition].vectors[row].astype(np.float32)
+
+    def describe(self, listing_id: str) -> dict:
+        """The indexed filter columns and photo of a listing."""
+        with self._lock:
+            type_code, price, active = self._attributes(listing_id)
+        names = {code: key for key, code in self.type_codes.items()}
+        return {'image_url': self.image_urls.get(listing_id), 'animal_type': names.get(type_code) or None,
+                'price': price, 'active': active}
+
+    def maybe_train(self) -> bool:
+        """Cluster into partitions once the index is big enough (again as it grows)."""
+        with self._lock:
+            size = len(self.rows)
+            if size < TRAIN_MIN or (self.centroids is not None and size < RETRAIN_GROWTH * self.trained_size):
+                return False
+            ids = list(self.rows)
+            vectors = np.stack([self.vector(i) for i in ids])
+            attributes = [self._attributes(i) for i in ids]
+            nlist = self.nlist or max(1, int(np.sqrt(size)))
+            start = time.perf_counter()
+            self.centroids = spherical_kmeans(vectors, nlist)
+            self.trained_size = size
+            self._rebuild(ids, vectors, attributes)
+            print(f"🧭 Listing index clustered: {size} listings into {len(self.centroids)} partitions "
+                  f"in {time.perf_counter() - start:.1f}s")
+            return True
+
+    def _attributes(self, listing_id: str) -> tuple:
+        partition, row = self.rows[listing_id]
+        p = self.partitions[partition]
+        price = float(p.prices[row])
+        return int(p.types[row]), None if np.isnan(price) else price, bool(p.active[row])
+
+    def _rebuild(self, ids: list, vectors: np.ndarray, attributes: list):
+        self.partitions = [_Partition(self.dim) for _ in range(len(self.centroids) if self.centroids is not None else 1)]
+        self.rows = {}
+        for listing_id, vector, partition, (type_code, price, active) in zip(
+                ids, vectors, self._assign(vectors), attributes):
+            row = self.partitions[partition].append(listing_id, vector, type_code, price, active)
+            self.rows[listing_id] = (int(partition), row)
+
+    def search(self, query, k: int = 10, animal_type: str = None, min_price: float = None,
+               max_price: float = None, active_only: bool = True, exclude: str = None,
+               nprobe: int = None) -> tuple:
+        """
+        The k most similar listings that pass the filters, as
+        [(listing_id, similarity)], plus scan statistics. Partitions are
+        probed nearest first; after `nprobe` of them the scan continues only
+        until k matching listings were found.
+        """
+        query = normalize(query)
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            if not self.rows:
+                return [], {'partitions': 0, 'scanned': 0, 'matched': 0}
+            type_code = None
+            if animal_type:
+                type_code = self.type_codes.get(animal_type_key(animal_type))
+                if type_code is None:
+                    return [], {'partitions': 0, 'scanned': 0, 'matched': 0}
+            if self.centroids is None:
+                order = [0]
+            else:
+                order = np.argsort(-(self.centroids @ query))
+
+            ids, scores = [], []
+            probed = scanned = matched = 0
+            for partition in order:
+                p = self.partitions[partition]
+                n = len(p)
+                probed += 1
+                if n:
+                    mask = np.ones(n, dtype=bool)
+                    if active_only:
+                        mask &= p.active[:n]
+                    if type_code is not None:
+                        mask &= p.types[:n] == type_code
+                    if min_price is not None:
+                        mask &= p.prices[:n] >= min_price   # NaN (no price) never passes
+                    if max_price is not None:
+                        mask &= p.prices[:n] <= max_price
+                    rows = np.flatnonzero(mask)
+                    scanned += n
+                    if rows.size:
+                        matched += rows.size
+                        scores.append(p.vectors[rows].astype(np.float32) @ query)
+                        ids.extend(p.ids[r] for r in rows)
+                if probed >= nprobe and matched - (exclude in ids) >= k:
+                    break
+
+            self.searches += 1
+            self.scanned += scanned
+        if not ids:
+            return [], {'partitions': probed, 'scanned': scanned, 'matched': 0}
+        scores = np.concatenate(scores)
+        top = np.argsort(-scores)[:k + 1]
+        results = [(ids[i], float(scores[i])) for i in top if ids[i] != exclude][:k]
+        return results, {'partitions': probed, 'scanned': scanned, 'matched': matched}
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    # ----- persistence -----
+
+    def save(self, path: str, cursor: dict = None, retry: list = None) -> int:
+        """
+        Write the index (and the sync cursor, and the listing rows still to
+        retry) to `path` atomically. Returns bytes.
+        """
+        with self._lock:
+            ids = list(self.rows)
+            vectors = np.stack([self.vector(i) for i in ids]).astype(np.float16) if ids else np.empty((0, 0), np.float16)
+            attributes = [self._attributes(i) for i in ids]
+            header = {
+                'model_version': self.model_version,
+                'dim': self.dim,
+                'trained_size': self.trained_size,
+                'type_codes': self.type_codes,
+                'image_urls': [self.image_urls.get(i) for i in ids],
+                'cursor': cursor,
+                'retry': retry or [],
+            }
+            arrays = {
+                'ids': np.array(ids, dtype=str),
+                'vectors': vectors,
+                'types': np.array([a[0] for a in attributes], dtype=np.uint8),
+                'prices': np.array([np.nan if a[1] is None else a[1] for a in attributes], dtype=np.float32),
+                'active': np.array([a[2] for a in attributes], dtype=bool),
+                'header': np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+            }
+            if self.centroids is not None:
+                arrays['centroids'] = self.centroids
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def load(self, path: str) -> tuple:
+        """Replace the index with a saved one. Returns its (sync cursor, rows to retry)."""
+        with np.load(path) as data:
+            header = json.loads(data['header'].tobytes())
+            centroids = data['centroids'] if 'centroids' in data else None
+            ids = data['ids'].tolist()
+            vectors = data['vectors'].astype(np.float32)
+            codes = data['types'].tolist()
+            prices = data['prices'].tolist()
+            active = data['active'].tolist()
+        with self._lock:
+            self.clear()
+            self.model_version, self.dim = header['model_version'], header['dim']
+            self.type_codes = header['type_codes']
+            self.trained_size = header['trained_size']
+            self.centroids = centroids
+            self.image_urls = dict(zip(ids, header['image_urls']))
+            attributes = [(c, None if np.isnan(p) else p, a) for c, p, a in zip(codes, prices, active)]
+            if self.dim:
+                self._rebuild(ids, vectors, attributes)
+        return header['cursor'], header.get('retry', [])
+
+    def stats(self) -> dict:
+        sizes = [len(p) for p in self.partitions]
+        return {
+            'listings': len(self.rows),
+            'model_version': self.model_version,
+            'partitions': len(sizes),
+            'largest_partition': max(sizes) if sizes else 0,
+            'nprobe': self.nprobe,
+            'searches': self.searches,
+            'mean_scanned': round(self.scanned / self.searches, 1) if self.searches else None,
+            'memory_mb': round(sum(p.vectors[:len(p)].nbytes for p in self.partitions) / 2 ** 20, 2),
+        }
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS,
+                     seed: int = 0) -> np.ndarray:
+    """k unit-norm centroids of unit-norm vectors (cosine k-means on a sample)."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = np.bincount(assign, minlength=k) > 0
+        centroids[filled] = normalize(sums[filled])
+    return centroids.astype(np.float32)
+
+
+# =============================================================================
+# INDEXING PIPELINE
+# =============================================================================
+
+class ListingsClient(MuzzlePrintsClient):
+    """The listings table over PostgREST, paged by (updated_at, id)."""
+
+    table = 'listings'
+    columns = LISTING_COLUMNS
+    filters = {}
+    order_column = 'updated_at'
+
+    def ids(self, limit: int = ID_PAGE_SIZE) -> set:
+        """Every listing id, paged by id."""
+        ids, last = set(), None
+        while True:
+            query = {'select': 'id', 'order': 'id.asc', 'limit': limit}
+            if last is not None:
+                query['id'] = f'gt.{last}'
+            rows = self._request('GET', query)
+            ids.update(str(row['id']) for row in rows)
+            if len(rows) < limit:
+                return ids
+            last = rows[-1]['id']
+
+
+def fetch_image(url: str, timeout: float = FETCH_TIMEOUT) -> tuple:
+    """Download a photo. Returns (image, SHA-256 of its bytes - the embedding cache key)."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        data = response.read()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image, hashlib.sha256(data).hexdigest()
+
+
+class ListingIndexer:
+    """
+    Keeps a ListingIndex current with the listings table.
+    `embed(images, keys)` gets the photos and their content hashes and
+    returns (N x D embeddings, model_version). It may raise while no model
+    is available; the page is then retried on the next sync.
+    """
+
+    def __init__(self, index: ListingIndex, client: ListingsClient = None, path: str = None,
+                 embed=None, page_size: int = PAGE_SIZE, batch_size: int = EMBED_BATCH):
+        self.index = index
+        self.client = client
+        self.path = path
+        self.embed = embed
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.cursor = None
+        self.retry = {}  # listing_id -> row whose photo could not be fetched
+        self.last_reconcile = None
+        self.embedded = 0
+        self.updated = 0
+        self.removed = 0
+        self.fetch_errors = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_sync = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='moomingle-listing-fetch')
+
+    def warm_start(self) -> int:
+        """Load the saved index, if any. Returns listings loaded."""
+        if self.path and os.path.exists(self.path):
+            try:
+                self.cursor, retry = self.index.load(self.path)
+                self.retry = {str(row['id']): row for row in retry}
+                print(f"📦 Loaded {len(self.index)} listing embeddings from {self.path}")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Listing index unreadable, rebuilding: {e}")
+        return len(self.index)
+
+    def reset(self):
+        """Forget everything (e.g. the model changed); the next sync re-embeds all listings."""
+        with self._lock:
+            self.index.clear()
+            self.cursor = None
+            self.retry = {}
+
+    def apply(self, rows: list):
+        """
+        Index one page of listing rows: embed new/changed photos, update the
+        rest. Rows whose photo could not be fetched go to self.retry.
+        """
+        changed = []
+        for row in rows:
+            listing_id = str(row['id'])
+            attributes = {'animal_type': row.get('animal_type'), 'price': _price(row.get('price')),
+                          'active': (row.get('status') or 'active') == 'active'}
+            url = row.get('image_url')
+            if not url:
+                self.removed += self.index.remove(listing_id)
+                self.retry.pop(listing_id, None)
+            elif listing_id in self.index and self.index.image_urls.get(listing_id) == url:
+                self.updated += self.index.update_attributes(listing_id, **attributes)
+                self.retry.pop(listing_id, None)
+            else:
+                changed.append((listing_id, url, attributes))
+        rows_by_id = {str(row['id']): row for row in rows}
+
+        for start in range(0, len(changed), self.batch_size):
+            batch = changed[start:start + self.batch_size]
+            fetched = list(self._pool.map(self._fetch, [url for _, url, _ in batch]))
+            for (listing_id, _, _), photo in zip(batch, fetched):
+                if photo is None:
+                    self.retry[listing_id] = rows_by_id[listing_id]
+            ready = [(item, photo) for item, photo in zip(batch, fetched) if photo is not None]
+            if not ready:
+                continue
+            embeddings, model_version = self.embed([image for _, (image, _) in ready],
+                                                   [key for _, (_, key) in ready])
+            if self.index.model_version not in (None, model_version):
+                raise ValueError('model changed during sync')
+            for ((listing_id, url, attributes), _), vector in zip(ready, embeddings):
+                self.index.upsert(listing_id, vector, model_version, url, **attributes)
+                self.retry.pop(listing_id, None)
+            self.embedded += len(ready)
+
+    def _fetch(self, url: str):
+        try:
+            image, key = fetch_image(url)
+            return image.convert('RGB'), key
+        except Exception as e:  # Broken links must not stop the sync
+            self.fetch_errors += 1
+            self.last_error = f'{url}: {e}'
+            return None
+
+    def sync_once(self) -> int:
+        """
+        Retry the listings whose photo failed, index listings changed since
+        the cursor and, every RECONCILE_SECONDS, drop deleted ones.
+        Returns listings seen or removed.
+        """
+        with self._lock:
+            seen = 0
+            try:
+                if self.retry:
+                    retried = list(self.retry.values())
+                    self.apply(retried)
+                    seen += len(retried)
+                for rows, cursor in self.client.pages(self.cursor, self.page_size):
+                    self.apply(rows)
+                    self.cursor = cursor
+                    seen += len(rows)
+                if self.last_reconcile is None or time.time() - self.last_reconcile >= RECONCILE_SECONDS:
+                    seen += self.reconcile()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"⚠️ Listing index sync stopped after {seen} listings: {e}")
+            self.last_sync = time.time()
+            if seen:
+                self.index.maybe_train()
+                if self.path:
+                    self.index.save(self.path, self.cursor, list(self.retry.values()))
+            return seen
+
+    def reconcile(self) -> int:
+        """Remove indexed listings that no longer exist (hard deletes). Returns listings removed."""
+        present = self.client.ids()
+        gone = [listing_id for listing_id in list(self.index.rows) if listing_id not in present]
+        for listing_id in gone:
+            self.index.remove(listing_id)
+            self.retry.pop(listing_id, None)
+        self.removed += len(gone)
+        self.last_reconcile = time.time()
+        return len(gone)
+
+    def start(self, interval_seconds: float):
+        """Sync now and then every interval_seconds in a daemon thread."""
+        def poll():
+            while True:
+                self.sync_once()
+                time.sleep(interval_seconds)
+
+        threading.Thread(target=poll, name='moomingle-listing-index', daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            'source': self.client.base if self.client is not None else None,
+            'path': self.path,
+            'cursor': self.cursor,
+            'embedded': self.embedded,
+            'updated': self.updated,
+            'removed': self.removed,
+            'fetch_errors': self.fetch_errors,
+            'pending_retry': len(self.retry),
+            'last_reconcile': self.last_reconcile,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'last_sync': self.last_sync,
+        }
+
+
+def _price(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MooMingle similar-listing index')
+    commands = parser.add_subparsers(dest='command', required=True)
+    info_cmd = commands.add_parser('info', help='Describe a saved index')
+    info_cmd.add_argument('path')
+    args = parser.parse_args()
+
+    index = ListingIndex()
+    cursor, retry = index.load(args.path)
+    print(json.dumps({**index.stats(), 'cursor': cursor, 'pending_retry': len(retry), 'bytes': os.path.getsize(args.path)}, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
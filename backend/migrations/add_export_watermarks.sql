@@ -0,0 +1,37 @@
+-- Migration: Change timestamps for incremental analytics exports
+-- Run this AFTER complete_migration_v3.sql and add_listing_updated_at.sql
+--
+-- scripts/export_listings.py keeps local Parquet / Arrow copies of listings,
+-- offers and purchases current by pulling only the rows changed since its
+-- last run, ordered by (updated_at, id). listings (add_listing_updated_at.sql)
+-- and offers already maintain updated_at; purchases only had purchased_at,
+-- so payment status changes were invisible to an incremental export.
+
+-- ============================================
+-- PURCHASES CHANGE TIMESTAMP
+-- ============================================
+
+ALTER TABLE purchases
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+UPDATE purchases
+SET updated_at = COALESCE(completed_at, purchased_at, NOW())
+WHERE updated_at IS NULL;
+
+-- update_updated_at_column() comes from complete_migration_v3.sql
+DROP TRIGGER IF EXISTS update_purchases_updated_at ON purchases;
+CREATE TRIGGER update_purchases_updated_at
+  BEFORE UPDATE ON purchases
+  FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- ============================================
+-- EXPORT INDEXES
+-- ============================================
+
+-- Incremental pulls page with
+--   ORDER BY updated_at, id  WHERE updated_at >= (last watermark - overlap)
+CREATE INDEX IF NOT EXISTS idx_offers_updated_at_id
+  ON offers(updated_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_purchases_updated_at_id
+  ON purchases(updated_at, id);
@@ -0,0 +1,37 @@
+-- Migration: Track listing changes for the similar-listing index
+-- Run this AFTER complete_migration_v3.sql (which adds listings.status)
+--
+-- The API embeds every listing photo for /listings/similar and keeps its
+-- index current by pulling the listings changed since its last sync
+-- (see backend/listing_index.py). That needs a change timestamp.
+
+-- ============================================
+-- CHANGE TIMESTAMP
+-- ============================================
+
+ALTER TABLE listings
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+UPDATE listings SET updated_at = COALESCE(created_at, NOW()) WHERE updated_at IS NULL;
+
+CREATE OR REPLACE FUNCTION set_listings_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_listings_updated_at ON listings;
+CREATE TRIGGER trg_listings_updated_at
+  BEFORE UPDATE ON listings
+  FOR EACH ROW EXECUTE FUNCTION set_listings_updated_at();
+
+-- ============================================
+-- SYNC INDEX
+-- ============================================
+
+-- The API pages through changed listings with
+--   ORDER BY updated_at, id  WHERE (updated_at, id) > (cursor)
+CREATE INDEX IF NOT EXISTS idx_listings_updated_at_id
+  ON listings(updated_at, id);
@@ -0,0 +1,34 @@
+-- Migration: Store muzzle embeddings in muzzle_prints
+-- Run this AFTER fix_rls_policies.sql (which creates muzzle_prints)
+--
+-- The muzzle API (backend/api.py) keeps its registry in memory. With these
+-- columns it writes every registration through to muzzle_prints and, on
+-- boot, restores from a snapshot file and then pulls the rows added since
+-- (see backend/muzzle_snapshot.py).
+
+-- ============================================
+-- EMBEDDING COLUMNS
+-- ============================================
+
+ALTER TABLE muzzle_prints
+ADD COLUMN IF NOT EXISTS muzzle_id TEXT UNIQUE,
+ADD COLUMN IF NOT EXISTS embedding TEXT,            -- base64, little-endian
+ADD COLUMN IF NOT EXISTS embedding_dtype TEXT DEFAULT 'float16',
+ADD COLUMN IF NOT EXISTS model_version TEXT,        -- only equal versions are compared
+ADD COLUMN IF NOT EXISTS animal_name TEXT,
+ADD COLUMN IF NOT EXISTS phash TEXT,                -- 64-bit dHash, hex
+ADD COLUMN IF NOT EXISTS region TEXT;
+
+-- The API registers from uploaded photos and has no storage URL for them
+ALTER TABLE muzzle_prints ALTER COLUMN image_url DROP NOT NULL;
+
+-- ============================================
+-- SYNC INDEX
+-- ============================================
+
+-- The API pages through new rows with
+--   ORDER BY created_at, id  WHERE (created_at, id) > (cursor)
+-- so every page is an index range scan, however large the table gets
+CREATE INDEX IF NOT EXISTS idx_muzzle_prints_created_at_id
+  ON muzzle_prints(created_at, id)
+  WHERE embedding IS NOT NULL;
@@ -0,0 +1,43 @@
+-- Migration: Track muzzle_prints changes for the registry sync
+-- Run this AFTER add_muzzle_embeddings.sql
+--
+-- Re-registering a listing upserts its muzzle_prints row (one per listing),
+-- which keeps the row's id and created_at. Workers paging by created_at would
+-- never see the new embedding, so they page by a change timestamp instead
+-- (see backend/muzzle_snapshot.py).
+
+-- ============================================
+-- CHANGE TIMESTAMP
+-- ============================================
+
+ALTER TABLE muzzle_prints
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+UPDATE muzzle_prints SET updated_at = COALESCE(created_at, NOW()) WHERE updated_at IS NULL;
+
+CREATE OR REPLACE FUNCTION set_muzzle_prints_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fires for INSERT ... ON CONFLICT DO UPDATE too
+DROP TRIGGER IF EXISTS trg_muzzle_prints_updated_at ON muzzle_prints;
+CREATE TRIGGER trg_muzzle_prints_updated_at
+  BEFORE UPDATE ON muzzle_prints
+  FOR EACH ROW EXECUTE FUNCTION set_muzzle_prints_updated_at();
+
+-- ============================================
+-- SYNC INDEX
+-- ============================================
+
+-- The API pages through changed rows with
+--   ORDER BY updated_at, id  WHERE (updated_at, id) > (cursor)
+-- (the created_at index it replaces is no longer read)
+CREATE INDEX IF NOT EXISTS idx_muzzle_prints_updated_at_id
+  ON muzzle_prints(updated_at, id)
+  WHERE embedding IS NOT NULL;
+
+DROP INDEX IF EXISTS idx_muzzle_prints_created_at_id;
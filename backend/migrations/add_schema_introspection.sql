@@ -0,0 +1,25 @@
+-- Migration: Expose index definitions for schema verification
+-- Run this after the other migrations (any order is fine, it only adds a function)
+--
+-- scripts/verify_tables.py reads table columns from the PostgREST OpenAPI
+-- document, which has no index information. This function lists the
+-- indexes of the public schema so the script can compare them with the
+-- CREATE INDEX statements in these migrations, in the same round trip.
+-- pg_indexes is readable by every role already, so this exposes nothing new.
+
+-- ============================================
+-- INDEX LISTING
+-- ============================================
+
+CREATE OR REPLACE FUNCTION schema_indexes()
+RETURNS TABLE (table_name TEXT, index_name TEXT, definition TEXT)
+LANGUAGE sql STABLE
+SET search_path = pg_catalog
+AS $$
+  SELECT tablename::TEXT, indexname::TEXT, indexdef::TEXT
+  FROM pg_indexes
+  WHERE schemaname = 'public'
+  ORDER BY tablename, indexname;
+$$;
+
+GRANT EXECUTE ON FUNCTION schema_indexes() TO anon, authenticated;
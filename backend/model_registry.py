@@ -0,0 +1,240 @@
+"""
+Versioned model registry with background loading and atomic hot-swap.
+
+A ModelVersion bundles an ONNX session, its prototypes and the vectorized
+scorer. Requests pin the current version for their whole lifetime
+(`with models.use() as mv:`), so a swap never mixes two models inside one
+request: in-flight requests finish on the old version while new requests
+see the new one as soon as it has been loaded and warmed up.
+
+Versions are identified by two tags:
+- model_version: digest of model.onnx. Embeddings are only comparable
+  within one model_version (embedding cache, muzzle index, /embed clients).
+- prototypes_version: digest of prototypes.json. Refreshing prototypes or
+  adding a breed changes only this tag and keeps all embeddings valid.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from scoring import PrototypeScorer
+
+HF_REPO = os.environ.get('MOOMINGLE_MODEL_REPO', 'vishnuamar/cattle-breed-classifier')
+WARMUP_RUNS = int(os.environ.get('MOOMINGLE_WARMUP_RUNS', '3'))
+INPUT_SHAPE = (1, 3, 224, 224)
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelVersion:
+    """A loaded model + prototypes pair. Never mutated after loading."""
+
+    def __init__(self, session, prototypes: dict, model_version: str,
+                 prototypes_version: str, animal_types: dict = None, source: str = None):
+        self.session = session
+        self.prototypes = prototypes
+        self.scorer = PrototypeScorer(prototypes, animal_types=animal_types)
+        self.model_version = model_version
+        self.prototypes_version = prototypes_version
+        self.source = source
+        self.loaded_at = time.time()
+        self.retired_at = None
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def tag(self) -> str:
+        return f"{self.model_version}/{self.prototypes_version}"
+
+    @property
+    def input_name(self) -> str:
+        return self.session.get_inputs()[0].name
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        """Run the model on an N x 3 x H x W batch, returning N embeddings."""
+        max_batch = self.session.get_inputs()[0].shape[0]
+        if not isinstance(max_batch, int) or len(batch) <= max_batch:
+            return self.session.run(None, {self.input_name: batch})[0]
+        # Exported with a fixed batch size: run it in chunks
+        return np.concatenate([self.session.run(None, {self.input_name: batch[i:i + max_batch]})[0]
+                               for i in range(0, len(batch), max_batch)])
+
+    def warm_up(self, runs: int = WARMUP_RUNS):
+        """A few synthetic inferences so the first real request is not slow."""
+        rng = np.random.default_rng(0)
+        for _ in range(runs):
+            features = self.run(rng.standard_normal(INPUT_SHAPE).astype(np.float32))
+            self.scorer.score(features)
+
+    def acquire(self):
+        with self._lock:
+            self._inflight += 1
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+            drained = self._inflight == 0 and self.retired_at is not None
+        if drained:
+            print(f"♻️ Model {self.tag} drained, releasing it")
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def info(self) -> dict:
+        return {
+            'model_version': self.model_version,
+            'prototypes_version': self.prototypes_version,
+            'breeds': len(self.scorer.breeds),
+            'embedding_dim': self.scorer.dim,
+            'source': self.source,
+            'loaded_at': self.loaded_at,
+            'inflight': self._inflight,
+        }
+
+
+class ModelRegistry:
+    """Holds the current ModelVersion and swaps in new ones atomically."""
+
+    def __init__(self, animal_types: dict = None):
+        self.animal_types = animal_types or {}
+        self._current = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._listeners = []
+        self.status = {'state': 'empty'}
+
+    def current(self):
+        return self._current
+
+    @contextmanager
+    def use(self):
+        """Pin the current version for the duration of a request (may yield None)."""
+        version = self._current
+        if version is None:
+            yield None
+            return
+        version.acquire()
+        try:
+            yield version
+        finally:
+            version.release()
+
+    def on_swap(self, callback):
+        """Register callback(old, new), called after every swap."""
+        self._listeners.append(callback)
+        return callback
+
+    def load_files(self, model_path: str, prototypes_path: str, source: str = None) -> ModelVersion:
+        """Build (but do not install) a version from local files and warm it up."""
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(model_path)
+        with open(prototypes_path, 'r') as f:
+            prototypes = json.load(f)
+        version = ModelVersion(
+            session, prototypes,
+            model_version=file_digest(model_path)[:12],
+            prototypes_version=file_digest(prototypes_path)[:12],
+            animal_types=self.animal_types,
+            source=source or model_path,
+        )
+        version.warm_up()
+        return version
+
+    def load_from_hub(self, revision: str = None) -> ModelVersion:
+        """Download model.onnx + prototypes.json from Hugging Face and load them."""
+        from huggingface_hub import hf_hub_download
+
+        model_path = hf_hub_download(HF_REPO, "model.onnx", revision=revision)
+        prototypes_path = hf_hub_download(HF_REPO, "prototypes.json", revision=revision)
+        return self.load_files(model_path, prototypes_path,
+                               source=f"{HF_REPO}@{revision or 'main'}")
+
+    def install(self, version: ModelVersion) -> ModelVersion:
+        """Atomically make `version` current; the old one drains in the background."""
+        with self._lock:
+            old = self._current
+            self._current = version
+        if old is not None:
+            old.retired_at = time.time()
+            if old.inflight == 0:
+                print(f"♻️ Model {old.tag} retired")
+        self.status = {'state': 'ready', 'tag': version.tag, 'at': time.time()}
+        print(f"✅ Model {version.tag} is live ({len(version.scorer.breeds)} breeds, from {version.source})")
+        for callback in self._listeners:
+            try:
+                callback(old, version)
+            except Exception as e:
+                print(f"⚠️ Model swap listener failed: {e}")
+        return version
+
+    def reload(self, revision: str = None, model_path: str = None, prototypes_path: str = None,
+               only_if_empty: bool = False):
+        """
+        Load a new version (blocking) and swap it in. Keeps the old one on failure.
+        With only_if_empty, a version installed meanwhile (e.g. by a concurrent
+        first load) is kept instead.
+        """
+        with self._load_lock:
+            if only_if_empty and self._current is not None:
+                return self._current
+            self.status = {'state': 'loading', 'revision': revision, 'at': time.time()}
+            try:
+                if model_path:
+                    version = self.load_files(model_path, prototypes_path)
+                else:
+                    version = self.load_from_hub(revision)
+            except Exception as e:
+                self.status = {'state': 'failed', 'error': str(e), 'at': time.time()}
+                print(f"❌ Model load failed: {e}")
+                return None
+            return self.install(version)
+
+    def reload_async(self, **kwargs) -> bool:
+        """Start reload() in a background thread. False if a load is already running."""
+        if self._load_lock.locked():
+            return False
+        threading.Thread(target=self.reload, kwargs=kwargs,
+                         name='moomingle-model-reload', daemon=True).start()
+        return True
+
+    def watch_hub(self, interval_seconds: float):
+        """Poll the Hugging Face repo and hot-reload when its revision changes."""
+        def poll():
+            from huggingface_hub import HfApi
+            api = HfApi()
+            seen = None
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    sha = api.model_info(HF_REPO).sha
+                except Exception as e:
+                    print(f"⚠️ Model poll failed: {e}")
+                    continue
+                if seen is not None and sha != seen:
+                    print(f"🔄 New model revision {sha[:12]}, reloading...")
+                    self.reload(revision=sha)
+                seen = sha
+
+        threading.Thread(target=poll, name='moomingle-model-watch', daemon=True).start()
+
+    def info(self) -> dict:
+        current = self._current
+        return {
+            'current': current.info() if current is not None else None,
+            'status': self.status,
+        }
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Sharded muzzle registry.
+
+Embeddings are partitioned across several shard processes, each holding a
+MuzzleStore and serving it over HTTP. ShardedMuzzleStore offers the same
+interface as MuzzleStore to api.py: a record goes to one shard (chosen by a
+hash of its region, or of its listing id), and every search fans out to all
+shards in parallel and merges their top-k.
+
+Enable it in the API with
+    MOOMINGLE_MUZZLE_SHARDS=http://10.0.0.5:7101,http://10.0.0.6:7101
+
+Usage (several shards on one machine):
+    python muzzle_shards.py serve --port 7101
+    python muzzle_shards.py launch --shards 4 --base-port 7101
+"""
+
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+from embeddings import decode_embedding, encode_embedding
+from muzzle_store import MuzzleStore
+
+SHARD_TIMEOUT = float(os.environ.get('MOOMINGLE_SHARD_TIMEOUT_S', '5'))
+
+
+class ShardUnavailable(RuntimeError):
+    """A shard did not answer; results would be incomplete."""
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Stable shard index for a partition key (same on every API worker)."""
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big') % shards
+
+
+def _pack(features) -> str:
+    return base64.b64encode(encode_embedding(features, 'float32')).decode('ascii')
+
+
+# =============================================================================
+# SHARD SERVER
+# =============================================================================
+
+class ShardHandler(BaseHTTPRequestHandler):
+    """JSON API over one MuzzleStore (self.server.store)."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive for the API's connections
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        store = self.server.store
+        path = urlparse(self.path).path
+        if path == '/stats':
+            return self._reply({'records': len(store), **store.stats()})
+        if path.startswith('/record/'):
+            muzzle_id = unquote(path[len('/record/'):])
+            return self._reply({'record': store.get(muzzle_id)})
+        if path.startswith('/listing/'):
+            found = store.by_listing(unquote(path[len('/listing/'):]))
+            return self._reply({'muzzle_id': found[0], 'record': found[1]} if found else {})
+        if path.startswith('/other_versions/'):
+            return self._reply({'count': store.count_other_versions(unquote(path[len('/other_versions/'):]))})
+        self._reply({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        store = self.server.store
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+        path = urlparse(self.path).path
+        try:
+            # Writes skip ids already held: the client retries a request once,
+            # and one that did arrive must not add its records twice
+            if path == '/add':
+                store.add_many([(data['muzzle_id'], decode_embedding(data['embedding'], 'float32'),
+                                 data['model_version'], data.get('metadata', {}))], skip_existing=True)
+                return self._reply({'ok': True})
+            if path == '/add_many':
+                added = store.add_many(((r['muzzle_id'], decode_embedding(r['embedding'], 'float32'),
+                                         r['model_version'], r.get('metadata', {})) for r in data['records']),
+                                       skip_existing=True)
+                return self._reply({'ok': True, 'added': added})
+            if path == '/search':
+                matches = store.search(decode_embedding(data['embedding'], 'float32'),
+                                       data['model_version'], k=data.get('k', 1))
+                return self._reply({'matches': [[m, s, store.get(m)] for m, s in matches]})
+            if path == '/clear':
+                store.clear()
+                return self._reply({'ok': True})
+        except (KeyError, ValueError) as e:
+            return self._reply({'error': str(e)}, 400)
+        self._reply({'error': 'not found'}, 404)
+
+
+def serve(port: int, host: str = '127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), ShardHandler)
+    server.daemon_threads = True
+    server.store = MuzzleStore()
+    print(f"🧩 Muzzle shard on {host}:{port} ({server.store.encoding})", flush=True)
+    server.serve_forever()
+
+
+def launch(shards: int, base_port: int, host: str = '127.0.0.1'):
+    """Start `shards` local shard processes. Returns (processes, urls)."""
+    script = os.path.abspath(__file__)
+    processes, urls = [], []
+    for i in range(shards):
+        port = base_port + i
+        processes.append(subprocess.Popen(
+            [sys.executable, script, 'serve', '--port', str(port), '--host', host]
+        ))
+        urls.append(f'http://{host}:{port}')
+    client = ShardedMuzzleStore(urls)
+    deadline = time.time() + 30
+    while True:
+        try:
+            client.stats()
+            return processes, urls
+        except (ShardUnavailable, OSError):
+            if time.time() > deadline:
+                for process in processes:
+                    process.terminate()
+                raise
+            time.sleep(0.1)
+
+
+# =============================================================================
+# CLIENT (used by api.py)
+# =============================================================================
+
+class _Shard:
+    """One shard endpoint with a keep-alive connection per calling thread."""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        self.url = url
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def call(self, method: str, path: str, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        for attempt in range(2):  # Retry once on a stale keep-alive connection
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                data = json.loads(response.read())
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise ShardUnavailable(f'Muzzle shard {self.url} failed: {e}')
+                continue
+            if response.status >= 400:
+                raise ShardUnavailable(f"Muzzle shard {self.url}: {data.get('error', response.status)}")
+            return data
+
+
+class ShardedMuzzleStore:
+    """MuzzleStore interface over several shard processes (scatter-gather search)."""
+
+    def __init__(self, urls, timeout: float = SHARD_TIMEOUT):
+        self.shards = [_Shard(url, timeout) for url in urls]
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shards)),
+                                        thread_name_prefix='muzzle-shard')
+        # Records of the caller's last search, so get() after search() needs no round trip
+        self._recent = threading.local()
+
+    def _all(self, method: str, path: str, payload=None) -> list:
+        """Same call on every shard in parallel."""
+        futures = [self._pool.submit(shard.call, method, path, payload) for shard in self.shards]
+        return [f.result() for f in futures]
+
+    def _shard_index(self, muzzle_id: str, metadata: dict) -> int:
+        key = metadata.get('region') or metadata.get('listing_id') or muzzle_id
+        return shard_for(str(key), len(self.shards))
+
+    def add(self, muzzle_id: str, features, model_version: str, **metadata):
+        shard = self.shards[self._shard_index(muzzle_id, metadata)]
+        shard.call('POST', '/add', {
+            'muzzle_id': muzzle_id, 'embedding': _pack(features),
+            'model_version': model_version, 'metadata': metadata,
+        })
+
+    def add_many(self, records, batch_size: int = 1000, skip_existing: bool = False) -> list:
+        """
+        Bulk insert (muzzle_id, features, model_version, metadata) tuples,
+        batched per shard. The owning shard drops ids it already holds (so a
+        retried batch is harmless), with or without skip_existing, and no
+        per-record lookups are needed. Returns the ids added.
+        """
+        pending = [[] for _ in self.shards]
+        futures = []
+
+        def send(index):
+            futures.append(self._pool.submit(self.shards[index].call, 'POST', '/add_many',
+                                             {'records': pending[index]}))
+            pending[index] = []
+
+        for muzzle_id, features, model_version, metadata in records:
+            index = self._shard_index(muzzle_id, metadata)
+            pending[index].append({'muzzle_id': muzzle_id, 'embedding': _pack(features),
+                                   'model_version': model_version, 'metadata': metadata})
+            if len(pending[index]) >= batch_size:
+                send(index)
+        for index, batch in enumerate(pending):
+            if batch:
+                send(index)
+        return [muzzle_id for future in futures for muzzle_id in future.result()['added']]
+
+    def search(self, features, model_version: str, k: int = 1) -> list:
+        """Top-k [(muzzle_id, similarity), ...] over all shards."""
+        replies = self._all('POST', '/search', {'embedding': _pack(features),
+                                                'model_version': model_version, 'k': k})
+        matches = [m for reply in replies for m in reply['matches']]
+        matches.sort(key=lambda m: -m[1])
+        self._recent.records = {m[0]: m[2] for m in matches[:k]}
+        return [(m[0], m[1]) for m in matches[:k]]
+
+    def get(self, muzzle_id: str):
+        recent = getattr(self._recent, 'records', {})
+        if muzzle_id in recent:
+            return recent[muzzle_id]
+        replies = self._all('GET', f'/record/{quote(muzzle_id, safe="")}')
+        return next((r['record'] for r in replies if r.get('record')), None)
+
+    def __contains__(self, muzzle_id):
+        return self.get(muzzle_id) is not None
+
+    def __len__(self):
+        return sum(s['records'] for s in self._all('GET', '/stats'))
+
+    def by_listing(self, listing_id):
+        for reply in self._all('GET', f'/listing/{quote(str(listing_id), safe="")}'):
+            if reply:
+                return reply['muzzle_id'], reply['record']
+        return None
+
+    def count_other_versions(self, model_version: str) -> int:
+        return sum(r['count'] for r in self._all('GET', f'/other_versions/{quote(model_version, safe="")}'))
+
+    def clear(self):
+        self._all('POST', '/clear', {})
+
+    def stats(self) -> dict:
+        shards = self._all('GET', '/stats')
+        return {
+            'shards': len(shards),
+            'records_per_shard': [s['records'] for s in shards],
+            'encoding': shards[0]['encoding'] if shards else None,
+            'embedding_bytes': sum(s['embedding_bytes'] for s in shards),
+            # Each shard trains its own PQ codebooks once it holds PQ_TRAIN_SIZE vectors
+            'searched_per_shard': [s.get('searched') for s in shards],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MooMingle muzzle registry shards')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_cmd = commands.add_parser('serve', help='Run one shard in this process')
+    serve_cmd.add_argument('--port', type=int, required=True)
+    serve_cmd.add_argument('--host', default='127.0.0.1')
+
+    launch_cmd = commands.add_parser('launch', help='Run several local shards')
+    launch_cmd.add_argument('--shards', type=int, default=4)
+    launch_cmd.add_argument('--base-port', type=int, default=7101)
+    launch_cmd.add_argument('--host', default='127.0.0.1')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.port, args.host)
+        return
+
+    processes, urls = launch(args.shards, args.base_port, args.host)
+    print(f"MOOMINGLE_MUZZLE_SHARDS={','.join(urls)}", flush=True)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Muzzle registry snapshots and incremental sync from the muzzle_prints table.
+
+A snapshot is a single file: a JSON header (records, ids per embedding
+space, array layout, sync cursor) followed by the store's raw arrays
+(float32/float16 rows, PQ codes and codebooks), each 64-byte aligned.
+Loading memory-maps the file and hands the arrays to MuzzleStore as they
+are, so a warm start is one JSON parse instead of re-adding (and
+re-quantizing) every embedding. The OS pages the vectors in as searches
+touch them, and gunicorn workers share those pages.
+
+After the snapshot, rows written to muzzle_prints since its cursor are
+pulled through PostgREST (Supabase's REST API) in keyset-paginated pages
+ordered by (updated_at, id) - one request per page instead of one per row.
+A re-registration replaces its listing's row and bumps updated_at
+(add_muzzle_prints_updated_at.sql), so it is pulled like a new one. Each
+pull starts SYNC_OVERLAP seconds behind the cursor, re-reading rows whose
+transactions committed after later ones had already been pulled.
+postgrest_stub.py serves the same subset of the API locally.
+
+Usage:
+    python muzzle_snapshot.py pull --output muzzles.snap   # full export from Supabase
+    python muzzle_snapshot.py info muzzles.snap
+"""
+
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+
+import numpy as np
+
+from embeddings import DEFAULT_DTYPE, decode_embedding, encode_embedding
+from muzzle_store import MuzzleStore
+
+MAGIC = b'MZSNAP01'
+ALIGN = 64
+SYNC_PAGE_SIZE = int(os.environ.get('MOOMINGLE_MUZZLE_SYNC_PAGE', '1000'))
+SYNC_TIMEOUT = float(os.environ.get('MOOMINGLE_MUZZLE_SYNC_TIMEOUT_S', '30'))
+SYNC_OVERLAP = float(os.environ.get('MOOMINGLE_MUZZLE_SYNC_OVERLAP_S', '10'))
+TABLE = 'muzzle_prints'
+COLUMNS = ('id', 'muzzle_id', 'listing_id', 'embedding', 'embedding_dtype', 'model_version',
+           'animal_name', 'phash', 'region', 'verified', 'created_at', 'updated_at')
+
+
+# =============================================================================
+# SNAPSHOT FILES
+# =============================================================================
+
+def save_snapshot(store: MuzzleStore, path: str, cursor: dict = None) -> int:
+    """
+    Write the store (and the sync cursor it is current up to) to `path`.
+    The file is written next to it and renamed, so readers never see a
+    partial snapshot. Returns the file size in bytes.
+    """
+    state = store.state()
+    arrays, layout, offset = [], {}, 0
+    for version, segment in state['segments'].items():
+        layout[version] = {'dim': segment['dim'], 'ids': segment['ids'], 'arrays': {}}
+        for name, array in segment['arrays'].items():
+            array = np.ascontiguousarray(array)
+            layout[version]['arrays'][name] = {
+                'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str,
+            }
+            arrays.append(array)
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({
+        'encoding': state['encoding'],
+        'keep_float32': state['keep_float32'],
+        'records': state['records'],
+        'segments': layout,
+        'cursor': cursor,
+        'saved_at': time.time(),
+    }).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    tmp = f'{path}.{os.getpid()}.tmp'  # Workers may save the same snapshot concurrently
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        f.write(b'\0' * (data_start - f.tell()))
+        for array in arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * (-array.nbytes % ALIGN))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def read_header(path: str) -> tuple:
+    """(header dict, byte offset of the array data)"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a muzzle snapshot')
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    return header, -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+
+
+def load_snapshot(store: MuzzleStore, path: str):
+    """
+    Replace the store's contents with a snapshot. Arrays stay memory-mapped
+    (read-only) until new records force a copy. Returns the sync cursor.
+    """
+    header, data_start = read_header(path)
+    segments = {}
+    for version, saved in header['segments'].items():
+        arrays = {}
+        for name, spec in saved['arrays'].items():
+            shape = tuple(spec['shape'])
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            else:
+                arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                         offset=data_start + spec['offset'], shape=shape)
+        segments[version] = {'dim': saved['dim'], 'ids': saved['ids'], 'arrays': arrays}
+    store.restore({
+        'encoding': header['encoding'],
+        'keep_float32': header['keep_float32'],
+        'records': header['records'],
+        'segments': segments,
+    })
+    return header.get('cursor')
+
+
+# =============================================================================
+# MUZZLE_PRINTS ROWS
+# =============================================================================
+
+def record_to_row(muzzle_id: str, features, model_version: str, metadata: dict,
+                  dtype: str = DEFAULT_DTYPE) -> dict:
+    """A muzzle_prints row for a registered record (see add_muzzle_embeddings.sql)."""
+    return {
+        'muzzle_id': muzzle_id,
+        'listing_id': metadata.get('listing_id'),
+        'embedding': base64.b64encode(encode_embedding(features, dtype)).decode('ascii'),
+        'embedding_dtype': dtype,
+        'model_version': model_version,
+        'animal_name': metadata.get('animal_name'),
+        'phash': metadata.get('phash'),
+        'region': metadata.get('region'),
+        'verified': metadata.get('status') == 'verified',
+    }
+
+
+def row_to_record(row: dict) -> tuple:
+    """(muzzle_id, features, model_version, metadata) for MuzzleStore.add_many()."""
+    features = decode_embedding(row['embedding'], row.get('embedding_dtype') or DEFAULT_DTYPE)
+    metadata = {
+        'phash': row.get('phash'),
+        'listing_id': row['listing_id'],
+        'animal_name': row.get('animal_name') or 'Unknown',
+        'region': row.get('region'),
+        'registered_at': row['created_at'],
+        'status': 'verified' if row.get('verified') else 'pending',
+    }
+    return row.get('muzzle_id') or row['id'], features, row['model_version'], metadata
+
+
+def _quoted(value: str) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class MuzzlePrintsClient:
+    """The muzzle_prints table over PostgREST (SUPABASE_URL + a service or anon key)."""
+
+    table = TABLE
+    columns = COLUMNS
+    filters = {'embedding': 'not.is.null'}
+    order_column = 'updated_at'  # keyset pagination on (order_column, id)
+
+    def __init__(self, url: str, key: str, timeout: float = SYNC_TIMEOUT):
+        self.base = url.rstrip('/') + '/rest/v1/' + self.table
+        self.headers = {'apikey': key, 'Authorization': f'Bearer {key}'}
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        """Client for SUPABASE_URL, or None when it is not configured."""
+        url = os.environ.get('SUPABASE_URL')
+        key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
+        return cls(url, key) if url and key else None
+
+    def _request(self, method: str, query: dict, body=None, headers: dict = None):
+        request = urllib.request.Request(
+            f'{self.base}?{urlencode(query, quote_via=quote, safe=",.()*")}',
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={**self.headers, 'Content-Type': 'application/json', **(headers or {})},
+            method=method,
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else None
+
+    def page(self, cursor: dict = None, limit: int = SYNC_PAGE_SIZE) -> list:
+        """
+        Up to `limit` rows (with an embedding) after `cursor`, in
+        (updated_at, id) order. A cursor without an id (see rewind()) starts
+        at its timestamp, inclusive.
+        """
+        column = self.order_column
+        query = {
+            'select': ','.join(self.columns),
+            **self.filters,
+            'order': f'{column}.asc,id.asc',
+            'limit': limit,
+        }
+        if cursor and 'id' in cursor:
+            value, row_id = _quoted(cursor[column]), _quoted(cursor['id'])
+            query['or'] = f'({column}.gt.{value},and({column}.eq.{value},id.gt.{row_id}))'
+        elif cursor:
+            query['and'] = f'({column}.gte.{_quoted(cursor[column])})'
+        return self._request('GET', query)
+
+    def rewind(self, cursor: dict, seconds: float):
+        """
+        A cursor `seconds` before `cursor`. Cursors of snapshots taken when
+        sync paged by created_at work too: updated_at is never earlier.
+        """
+        value = (cursor or {}).get(self.order_column) or (cursor or {}).get('created_at')
+        if value is None:
+            return None
+        since = datetime.fromisoformat(value.replace('Z', '+00:00')) - timedelta(seconds=seconds)
+        return {self.order_column: since.isoformat()}
+
+    def pages(self, cursor: dict = None, limit: int = SYNC_PAGE_SIZE):
+        """Yield (rows, cursor after them) until the table is exhausted."""
+        while True:
+            rows = self.page(cursor, limit)
+            if not rows:
+                return
+            cursor = {self.order_column: rows[-1][self.order_column], 'id': rows[-1]['id']}
+            yield rows, cursor
+            if len(rows) < limit:
+                return
+
+    def upsert(self, row: dict):
+        """Insert or replace the row of row['listing_id'] (muzzle_prints is one per listing)."""
+        self._request('POST', {'on_conflict': 'listing_id'}, row,
+                      {'Prefer': 'resolution=merge-duplicates,return=minimal'})
+
+
+# =============================================================================
+# SYNC
+# =============================================================================
+
+class MuzzleSync:
+    """
+    Keeps a MuzzleStore current with muzzle_prints: warm start from a
+    snapshot, then paged pulls of newer rows (once or on an interval),
+    re-snapshotting after every pull that added records.
+    """
+
+    def __init__(self, store, client: MuzzlePrintsClient = None, snapshot_path: str = None,
+                 on_added=None, page_size: int = SYNC_PAGE_SIZE, overlap: float = SYNC_OVERLAP):
+        self.store = store
+        self.client = client
+        # Snapshots need the arrays in this process (not shard processes)
+        self.snapshot_path = snapshot_path if isinstance(store, MuzzleStore) else None
+        self.on_added = on_added
+        self.page_size = page_size
+        self.overlap = overlap
+        self.cursor = None
+        self.synced = 0
+        self.errors = 0
+        self.last_sync = None
+        self.last_error = None
+        self.snapshot_bytes = None
+        self.written = 0
+        self.write_errors = 0
+        self._lock = threading.RLock()
+
+    def warm_start(self) -> int:
+        """Load the snapshot (if any), then pull what was added since. Returns records loaded."""
+        loaded = 0
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            start = time.perf_counter()
+            try:
+                self.cursor = load_snapshot(self.store, self.snapshot_path)
+                loaded = len(self.store)
+                if self.on_added is not None:
+                    self.on_added(self.store.records.items())
+                print(f"📦 Loaded {loaded} muzzle records from {self.snapshot_path} "
+                      f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Muzzle snapshot unreadable, starting empty: {e}")
+        if self.client is not None:
+            loaded += self.sync_once()
+        return loaded
+
+    def sync_once(self) -> int:
+        """Pull muzzle_prints rows written since the cursor. Returns records added."""
+        with self._lock:
+            added = 0
+            try:
+                # Rows re-read from the overlap are skipped by id
+                start = self.client.rewind(self.cursor, self.overlap)
+                for rows, cursor in self.client.pages(start, self.page_size):
+                    records = [row_to_record(row) for row in rows]
+                    # One bulk call: the store (or each owning shard) skips ids it already has
+                    fresh = set(self.store.add_many(records, skip_existing=True))
+                    if fresh and self.on_added is not None:
+                        # The first row of a repeated id is the one stored
+                        self.on_added({r[0]: r[3] for r in reversed(records) if r[0] in fresh}.items())
+                    added += len(fresh)
+                    self.cursor = cursor
+            except (OSError, ValueError, KeyError) as e:  # URLError is an OSError
+                self.errors += 1
+                self.last_error = str(e)
+                print(f"⚠️ Muzzle sync failed after {added} records: {e}")
+            self.synced += added
+            self.last_sync = time.time()
+            if added and self.snapshot_path:
+                self.save()
+            return added
+
+    def write_through(self, muzzle_id: str, features, model_version: str, metadata: dict) -> bool:
+        """Upsert a new registration into muzzle_prints. Failures are logged, not raised."""
+        try:
+            self.client.upsert(record_to_row(muzzle_id, features, model_version, metadata))
+        except (OSError, ValueError) as e:
+            self.write_errors += 1
+            self.last_error = str(e)
+            print(f"⚠️ muzzle_prints write failed for {muzzle_id}: {e}")
+            return False
+        self.written += 1
+        return True
+
+    def save(self) -> int:
+        with self._lock:
+            self.snapshot_bytes = save_snapshot(self.store, self.snapshot_path, self.cursor)
+            return self.snapshot_bytes
+
+    def start(self, interval_seconds: float):
+        """Pull new rows every interval_seconds in a daemon thread."""
+        def poll():
+            while True:
+                time.sleep(interval_seconds)
+                self.sync_once()
+
+        threading.Thread(target=poll, name='moomingle-muzzle-sync', daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            'source': self.client.base if self.client is not None else None,
+            'snapshot': self.snapshot_path,
+            'snapshot_bytes': self.snapshot_bytes,
+            'cursor': self.cursor,
+            'synced': self.synced,
+            'errors': self.errors,
+            'written': self.written,
+            'write_errors': self.write_errors,
+            'last_error': self.last_error,
+            'last_sync': self.last_sync,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MooMingle muzzle registry snapshots')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pull_cmd = commands.add_parser('pull', help='Export muzzle_prints into a snapshot')
+    pull_cmd.add_argument('--output', required=True)
+    pull_cmd.add_argument('--url', default=os.environ.get('SUPABASE_URL'))
+    pull_cmd.add_argument('--key', default=os.environ.get('SUPABASE_SERVICE_ROLE_KEY')
+                          or os.environ.get('SUPABASE_ANON_KEY'))
+    pull_cmd.add_argument('--page-size', type=int, default=SYNC_PAGE_SIZE)
+
+    info_cmd = commands.add_parser('info', help='Describe a snapshot')
+    info_cmd.add_argument('path')
+
+    args = parser.parse_args()
+    if args.command == 'info':
+        header, _ = read_header(args.path)
+        print(json.dumps({
+            'records': len(header['records']),
+            'encoding': header['encoding'],
+            'keep_float32': header['keep_float32'],
+            'versions': {v: len(s['ids']) for v, s in header['segments'].items()},
+            'cursor': header['cursor'],
+            'bytes': os.path.getsize(args.path),
+        }, indent=2))
+        return
+
+    if not args.url or not args.key:
+        parser.error('Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or pass --url/--key)')
+    sync = MuzzleSync(MuzzleStore(), MuzzlePrintsClient(args.url, args.key),
+                      args.output, page_size=args.page_size)
+    if os.path.exists(args.output):
+        sync.warm_start()
+    else:
+        sync.sync_once()
+    if sync.errors:
+        return 1
+    size = sync.save()
+    print(f"✅ {len(sync.store)} muzzle records -> {args.output} ({size / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
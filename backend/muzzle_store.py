@@ -0,0 +1,409 @@
+"""
+In-memory muzzle registry with compact embedding storage.
+
+Records are kept as metadata dicts plus one contiguous embedding matrix per
+embedding space (model version), so a search is a single matrix product
+instead of a Python loop over lists. The search index can be stored as:
+
+- float32: exact cosine similarity (4 bytes per dimension)
+- float16: half the memory, practically exact, but about 10x slower to
+           scan: NumPy has no float16 BLAS, so rows are widened to float32
+           block by block on every search
+- pq:      product quantization (1 byte per PQ_SUBVECTOR_DIM dimensions),
+           searched with asymmetric distance computation (the query stays
+           float32, only the stored side is quantized). The codebooks are
+           trained once PQ_TRAIN_SIZE vectors are stored; until then the
+           vectors are kept and scanned as float32 (see stats()).
+
+With keep_float32=True the full-precision vectors are kept next to the index
+and the best candidates of a pq search are re-ranked exactly; a float16
+index is then not scanned at all, as the float32 rows are faster and exact.
+Without it only the compressed index is kept in memory.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+ENCODINGS = ('float32', 'float16', 'pq')
+DEFAULT_ENCODING = os.environ.get('MOOMINGLE_MUZZLE_ENCODING', 'float32')
+KEEP_FLOAT32 = os.environ.get('MOOMINGLE_MUZZLE_KEEP_FLOAT32', '1') == '1'
+PQ_SUBVECTOR_DIM = int(os.environ.get('MOOMINGLE_PQ_SUBVECTOR_DIM', '8'))
+PQ_CENTROIDS = 256
+PQ_TRAIN_SIZE = int(os.environ.get('MOOMINGLE_PQ_TRAIN_SIZE', '2048'))
+PQ_ITERATIONS = 15
+RERANK_CANDIDATES = int(os.environ.get('MOOMINGLE_RERANK_CANDIDATES', '64'))
+SCAN_BLOCK = 4096  # rows widened from float16 at a time (stays in cache)
+
+
+def normalize(features) -> np.ndarray:
+    """L2-normalize a vector or the rows of a matrix (float32)."""
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=-1, keepdims=True)
+    return features / np.maximum(norms, 1e-12)
+
+
+class _Rows:
+    """Append-only 2-D array with amortized O(1) growth."""
+
+    def __init__(self, width: int, dtype):
+        self._data = np.empty((16, width), dtype=dtype)
+        self.size = 0
+
+    def append(self, row):
+        if self.size == len(self._data):
+            grown = np.empty((2 * len(self._data), self._data.shape[1]), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size] = row
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    def replace(self, data: np.ndarray):
+        self._data = np.array(data, dtype=self._data.dtype)
+        self.size = len(data)
+
+    def adopt(self, data: np.ndarray):
+        """Use `data` (e.g. a read-only memmap) without copying; the next
+        append copies it into a new, growable buffer."""
+        self._data = data
+        self.size = len(data)
+
+    @property
+    def nbytes(self) -> int:
+        return self.view().nbytes
+
+
+class _Columns:
+    """Append-only column-major 2-D array (each column is one record), so a
+    scan over one feature of every record reads contiguous memory."""
+
+    def __init__(self, height: int, dtype):
+        self._data = np.empty((height, 16), dtype=dtype)
+        self.size = 0
+
+    def append(self, column):
+        if self.size == self._data.shape[1]:
+            grown = np.empty((self._data.shape[0], 2 * self.size), dtype=self._data.dtype)
+            grown[:, :self.size] = self._data[:, :self.size]
+            self._data = grown
+        self._data[:, self.size] = column
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self._data[:, :self.size]
+
+    def replace(self, data: np.ndarray):
+        self._data = np.array(data, dtype=self._data.dtype, order='C')
+        self.size = data.shape[1]
+
+    def adopt(self, data: np.ndarray):
+        self._data = data
+        self.size = data.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.view().nbytes
+
+
+class ProductQuantizer:
+    """k-means codebooks per subvector; codes are one uint8 per subvector."""
+
+    def __init__(self, dim: int, subvector_dim: int = PQ_SUBVECTOR_DIM):
+        self.dim = dim
+        self.subvector_dim = subvector_dim
+        self.subvectors = dim // subvector_dim
+        self.codebooks = None  # subvectors x 256 x subvector_dim
+
+    @staticmethod
+    def supports(dim: int, subvector_dim: int = PQ_SUBVECTOR_DIM) -> bool:
+        return dim % subvector_dim == 0
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """N x D -> subvectors x N x subvector_dim"""
+        return vectors.reshape(len(vectors), self.subvectors, self.subvector_dim).transpose(1, 0, 2)
+
+    def train(self, vectors: np.ndarray, iterations: int = PQ_ITERATIONS, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        parts = self._split(vectors)
+        k = min(PQ_CENTROIDS, len(vectors))
+        codebooks = parts[:, rng.choice(len(vectors), k, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(parts, codebooks)
+            for m in range(self.subvectors):
+                counts = np.bincount(assign[m], minlength=k)
+                sums = np.zeros((k, self.subvector_dim), dtype=np.float64)
+                np.add.at(sums, assign[m], parts[m])
+                filled = counts > 0
+                codebooks[m, filled] = sums[filled] / counts[filled, None]
+        self.codebooks = codebooks.astype(np.float32)
+
+    @staticmethod
+    def _assign(parts: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 = ||c||^2 - 2 x.c (+ ||x||^2, constant per row)
+        dots = np.einsum('mnd,mkd->mnk', parts, codebooks)
+        dist = (codebooks ** 2).sum(axis=2)[:, None, :] - 2 * dots
+        return dist.argmin(axis=2)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """N x D float32 -> subvectors x N uint8 codes"""
+        return self._assign(self._split(vectors), self.codebooks).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.subvectors)[:, None], codes]  # subvectors x N x subvector_dim
+        return parts.transpose(1, 0, 2).reshape(codes.shape[1], self.dim)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric dot products of one float32 query with N codes (subvectors x N)."""
+        table = np.einsum('md,mkd->mk', query.reshape(self.subvectors, self.subvector_dim), self.codebooks)
+        scores = np.zeros(codes.shape[1], dtype=np.float32)
+        for m in range(self.subvectors):
+            scores += table[m].take(codes[m])
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes if self.codebooks is not None else 0
+
+
+class _Segment:
+    """All embeddings of one embedding space (model version)."""
+
+    def __init__(self, dim: int, encoding: str, keep_float32: bool):
+        self.dim = dim
+        self.ids = []
+        self.encoding = encoding
+        self.pq = ProductQuantizer(dim) if encoding == 'pq' and ProductQuantizer.supports(dim) else None
+        self.half = _Rows(dim, np.float16) if encoding == 'float16' else None
+        # Exact vectors: the float32 index itself, the re-ranking source, or the
+        # fallback for dimensions PQ cannot split
+        needs_exact = keep_float32 or (self.pq is None and self.half is None)
+        self.exact = _Rows(dim, np.float32) if needs_exact else None
+        self.codes = None
+        # PQ needs training data: until then, vectors wait in `pending` (exact search)
+        self.pending = _Rows(dim, np.float32) if self.pq is not None else None
+
+    def append(self, muzzle_id: str, vector: np.ndarray):
+        self.ids.append(muzzle_id)
+        if self.exact is not None:
+            self.exact.append(vector)
+        if self.half is not None:
+            self.half.append(vector)
+        if self.pq is not None:
+            if self.codes is None:
+                self.pending.append(vector)
+                if self.pending.size >= PQ_TRAIN_SIZE:
+                    self._train()
+            else:
+                self.codes.append(self.pq.encode(vector[None])[:, 0])
+
+    def _train(self):
+        vectors = self.pending.view()
+        self.pq.train(vectors)
+        self.codes = _Columns(self.pq.subvectors, np.uint8)
+        self.codes.replace(self.pq.encode(vectors))
+        self.pending = None
+
+    @property
+    def searched(self) -> str:
+        """The representation scores() scans: 'pq', 'float16' or 'float32'."""
+        if self.pq is not None:
+            return 'pq' if self.codes is not None else 'float32'
+        if self.half is not None and self.exact is None:
+            return 'float16'
+        return 'float32'
+
+    def scores(self, query: np.ndarray) -> tuple:
+        """(approximate scores of every record, whether they are exact)"""
+        if self.pq is not None:
+            if self.codes is None:
+                return self.pending.view() @ query, True
+            return self.pq.scores(query, self.codes.view()), False
+        if self.half is not None and self.exact is None:
+            # NumPy has no float16 BLAS: widen in blocks to bound the temporary memory
+            half = self.half.view()
+            return np.concatenate([half[i:i + SCAN_BLOCK].astype(np.float32) @ query
+                                   for i in range(0, len(half), SCAN_BLOCK)]), False
+        return self.exact.view() @ query, True
+
+    def rerank(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        return self.exact.view()[rows] @ query
+
+    def arrays(self) -> dict:
+        """Every array that makes up the segment, by name (for snapshots)."""
+        parts = {'exact': self.exact, 'half': self.half, 'codes': self.codes, 'pending': self.pending}
+        arrays = {name: part.view() for name, part in parts.items() if part is not None}
+        if self.pq is not None and self.pq.codebooks is not None:
+            arrays['codebooks'] = self.pq.codebooks
+        return arrays
+
+    def adopt(self, ids: list, arrays: dict):
+        """Take over the arrays of a segment saved with the same layout."""
+        self.ids = list(ids)
+        for name in ('exact', 'half', 'pending'):
+            if name in arrays and getattr(self, name) is not None:
+                getattr(self, name).adopt(arrays[name])
+        if 'codes' in arrays:
+            self.pq.codebooks = np.asarray(arrays['codebooks'])
+            self.codes = _Columns(self.pq.subvectors, np.uint8)
+            self.codes.adopt(arrays['codes'])
+            self.pending = None
+
+    def vectors(self) -> np.ndarray:
+        """Best available float32 copy of every embedding (for re-encoding)."""
+        if self.exact is not None:
+            return self.exact.view()
+        if self.half is not None:
+            return self.half.view().astype(np.float32)
+        if self.codes is None:
+            return self.pending.view()
+        return normalize(self.pq.decode(self.codes.view()))
+
+    @property
+    def nbytes(self) -> int:
+        parts = [self.exact, self.half, self.codes, self.pending]
+        return sum(p.nbytes for p in parts if p is not None) + (self.pq.nbytes if self.pq else 0)
+
+
+class MuzzleStore:
+    """Muzzle records (metadata) plus their embeddings, searchable by cosine similarity."""
+
+    def __init__(self, encoding: str = DEFAULT_ENCODING, keep_float32: bool = KEEP_FLOAT32):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown muzzle encoding '{encoding}'. Use one of: {', '.join(ENCODINGS)}")
+        self.encoding = encoding
+        self.keep_float32 = keep_float32
+        self.records = {}
+        self._segments = {}
+        self._by_listing = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, muzzle_id):
+        return muzzle_id in self.records
+
+    def get(self, muzzle_id):
+        return self.records.get(muzzle_id)
+
+    def add(self, muzzle_id: str, features, model_version: str, **metadata):
+        """Store a record. Embeddings are L2-normalized; only ids of the same
+        model_version are ever compared."""
+        vector = normalize(np.ravel(features))
+        with self._lock:
+            segment = self._segments.get(model_version)
+            if segment is None:
+                segment = self._segments[model_version] = _Segment(
+                    len(vector), self.encoding, self.keep_float32)
+            elif len(vector) != segment.dim:
+                raise ValueError(f'Embedding has {len(vector)} dimensions, '
+                                 f'registry for {model_version} has {segment.dim}')
+            segment.append(muzzle_id, vector)
+            self.records[muzzle_id] = {**metadata, 'model_version': model_version}
+            if 'listing_id' in metadata:
+                self._by_listing[metadata['listing_id']] = muzzle_id
+
+    def add_many(self, records, skip_existing: bool = False) -> list:
+        """
+        Bulk insert (muzzle_id, features, model_version, metadata) tuples.
+        With skip_existing, ids already stored are left alone. Returns the
+        ids added.
+        """
+        added = []
+        for muzzle_id, features, model_version, metadata in records:
+            if skip_existing and muzzle_id in self.records:
+                continue
+            self.add(muzzle_id, features, model_version, **metadata)
+            added.append(muzzle_id)
+        return added
+
+    def by_listing(self, listing_id):
+        """(muzzle_id, record) registered for a listing, or None."""
+        muzzle_id = self._by_listing.get(listing_id)
+        return (muzzle_id, self.records[muzzle_id]) if muzzle_id is not None else None
+
+    def search(self, features, model_version: str, k: int = 1,
+               rerank: int = RERANK_CANDIDATES) -> list:
+        """
+        Top-k [(muzzle_id, cosine similarity), ...] among records of
+        model_version. Approximate scores are re-ranked exactly over the
+        best max(rerank, 10k) candidates when full-precision vectors are kept.
+        """
+        segment = self._segments.get(model_version)
+        if segment is None or not segment.ids:
+            return []
+        query = normalize(np.ravel(features))
+        if len(query) != segment.dim:
+            return []
+
+        scores, exact = segment.scores(query)
+        count = len(scores)
+        pool = min(count, k if exact or segment.exact is None else max(10 * k, rerank))
+        rows = np.argpartition(-scores, pool - 1)[:pool] if pool < count else np.arange(count)
+        if exact or segment.exact is None:
+            candidate_scores = scores[rows]
+        else:
+            candidate_scores = segment.rerank(query, rows)
+        order = np.argsort(-candidate_scores)[:k]
+        return [(segment.ids[rows[i]], float(candidate_scores[i])) for i in order]
+
+    def state(self) -> dict:
+        """Records and raw segment arrays, as written by muzzle_snapshot.save_snapshot()."""
+        with self._lock:
+            return {
+                'encoding': self.encoding,
+                'keep_float32': self.keep_float32,
+                'records': dict(self.records),
+                'segments': {v: {'dim': s.dim, 'ids': list(s.ids), 'arrays': s.arrays()}
+                             for v, s in self._segments.items()},
+            }
+
+    def restore(self, state: dict):
+        """
+        Replace the contents with a state() (arrays may be memory-mapped).
+        Arrays are used as they are when the layout matches this store's
+        encoding; otherwise the embeddings are re-encoded.
+        """
+        same_layout = (state['encoding'], state['keep_float32']) == (self.encoding, self.keep_float32)
+        segments = {}
+        for version, saved in state['segments'].items():
+            segment = segments[version] = _Segment(saved['dim'], self.encoding, self.keep_float32)
+            if same_layout:
+                segment.adopt(saved['ids'], saved['arrays'])
+                continue
+            source = _Segment(saved['dim'], state['encoding'], state['keep_float32'])
+            source.adopt(saved['ids'], saved['arrays'])
+            for muzzle_id, vector in zip(source.ids, source.vectors()):
+                segment.append(muzzle_id, vector)
+        with self._lock:
+            self.records = dict(state['records'])
+            self._segments = segments
+            self._by_listing = {r['listing_id']: m for m, r in self.records.items() if 'listing_id' in r}
+
+    def count_other_versions(self, model_version: str) -> int:
+        """Records that cannot be compared with embeddings of model_version."""
+        return sum(len(s.ids) for v, s in self._segments.items() if v != model_version)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self._segments.clear()
+            self._by_listing.clear()
+
+    def stats(self) -> dict:
+        index_bytes = sum(s.nbytes for s in self._segments.values())
+        return {
+            'encoding': self.encoding,
+            'keep_float32': self.keep_float32,
+            'embedding_bytes': index_bytes,
+            'bytes_per_record': round(index_bytes / len(self.records), 1) if self.records else 0.0,
+            'versions': {v: len(s.ids) for v, s in self._segments.items()},
+            # What searches actually scan: pq stays float32 until PQ_TRAIN_SIZE vectors
+            'searched': {v: s.searched for v, s in self._segments.items()},
+            'pq_untrained': {v: f'{s.pending.size}/{PQ_TRAIN_SIZE}' for v, s in self._segments.items()
+                             if s.pq is not None and s.codes is None},
+        }
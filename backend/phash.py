@@ -0,0 +1,115 @@
+"""
+Perceptual hashes for near-duplicate photo detection.
+
+dHash: the photo is shrunk to 9x8 grayscale and each bit records whether a
+pixel is brighter than its right neighbour. Re-encoding, resizing or mild
+brightness changes flip only a few of the 64 bits, so the same photo
+uploaded twice lands within a small Hamming distance.
+
+PHashIndex finds stored hashes within a distance r with multi-index
+hashing: the hash is split into 4 bands of 16 bits, and by the pigeonhole
+principle any hash within distance r is within r // 4 of the query in at
+least one band. Probing each band's table with those few neighbours gives a
+small candidate set that is then compared bit by bit, so a lookup costs a
+few dozen dict probes instead of a scan.
+"""
+
+import os
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+DEFAULT_MAX_DISTANCE = int(os.environ.get('MOOMINGLE_PHASH_MAX_DISTANCE', '6'))
+
+
+def dhash(image: Image.Image) -> int:
+    """64-bit difference hash of an image."""
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class PHashIndex:
+    """Multi-index Hamming search over 64-bit perceptual hashes."""
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        # Every band value within max_distance // BANDS bit flips is probed
+        band_radius = max_distance // BANDS
+        self._flips = [sum(1 << bit for bit in bits)
+                       for radius in range(band_radius + 1)
+                       for bits in combinations(range(BAND_BITS), radius)]
+        self._tables = [{} for _ in range(BANDS)]
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def _band_values(value: int):
+        mask = (1 << BAND_BITS) - 1
+        return [(value >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+    def add(self, key, value: int):
+        with self._lock:
+            self._remove(key)
+            self._hashes[key] = value
+            for table, band in zip(self._tables, self._band_values(value)):
+                table.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for table, band in zip(self._tables, self._band_values(value)):
+            keys = table.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del table[band]
+
+    def search(self, value: int, max_distance: int = None) -> list:
+        """[(key, distance), ...] of stored hashes within max_distance, closest first."""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            candidates = set()
+            for table, band in zip(self._tables, self._band_values(value)):
+                for flip in self._flips:
+                    candidates.update(table.get(band ^ flip, ()))
+            matches = [(key, hamming(value, self._hashes[key])) for key in candidates]
+        return sorted((m for m in matches if m[1] <= max_distance), key=lambda m: m[1])
+
+    def find_duplicate(self, value: int):
+        """Closest stored (key, distance) within max_distance, or None. Counted in stats()."""
+        matches = self.search(value)
+        self.lookups += 1
+        if matches:
+            self.hits += 1
+            return matches[0]
+        return None
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def stats(self) -> dict:
+        return {
+            'indexed': len(self._hashes),
+            'probes_per_lookup': BANDS * len(self._flips),
+            'max_distance': self.max_distance,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+        }
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Supabase's PostgREST API, for testing the muzzle_prints
+sync (muzzle_snapshot.py) without a database.
+
+Tables live in memory. Supported: GET with select, order, limit, offset,
+column filters (eq, neq, gt, gte, lt, lte, is, in, not.*) and or=(...)
+with nested and(...); POST inserts and upserts (Prefer:
+resolution=merge-duplicates + on_conflict); Prefer: count=exact. Values are
+compared as text, which orders ISO timestamps and UUIDs like Postgres does.
+With a `schema` ({table: [columns]}) set, unknown tables answer 404 and the
+root (GET /rest/v1/) serves the OpenAPI document with their definitions;
+`functions` ({name: callable(args) -> rows}) are served at POST /rest/v1/rpc/<name>.
+--latency-ms adds a delay to every request to model the network round trip,
+and --error-rate answers that fraction of inserts with a 503 (as PostgREST
+does when it loses its database connection) to exercise client retries.
+
+Usage:
+    python postgrest_stub.py --port 7400 --seed-rows 20000
+    SUPABASE_URL=http://127.0.0.1:7400 SUPABASE_ANON_KEY=stub python muzzle_snapshot.py pull --output muzzles.snap
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+
+# Columns that reject duplicates, per table (the first is the primary key)
+UNIQUE_COLUMNS = {'muzzle_prints': ('id', 'listing_id', 'muzzle_id')}
+# Tables with a set_*_updated_at trigger (see the migrations)
+TOUCHED_TABLES = {'muzzle_prints', 'listings'}
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'or', 'and'}
+
+
+def _split_top_level(text: str) -> list:
+    """Split on commas outside parentheses and double quotes."""
+    parts, depth, quoted, current = [], 0, False, ''
+    for i, char in enumerate(text):
+        if char == '"' and (i == 0 or text[i - 1] != '\\'):
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _compare(value, op: str, operand: str) -> bool:
+    value = _text(value)
+    if op == 'is':
+        return value == (None if operand == 'null' else operand)
+    if value is None:
+        return False
+    if op == 'in':
+        return value in [_unquote(v) for v in _split_top_level(operand.strip('()'))]
+    operand = _unquote(operand)
+    return {
+        'eq': value == operand, 'neq': value != operand,
+        'gt': value > operand, 'gte': value >= operand,
+        'lt': value < operand, 'lte': value <= operand,
+    }[op]
+
+
+def parse_condition(column: str, expression: str):
+    """Predicate for `column=op.value` (or `not.op.value`)."""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, operand = expression.partition('.')
+    return lambda row: _compare(row.get(column), op, operand) != negate
+
+
+def parse_logic(kind: str, body: str):
+    """Predicate for `or=(...)` / `and=(...)`, nesting allowed."""
+    predicates = []
+    for part in _split_top_level(body[1:-1]):
+        match = re.match(r'^(not\.)?(and|or)(\(.*\))$', part)
+        if match:
+            inner = parse_logic(match.group(2), match.group(3))
+            predicates.append((lambda p: lambda row: not p(row))(inner) if match.group(1) else inner)
+        else:
+            column, _, expression = part.partition('.')
+            predicates.append(parse_condition(column, expression))
+    combine = any if kind == 'or' else all
+    return lambda row: combine(p(row) for p in predicates)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status: int = 200, headers: dict = None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _table(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        key = self.server.key
+        if key and self.headers.get('apikey') != key:
+            self._reply({'message': 'Invalid API key'}, 401)
+            return None, None
+        url = urlparse(self.path)
+        if not url.path.startswith('/rest/v1/'):
+            self._reply({'message': 'not found'}, 404)
+            return None, None
+        name = url.path[len('/rest/v1/'):]
+        return name, parse_qsl(url.query, keep_blank_values=True)
+
+    def _openapi(self):
+        """The PostgREST root document: one definition per table, columns as properties."""
+        schema = self.server.schema if self.server.schema is not None else {
+            name: sorted({column for row in rows for column in row}) for name, rows in self.server.tables.items()}
+        return {
+            'swagger': '2.0',
+            'info': {'title': 'PostgREST stub'},
+            'paths': {f'/{name}': {} for name in schema},
+            'definitions': {name: {'type': 'object', 'properties': {c: {'type': 'string'} for c in columns}}
+                            for name, columns in schema.items()},
+        }
+
+    def do_GET(self):
+        name, params = self._table()
+        if name is None:
+            return
+        if name == '':
+            return self._reply(self._openapi())
+        if self.server.schema is not None and name not in self.server.schema:
+            return self._reply({'code': 'PGRST205', 'message': f"Could not find the table 'public.{name}'"}, 404)
+        options = dict(params)
+        predicates = [parse_logic(k, v) if k in ('or', 'and') else parse_condition(k, v)
+                      for k, v in params if k not in RESERVED_PARAMS or k in ('or', 'and')]
+        with self.server.lock:
+            rows = [r for r in self.server.tables.get(name, []) if all(p(r) for p in predicates)]
+        for term in reversed(options.get('order', '').split(',') if options.get('order') else []):
+            column, _, direction = term.partition('.')
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            present.sort(key=lambda r: _text(r[column]), reverse=direction.startswith('desc'))
+            rows = present + missing
+        total = len(rows)
+        offset = int(options.get('offset', 0))
+        limit = int(options['limit']) if 'limit' in options else None
+        rows = rows[offset:offset + limit if limit is not None else None]
+        select = options.get('select', '*')
+        if select != '*':
+            columns = select.split(',')
+            rows = [{c: r.get(c) for c in columns} for r in rows]
+        headers = {}
+        if 'count=exact' in self.headers.get('Prefer', ''):
+            end = offset + len(rows) - 1
+            headers['Content-Range'] = f'{offset}-{end}/{total}' if rows else f'*/{total}'
+        self._reply(rows, 200, headers)
+
+    def do_POST(self):
+        name, params = self._table()
+        if name is None:
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'[]')
+        if name.startswith('rpc/'):
+            function = self.server.functions.get(name[4:])
+            if function is None:
+                return self._reply({'code': 'PGRST202', 'message': f'Could not find the function public.{name[4:]}'}, 404)
+            return self._reply(function(payload or {}))
+        with self.server.lock:
+            failed = self.server.error_rate > 0 and self.server.random.random() < self.server.error_rate
+            self.server.stats['injected_errors'] += failed
+        if failed:
+            return self._reply({'code': 'PGRST001', 'message': 'Injected failure (error_rate)'}, 503)
+        rows = payload if isinstance(payload, list) else [payload]
+        prefer = self.headers.get('Prefer', '')
+        conflict = dict(params).get('on_conflict') if 'merge-duplicates' in prefer else None
+        written = []
+        with self.server.lock:
+            table = self.server.tables.setdefault(name, [])
+            unique = UNIQUE_COLUMNS.get(name, ('id',))
+            for row in rows:
+                existing = next((r for r in table if r.get(conflict) == row.get(conflict)), None) if conflict else None
+                if existing is not None:
+                    existing.update(row)
+                    if name in TOUCHED_TABLES:
+                        existing['updated_at'] = self.server.now()
+                    written.append(existing)
+                    continue
+                # Generated ids cannot clash: only scan for the values the client sent
+                sent = [c for c in unique if row.get(c) is not None]
+                row = {'id': str(uuid.uuid4()), 'created_at': self.server.now(), **row}
+                if name in TOUCHED_TABLES:
+                    row.setdefault('updated_at', row['created_at'])
+                clash = next((c for c in sent for r in table if r.get(c) == row[c]), None)
+                if clash:
+                    return self._reply({'code': '23505', 'message': f'duplicate key value violates '
+                                                                     f'unique constraint on {clash}'}, 409)
+                table.append(row)
+                written.append(row)
+            self.server.stats['inserted'] += len(rows)
+        self._reply(written if 'return=representation' in prefer else None, 201)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, key: str = None, latency_ms: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        super().__init__(address, StubHandler)
+        self.tables = {}
+        self.schema = None
+        self.functions = {}
+        self.lock = threading.Lock()
+        self.key = key
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'inserted': 0, 'injected_errors': 0}
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self._tick = threading.Lock()
+
+    def now(self) -> str:
+        """Strictly increasing created_at values, formatted like PostgREST."""
+        with self._tick:
+            self._clock = max(self._clock + timedelta(microseconds=1), datetime.now(timezone.utc))
+            return self._clock.isoformat()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def seed_muzzle_prints(server: StubServer, rows: int, dim: int = 512,
+                       model_version: str = 'bench', seed: int = 0):
+    """Fill muzzle_prints with `rows` random float16 embeddings."""
+    rng = np.random.default_rng(seed)
+    table = server.tables.setdefault('muzzle_prints', [])
+    for i in range(rows):
+        vector = rng.standard_normal(dim).astype(np.float16)
+        now = server.now()
+        table.append({
+            'id': str(uuid.UUID(int=int(rng.integers(1 << 62)) << 64 | i)),
+            'listing_id': str(uuid.uuid4()),
+            'image_url': f'https://example.invalid/muzzles/{i}.jpg',
+            'hash': None,
+            'verified': True,
+            'created_at': now,
+            'updated_at': now,
+            'muzzle_id': f'MZL-{i:012X}',
+            'embedding': base64.b64encode(vector.tobytes()).decode('ascii'),
+            'embedding_dtype': 'float16',
+            'model_version': model_version,
+            'animal_name': f'Animal {i}',
+            'phash': None,
+            'region': None,
+        })
+
+
+def start(port: int = 0, host: str = '127.0.0.1', key: str = None, latency_ms: float = 0.0,
+          error_rate: float = 0.0, seed: int = 0) -> StubServer:
+    """Serve in a background thread (port 0 picks a free port)."""
+    server = StubServer((host, port), key, latency_ms, error_rate, seed)
+    threading.Thread(target=server.serve_forever, name='postgrest-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local PostgREST stand-in')
+    parser.add_argument('--port', type=int, default=7400)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--key', help='Require this apikey header')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of inserts answered with 503')
+    parser.add_argument('--seed-rows', type=int, default=0, help='Random muzzle_prints rows to start with')
+    parser.add_argument('--dim', type=int, default=512)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.key, args.latency_ms, args.error_rate)
+    seed_muzzle_prints(server, args.seed_rows, args.dim)
+    print(f"🧪 PostgREST stub on {server.url} ({args.seed_rows} muzzle_prints rows)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Model input preprocessing with PIL + NumPy.
+
+Same result as the torchvision pipeline the classifier was trained with:
+
+    Resize(256) -> CenterCrop(224) -> ToTensor() -> Normalize(ImageNet mean/std)
+
+but without importing torch, which costs seconds and hundreds of MB at
+worker startup for four lines of arithmetic. tta_views() adds the extra
+crops used for test-time augmentation.
+"""
+
+import numpy as np
+from PIL import Image
+
+RESIZE = 256
+CROP = 224
+TTA_VIEWS = {'flip': 1, 'five': 4, 'ten': 9}  # extra views besides the center crop
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+
+def resize_shorter(image: Image.Image, size: int = RESIZE) -> Image.Image:
+    """Scale so the shorter side is `size` (torchvision Resize(int) rounding)."""
+    width, height = image.size
+    if width <= height:
+        new_size = (size, int(size * height / width))
+    else:
+        new_size = (int(size * width / height), size)
+    return image.resize(new_size, Image.BILINEAR)
+
+
+def center_crop(image: Image.Image, size: int = CROP) -> Image.Image:
+    width, height = image.size
+    top = int(round((height - size) / 2.0))
+    left = int(round((width - size) / 2.0))
+    return image.crop((left, top, left + size, top + size))
+
+
+def to_input(image: Image.Image) -> np.ndarray:
+    """One image -> 3 x 224 x 224 float32, normalized."""
+    image = center_crop(resize_shorter(image.convert('RGB')))
+    chw = np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return (chw - MEAN) / STD
+
+
+def to_batch(images: list) -> np.ndarray:
+    """N images -> N x 3 x 224 x 224 model input."""
+    return np.stack([to_input(image) for image in images])
+
+
+def tta_views(image: Image.Image, views: str = 'ten') -> np.ndarray:
+    """
+    Test-time augmentation views besides the plain center crop, as one
+    K x 3 x 224 x 224 batch cut from a single resize:
+
+    - flip: the mirrored center crop (1 view)
+    - five: the four corner crops (4 views)
+    - ten:  corners plus mirrors of all five crops (9 views)
+    """
+    if views not in TTA_VIEWS:
+        raise ValueError(f"Unknown TTA views '{views}'. Use one of: {', '.join(TTA_VIEWS)}")
+    resized = np.asarray(resize_shorter(image.convert('RGB')), dtype=np.float32)
+    height, width = resized.shape[:2]
+    top, left = int(round((height - CROP) / 2.0)), int(round((width - CROP) / 2.0))
+    center = resized[top:top + CROP, left:left + CROP]
+    corners = [resized[y:y + CROP, x:x + CROP]
+               for y, x in ((0, 0), (0, width - CROP), (height - CROP, 0), (height - CROP, width - CROP))]
+
+    crops = corners if views != 'flip' else []
+    if views != 'five':
+        crops = crops + [crop[:, ::-1] for crop in [center] + crops]
+    batch = np.stack(crops).transpose(0, 3, 1, 2) / 255.0
+    return ((batch - MEAN) / STD).astype(np.float32)
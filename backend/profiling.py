@@ -0,0 +1,329 @@
+"""
+Request tracing and sampling profiler for the MooMingle backend.
+
+Opt-in and framework-agnostic, used by both api.py (Flask) and server.py
+(FastAPI):
+
+- A request is traced when it sends `X-Moomingle-Trace: 1` or is picked by
+  MOOMINGLE_TRACE_SAMPLE_RATE. Traced requests record stage timings
+  (returned as a Server-Timing header) and are stack-sampled in the
+  background.
+- Traced requests slower than MOOMINGLE_SLOW_REQUEST_MS have their samples
+  written to MOOMINGLE_PROFILE_DIR as flamegraph-compatible collapsed
+  stacks (`frame;frame;frame count`).
+- ProfileSession samples every thread of a running worker for a bounded
+  time; the admin endpoints start/stop it when MOOMINGLE_ADMIN_TOKEN is set.
+"""
+
+import contextvars
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+TRACE_HEADER = 'X-Moomingle-Trace'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+TRACE_SAMPLE_RATE = float(os.environ.get('MOOMINGLE_TRACE_SAMPLE_RATE', '0'))
+SLOW_REQUEST_MS = float(os.environ.get('MOOMINGLE_SLOW_REQUEST_MS', '2000'))
+PROFILE_DIR = os.environ.get('MOOMINGLE_PROFILE_DIR', '/tmp/moomingle-profiles')
+SAMPLE_INTERVAL_MS = float(os.environ.get('MOOMINGLE_PROFILE_INTERVAL_MS', '5'))
+MAX_PROFILE_SECONDS = float(os.environ.get('MOOMINGLE_MAX_PROFILE_SECONDS', '120'))
+# Sampling interval bounds: below 1 ms the sampler would spin on sys._current_frames()
+MIN_INTERVAL_MS = 1.0
+MAX_INTERVAL_MS = 1000.0
+ADMIN_TOKEN = os.environ.get('MOOMINGLE_ADMIN_TOKEN')
+
+_current_trace = contextvars.ContextVar('moomingle_trace', default=None)
+
+
+# =============================================================================
+# STACK SAMPLING
+# =============================================================================
+
+def collapse_stack(frame) -> str:
+    """Render a frame chain root-first as `file:function;file:function`."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def format_collapsed(counts: Counter) -> str:
+    """Collapsed-stack text as consumed by flamegraph.pl / speedscope."""
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def _write_profile(prefix: str, counts: Counter, details: dict = None) -> str:
+    """Write collapsed stacks (and optional JSON details) to PROFILE_DIR."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(PROFILE_DIR, f"{prefix}-{stamp}-{uuid.uuid4().hex[:8]}.collapsed")
+    with open(path, 'w') as f:
+        f.write(format_collapsed(counts))
+    if details is not None:
+        with open(path[:-len('.collapsed')] + '.json', 'w') as f:
+            json.dump(details, f, indent=2)
+    return path
+
+
+class _RequestSampler(threading.Thread):
+    """
+    One background thread that samples the stacks of all threads currently
+    serving a traced request. For asyncio servers this is the event loop
+    thread, so samples show whatever blocks the loop during the request.
+    Concurrent traced requests on one loop share its thread: each sample
+    is counted for all of them (and the trace is marked shared), since a
+    stack cannot be attributed to one coroutine.
+    """
+
+    def __init__(self):
+        super().__init__(name='moomingle-request-sampler', daemon=True)
+        self.interval = SAMPLE_INTERVAL_MS / 1000.0
+        self.active = {}  # thread id -> [RequestTrace]
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                targets = [(thread_id, list(traces)) for thread_id, traces in self.active.items()]
+            frames = sys._current_frames()
+            for thread_id, traces in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = collapse_stack(frame)
+                    for trace in traces:
+                        trace.samples[stack] += 1
+
+    def add(self, trace):
+        with self.lock:
+            traces = self.active.setdefault(trace.thread_id, [])
+            traces.append(trace)
+            if len(traces) > 1:
+                for other in traces:
+                    other.shared = True
+
+    def remove(self, trace):
+        with self.lock:
+            traces = self.active.get(trace.thread_id, [])
+            if trace in traces:
+                traces.remove(trace)
+            if not traces:
+                self.active.pop(trace.thread_id, None)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler() -> _RequestSampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _RequestSampler()
+            _sampler.start()
+    return _sampler
+
+
+# =============================================================================
+# REQUEST TRACES
+# =============================================================================
+
+class RequestTrace:
+    """Stage timings and stack samples for a single request."""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.samples = Counter()
+        self.shared = False  # samples include other traced requests on this thread
+        self.total_ms = None
+
+    def add_stage(self, name: str, elapsed_ms: float):
+        self.stages.append((name, elapsed_ms))
+
+    def server_timing(self) -> str:
+        """Stage timings in Server-Timing header format."""
+        parts = [f"{name};dur={ms:.2f}" for name, ms in self.stages]
+        parts.append(f"total;dur={self.total_ms:.2f}")
+        return ', '.join(parts)
+
+    def summary(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'total_ms': round(self.total_ms, 2),
+            'stages': [{'name': n, 'ms': round(ms, 2)} for n, ms in self.stages],
+            'samples': sum(self.samples.values()),
+            'shared_samples': self.shared,
+        }
+
+
+def should_trace(header_value=None) -> bool:
+    """Trace when the client asks for it or the request is sampled."""
+    if header_value and header_value.strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def start_trace(name: str, header_value=None):
+    """
+    Begin tracing the current request if it is opted in.
+    Returns a token for end_trace(), or None when not traced.
+    """
+    if not should_trace(header_value):
+        return None
+    trace = RequestTrace(name)
+    _get_sampler().add(trace)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    """Finish a trace started by start_trace(). Safe to call twice."""
+    if token is None:
+        return None
+    trace, context_token = token
+    if trace.total_ms is not None:
+        return trace
+    trace.total_ms = (time.perf_counter() - trace.started) * 1000.0
+    _get_sampler().remove(trace)
+    try:
+        _current_trace.reset(context_token)
+    except ValueError:
+        # Ended from a different context (e.g. an async middleware task)
+        pass
+
+    stages = ', '.join(f"{n}={ms:.1f}ms" for n, ms in trace.stages)
+    print(f"⏱️ Trace {trace.trace_id} {trace.name}: {trace.total_ms:.1f}ms [{stages}]")
+
+    if trace.total_ms >= SLOW_REQUEST_MS and trace.samples:
+        path = _write_profile('slow', trace.samples, trace.summary())
+        print(f"🐢 Slow request {trace.trace_id} ({trace.total_ms:.0f}ms) profile: {path}")
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage of the current request (no-op when untraced)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, (time.perf_counter() - start) * 1000.0)
+
+
+# =============================================================================
+# ON-DEMAND WORKER PROFILES
+# =============================================================================
+
+class ProfileSession:
+    """Time-bounded sampling profile of every thread in this worker."""
+
+    def __init__(self, seconds: float, interval_ms: float = SAMPLE_INTERVAL_MS):
+        seconds, interval_ms = float(seconds), float(interval_ms)
+        if not seconds > 0:
+            raise ValueError('seconds must be positive')
+        if not MIN_INTERVAL_MS <= interval_ms <= MAX_INTERVAL_MS:
+            raise ValueError(f'interval_ms must be between {MIN_INTERVAL_MS:g} and {MAX_INTERVAL_MS:g}')
+        self.seconds = min(seconds, MAX_PROFILE_SECONDS)
+        self.interval = interval_ms / 1000.0
+        self.samples = Counter()
+        self.started_at = time.time()
+        self.path = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='moomingle-profiler',
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        deadline = time.perf_counter() + self.seconds
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[collapse_stack(frame)] += 1
+        self.path = _write_profile('worker', self.samples)
+        print(f"🔬 Worker profile written: {self.path}")
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks."""
+        self._stop.set()
+        self._thread.join()
+        return format_collapsed(self.samples)
+
+    def status(self) -> dict:
+        return {
+            'running': self.running,
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'seconds': self.seconds,
+            'samples': sum(self.samples.values()),
+            'path': self.path,
+        }
+
+
+_profile_session = None
+_profile_lock = threading.Lock()
+
+
+def start_profile(seconds: float, interval_ms: float = SAMPLE_INTERVAL_MS) -> ProfileSession:
+    """Start a worker profile unless one is already running."""
+    global _profile_session
+    with _profile_lock:
+        if _profile_session is not None and _profile_session.running:
+            raise RuntimeError('A profile is already running in this worker')
+        _profile_session = ProfileSession(seconds, interval_ms).start()
+        return _profile_session
+
+
+def stop_profile():
+    """Stop the current worker profile. Returns (session, collapsed) or None."""
+    with _profile_lock:
+        if _profile_session is None:
+            return None
+        return _profile_session, _profile_session.stop()
+
+
+def profile_status() -> dict:
+    if _profile_session is None:
+        return {'running': False, 'pid': os.getpid()}
+    return _profile_session.status()
+
+
+def admin_enabled() -> bool:
+    return bool(ADMIN_TOKEN)
+
+
+def check_admin_token(value) -> bool:
+    """Admin endpoints are disabled unless MOOMINGLE_ADMIN_TOKEN is set."""
+    # Compared as bytes: compare_digest raises TypeError for non-ASCII str
+    return bool(ADMIN_TOKEN) and bool(value) and hmac.compare_digest(value.encode(), ADMIN_TOKEN.encode())
@@ -0,0 +1,133 @@
+"""
+Vectorized prototype scoring for the breed classifier.
+
+Everything is derived from one matrix product between the (L2-normalized)
+image embeddings and the prototype matrix:
+
+- calibrated probabilities: temperature-scaled softmax over the similarities
+- margin: top-1 minus top-2 probability (how sure the model is of the winner)
+- open-set rejection: if even the best prototype is far away, the photo is
+  most likely not a cow/buffalo and no breed is reported
+
+Temperature and rejection threshold should be fit on held-out photos; they
+can be set per model in prototypes.json under "calibration"
+({"temperature": ..., "ood_threshold": ...}) or overridden by env vars.
+"""
+
+import os
+
+import numpy as np
+
+DEFAULT_TEMPERATURE = 0.05
+DEFAULT_OOD_THRESHOLD = 0.3
+TEMPERATURE_OVERRIDE = os.environ.get('MOOMINGLE_SOFTMAX_TEMPERATURE')
+OOD_THRESHOLD_OVERRIDE = os.environ.get('MOOMINGLE_OOD_THRESHOLD')
+VERIFIED_PROBABILITY = float(os.environ.get('MOOMINGLE_VERIFIED_PROBABILITY', '0.8'))
+VERIFIED_MARGIN = float(os.environ.get('MOOMINGLE_VERIFIED_MARGIN', '0.2'))
+TOP_K = 5
+
+
+def _setting(*candidates, default: float) -> float:
+    """First value that is set: explicit argument, env override, calibration file."""
+    for value in candidates:
+        if value is not None:
+            return float(value)
+    return default
+
+
+def degraded_result(reason: str = 'model_unavailable') -> dict:
+    """
+    Explicit "no answer" response used when the model cannot run. Clients
+    should not treat it as a prediction or trigger follow-up calls on it.
+    """
+    return {
+        'breed': None,
+        'confidence': 0.0,
+        'animal_type': 'Unknown',
+        'is_verified': False,
+        'all_scores': {},
+        'status': 'degraded',
+        'reason': reason,
+    }
+
+
+class PrototypeScorer:
+    """Scores embeddings against breed prototypes in a single matrix product."""
+
+    def __init__(self, prototypes: dict, animal_types: dict = None,
+                 temperature: float = None, ood_threshold: float = None):
+        self.prototypes = prototypes
+        protos = prototypes.get('prototypes', {})
+        calibration = prototypes.get('calibration', {})
+
+        self.breeds = list(protos.keys())
+        matrix = np.asarray([protos[b] for b in self.breeds], dtype=np.float32)
+        if matrix.ndim != 2 or not len(self.breeds):
+            raise ValueError('prototypes.json has no usable prototypes')
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.maximum(norms, 1e-12)
+        self.dim = self.matrix.shape[1]
+
+        self.animal_types = animal_types or {}
+        self.temperature = _setting(temperature, TEMPERATURE_OVERRIDE,
+                                    calibration.get('temperature'),
+                                    default=DEFAULT_TEMPERATURE)
+        self.ood_threshold = _setting(ood_threshold, OOD_THRESHOLD_OVERRIDE,
+                                      calibration.get('ood_threshold'),
+                                      default=DEFAULT_OOD_THRESHOLD)
+
+    def similarities(self, features: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each embedding (N x D) to each prototype (N x K)."""
+        features = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return (features / np.maximum(norms, 1e-12)) @ self.matrix.T
+
+    def score(self, features: np.ndarray) -> list:
+        """Score one (D,) or many (N x D) embeddings. Returns one result per row."""
+        sims = self.similarities(features)
+
+        logits = sims / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        k = min(TOP_K, probs.shape[1])
+        top = np.argsort(-probs, axis=1)[:, :k]
+        rows = np.arange(probs.shape[0])[:, None]
+        top_probs = probs[rows, top]
+        top1_sims = sims[rows[:, 0], top[:, 0]]
+        margins = top_probs[:, 0] - (top_probs[:, 1] if k > 1 else 0.0)
+
+        return [
+            self._result(top[i], top_probs[i], float(top1_sims[i]), float(margins[i]))
+            for i in range(probs.shape[0])
+        ]
+
+    def _result(self, top, top_probs, similarity: float, margin: float) -> dict:
+        if similarity < self.ood_threshold:
+            return {
+                'breed': None,
+                'confidence': 0.0,
+                'animal_type': 'Unknown',
+                'is_verified': False,
+                'all_scores': {},
+                'margin': 0.0,
+                'similarity': round(similarity, 4),
+                'is_cattle': False,
+                'status': 'rejected',
+                'reason': 'not_cattle_or_buffalo',
+            }
+
+        breed = self.breeds[top[0]]
+        confidence = float(top_probs[0])
+        return {
+            'breed': breed,
+            'confidence': round(confidence, 4),
+            'animal_type': self.animal_types.get(breed, 'Unknown'),
+            'is_verified': confidence >= VERIFIED_PROBABILITY and margin >= VERIFIED_MARGIN,
+            'all_scores': {self.breeds[j]: round(float(p), 4) for j, p in zip(top, top_probs)},
+            'margin': round(margin, 4),
+            'similarity': round(similarity, 4),
+            'is_cattle': True,
+            'status': 'ok',
+        }
@@ -1,9 +1,18 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
+from fastapi.responses import JSONResponse, PlainTextResponse
 from PIL import Image
+from typing import List
+import asyncio
+import hashlib
 import io
-import random
+import os
+
+import profiling
+from admission import API_KEY_HEADER, DEADLINE_HEADER, Admission, RateLimiter, Shed, deadline_from
+from profiling import stage
+from scoring import degraded_result
+from singleflight import AsyncSingleFlight, SingleFlightTimeout
 
 app = FastAPI()
 
@@ -18,72 +27,338 @@ app.add_middleware(
 
 # -------------------------------------------------------------------------
 # TODO: REPLACE WITH YOUR MODEL PATH
-# Put your .pt file in this same folder and update the name below.
-# Example: model = YOLO("best.pt")
+# Put your .pt file in this same folder and set MOOMINGLE_YOLO_WEIGHTS.
+# Example: MOOMINGLE_YOLO_WEIGHTS=best.pt
+#
+# MOOMINGLE_YOLO_BACKEND picks how it is served:
+#   onnx        - onnxruntime + NumPy pre/post-processing (yolo_onnx.py),
+#                 no torch/ultralytics in the process
+#   ultralytics - the .pt file through ultralytics
+#   auto        - onnx if the .onnx file exists (or MOOMINGLE_YOLO_EXPORT=1
+#                 exports it at startup), else ultralytics
 # -------------------------------------------------------------------------
+YOLO_BACKEND = os.environ.get("MOOMINGLE_YOLO_BACKEND", "auto")
+YOLO_WEIGHTS = os.environ.get("MOOMINGLE_YOLO_WEIGHTS", "yolov8n.pt")
+YOLO_ONNX = os.environ.get("MOOMINGLE_YOLO_ONNX", os.path.splitext(YOLO_WEIGHTS)[0] + ".onnx")
+YOLO_EXPORT = os.environ.get("MOOMINGLE_YOLO_EXPORT", "0") == "1"
+MAX_BATCH = int(os.environ.get("MOOMINGLE_MAX_BATCH", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MOOMINGLE_MAX_BATCH_WAIT_MS", "5"))
+TOP_K = 5
+
+
+def load_yolo():
+    """
+    Load the model for the configured backend. Returns (backend, predict)
+    where predict(images) -> one list of {name, confidence[, box]} per image,
+    best first.
+    """
+    backend = YOLO_BACKEND
+    if backend == "auto":
+        backend = "onnx" if os.path.exists(YOLO_ONNX) or YOLO_EXPORT else "ultralytics"
+
+    if backend == "onnx":
+        from yolo_onnx import OnnxYolo, export_onnx
+
+        path = YOLO_ONNX
+        if not os.path.exists(path) and YOLO_EXPORT:
+            print(f"📦 Exporting {YOLO_WEIGHTS} to ONNX...")
+            path = export_onnx(YOLO_WEIGHTS)
+        onnx_model = OnnxYolo(path, max_batch=MAX_BATCH)
+        return backend, lambda images: onnx_model.predict(images, top_k=TOP_K)
+
+    from ultralytics import YOLO
+
+    yolo = YOLO(YOLO_WEIGHTS)
+
+    def predict(images):
+        results = yolo(images, verbose=False)
+        predictions = []
+        for result in results:
+            if result.probs is not None:  # classification model
+                top = result.probs.data.argsort(descending=True)[:TOP_K].tolist()
+                predictions.append([
+                    {"name": result.names[c], "confidence": float(result.probs.data[c])} for c in top
+                ])
+            else:  # detection model: boxes sorted by confidence
+                boxes = result.boxes
+                order = boxes.conf.argsort(descending=True)[:TOP_K].tolist() if boxes is not None else []
+                predictions.append([
+                    {"name": result.names[int(boxes.cls[i])], "confidence": float(boxes.conf[i]),
+                     "box": [round(float(v), 1) for v in boxes.xyxy[i]]}
+                    for i in order
+                ])
+        return predictions
+
+    return backend, predict
+
+
 try:
-    # We attempt to load a generic YOLO model. 
-    # If you have a custom one, change "yolov8n.pt" to your filename.
-    model = YOLO("yolov8n.pt") 
-    print("✅ Model loaded successfully!")
+    backend, predict_images = load_yolo()
+    print(f"✅ Model loaded successfully! ({backend})")
 except Exception as e:
     print(f"⚠️ warning: Model load failed: {e}")
-    model = None
+    backend, predict_images = None, None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-image requests for up to max_wait_ms (or
+    max_batch images) and runs them as one batch in a worker thread, so the
+    event loop never blocks on inference and the model sees full batches
+    under load.
+    """
+
+    def __init__(self, predict, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_BATCH_WAIT_MS):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = None
+        self.batches = 0
+        self.images = 0
+
+    async def submit(self, image):
+        loop = asyncio.get_running_loop()
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            loop.create_task(self._run())
+        future = loop.create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(None, self.predict, [image for image, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+batcher = MicroBatcher(predict_images) if predict_images else None
+
+# Identical uploads in flight at the same time (client retries) share one inference
+inflight = AsyncSingleFlight()
+
+# Admission control (see admission.py). Admitted requests feed the micro-batcher,
+# so the default admits two full batches at a time.
+admission = Admission(int(os.environ.get("MOOMINGLE_ADMISSION_CONCURRENCY", str(2 * MAX_BATCH))))
+rate_limiter = RateLimiter()
+
+
+@app.exception_handler(Shed)
+async def shed_request(request: Request, exc: Shed):
+    return JSONResponse(exc.body(), status_code=exc.status, headers={"Retry-After": str(exc.retry_after)})
+
+
+async def admit(request: Request, cost: int = 1):
+    """Rate limit the client, then wait for a slot. Returns (acquired_at, deadline)."""
+    forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    client = rate_limiter.client(request.headers.get(API_KEY_HEADER), forwarded,
+                                 request.client.host if request.client else None)
+    wait = rate_limiter.check(client, cost)
+    if wait:
+        raise Shed("rate_limited", wait)
+    deadline = deadline_from(request.headers.get(DEADLINE_HEADER))
+    return await admission.acquire_async("predict", deadline), deadline
+
+
+def build_prediction(predictions: list) -> dict:
+    """Response body for one image from its ranked predictions."""
+    if not predictions:
+        # Nothing detected: tell the app there is no animal instead of inventing one
+        return {
+            "breed": None,
+            "confidence": 0.0,
+            "is_verified": False,
+            "status": "rejected",
+            "reason": "no_animal_detected"
+        }
+    best = predictions[0]
+    return {
+        "breed": best["name"],
+        "confidence": best["confidence"],
+        "is_verified": best["confidence"] > 0.8,
+        "status": "ok",
+        "predictions": predictions,
+    }
+
+
+def decode_image(image_data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    return image
+
+async def read_image(file: UploadFile) -> Image.Image:
+    return decode_image(await file.read())
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Opt-in request tracing (X-Moomingle-Trace header or sampling rate)."""
+    token = profiling.start_trace(
+        f"{request.method} {request.url.path}",
+        request.headers.get(profiling.TRACE_HEADER)
+    )
+    try:
+        response = await call_next(request)
+    finally:
+        trace = profiling.end_trace(token)
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Moomingle-Trace-Id'] = trace.trace_id
+    return response
 
 @app.get("/")
 def read_root():
-    return {"status": "MooMingle AI Server Running"}
+    return {
+        "status": "MooMingle AI Server Running",
+        "backend": backend,
+        "batching": batcher.stats() if batcher else None,
+        "coalescing": inflight.stats(),
+        "admission": {**admission.stats(), "rate_limit": rate_limiter.stats()},
+    }
 
 @app.post("/predict")
-async def predict_breed(file: UploadFile = File(...)):
+async def predict_breed(request: Request, file: UploadFile = File(...)):
     print(f"📸 Received image for prediction...")
     
     # 1. Read Image
     image_data = await file.read()
-    image = Image.open(io.BytesIO(image_data))
 
-    # 2. Run Inference (If model exists)
-    detected_breed = "Unknown"
-    confidence = 0.0
-
-    if model:
-        try:
-            results = model(image)
-            # Logic to extract class name from YOLO results
-            # This depends on how you trained it. 
-            # Assuming class names match breeds.
-            if results and len(results) > 0:
-                probs = results[0].probs # For classification model
-                if probs:
-                   top1 = probs.top1
-                   detected_breed = results[0].names[top1]
-                   confidence = float(probs.top1conf)
-                else:
-                    # Detection model logic (boxes)
-                    boxes = results[0].boxes
-                    if boxes and len(boxes) > 0:
-                        # Just take the first box's class
-                        cls_id = int(boxes[0].cls[0])
-                        detected_breed = results[0].names[cls_id]
-                        confidence = float(boxes[0].conf[0])
-        except Exception as e:
-            print(f"❌ Prediction Error: {e}")
-            detected_breed = "Error"
-    
-    # 3. Fallback / Simulation (If no model or no detection)
-    if detected_breed == "Unknown" or detected_breed == "Error":
-        # Hackathon Fallback: Return a random Indian breed if model fails
-        breeds = ['Murrah', 'Jaffarbadi', 'Gir', 'Sahiwal', 'Ongole']
-        detected_breed = random.choice(breeds)
-        confidence = 0.85 + random.random() * 0.1
-
-    print(f"🐮 Result: {detected_breed} ({confidence:.2f})")
-    
-    return {
-        "breed": detected_breed,
-        "confidence": confidence,
-        "is_verified": confidence > 0.8
-    }
+    # 2. No model: explicit degraded answer, never a guess
+    if batcher is None:
+        print("⚠️ Prediction unavailable (model not loaded)")
+        return JSONResponse(degraded_result("model_unavailable"), status_code=503)
+
+    acquired_at, deadline = await admit(request)
+    try:
+        return await _predict_one(image_data, deadline)
+    finally:
+        admission.release(acquired_at)
+
+
+async def _predict_one(image_data: bytes, deadline):
+    # Dropped if the client gave up while it was queued
+    admission.check_deadline("predict", deadline)
+
+    async def run():
+        with stage("decode"):
+            image = decode_image(image_data)
+        with stage("inference"):
+            return await batcher.submit(image)
+
+    # 3. Run Inference (batched with other requests, shared with identical ones)
+    try:
+        predictions = await inflight.do(hashlib.sha256(image_data).hexdigest(), run)
+    except SingleFlightTimeout as e:
+        print(f"⏱️ {e}")
+        return JSONResponse(degraded_result("timeout"), status_code=503)
+    except OSError:  # UnidentifiedImageError, truncated files
+        raise HTTPException(status_code=400, detail="File is not a valid image")
+    except Exception as e:
+        print(f"❌ Prediction Error: {e}")
+        return JSONResponse(degraded_result("inference_error"), status_code=503)
+
+    result = build_prediction(predictions)
+    if result["breed"] is None:
+        print("❌ No animal detected")
+    else:
+        print(f"🐮 Result: {result['breed']} ({result['confidence']:.2f})")
+    return result
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, files: List[UploadFile] = File(...)):
+    """Several photos in one request, run as a single model batch."""
+    if len(files) > MAX_BATCH * 4:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH * 4} images per request")
+
+    with stage("decode"):
+        images = []
+        for index, file in enumerate(files):
+            try:
+                images.append(await read_image(file))
+            except OSError:  # UnidentifiedImageError, truncated files
+                raise HTTPException(status_code=400,
+                                    detail=f"File {index} ({file.filename}) is not a valid image")
+
+    if predict_images is None:
+        return JSONResponse(degraded_result("model_unavailable"), status_code=503)
+
+    # Counts as one request per photo against the client's rate limit
+    acquired_at, deadline = await admit(request, cost=len(images))
+    try:
+        admission.check_deadline("predict", deadline)
+        with stage("inference"):
+            predictions = await asyncio.get_running_loop().run_in_executor(None, predict_images, images)
+    except Shed:
+        raise
+    except Exception as e:
+        print(f"❌ Batch Prediction Error: {e}")
+        return JSONResponse(degraded_result("inference_error"), status_code=503)
+    finally:
+        admission.release(acquired_at)
+
+    return {"results": [build_prediction(p) for p in predictions]}
+
+# -------------------------------------------------------------------------
+# Admin: time-bounded sampling profile of this worker
+# (disabled unless MOOMINGLE_ADMIN_TOKEN is set)
+# -------------------------------------------------------------------------
+def _check_admin(token):
+    if not profiling.admin_enabled():
+        raise HTTPException(status_code=404, detail="Not found")
+    if not profiling.check_admin_token(token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+@app.post("/admin/profile/start")
+def admin_profile_start(seconds: float = 30, interval_ms: float = profiling.SAMPLE_INTERVAL_MS,
+                        x_admin_token: str = Header(None)):
+    _check_admin(x_admin_token)
+    try:
+        return profiling.start_profile(seconds, interval_ms).status()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/profile/stop")
+def admin_profile_stop(x_admin_token: str = Header(None)):
+    _check_admin(x_admin_token)
+    stopped = profiling.stop_profile()
+    if stopped is None:
+        raise HTTPException(status_code=404, detail="No profile has been started in this worker")
+    profile, collapsed = stopped
+    return PlainTextResponse(collapsed, headers={"X-Profile-Path": profile.path or ""})
+
+@app.get("/admin/profile/status")
+def admin_profile_status(x_admin_token: str = Header(None)):
+    _check_admin(x_admin_token)
+    return profiling.profile_status()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,133 @@
+"""
+In-flight request coalescing ("single flight").
+
+When the same key (e.g. the content hash of an uploaded image) is already
+being computed, later callers wait for that computation and share its
+result instead of running it again. Errors are propagated to every waiter;
+waiters give up after a per-call timeout.
+
+- SingleFlight:      for threaded servers (Flask / gunicorn threads)
+- AsyncSingleFlight: for asyncio servers (FastAPI)
+"""
+
+import asyncio
+import os
+import threading
+
+DEFAULT_TIMEOUT = float(os.environ.get('MOOMINGLE_COALESCE_TIMEOUT_S', '30'))
+
+
+class SingleFlightTimeout(TimeoutError):
+    """A waiter gave up on a computation started by another request."""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _Stats:
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def stats(self, inflight: int) -> dict:
+        total = self.leaders + self.shared
+        return {
+            'computed': self.leaders,
+            'shared': self.shared,
+            'timeouts': self.timeouts,
+            'inflight': inflight,
+            'shared_rate': round(self.shared / total, 4) if total else 0.0,
+        }
+
+
+class SingleFlight(_Stats):
+    """Thread-based single flight."""
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout: float = None):
+        """
+        Return fn(), unless a call with the same key is running: then wait
+        for it (at most `timeout` seconds) and return or raise its outcome.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(self.timeout if timeout is None else timeout):
+            self.timeouts += 1
+            raise SingleFlightTimeout(f'Timed out waiting for in-flight call {key!r}')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> dict:
+        return super().stats(len(self._calls))
+
+
+class AsyncSingleFlight(_Stats):
+    """
+    asyncio single flight. The computation runs as its own task, so a
+    caller that disconnects or times out does not cancel it for the others.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+        self._calls = {}
+
+    async def do(self, key, fn, timeout: float = None):
+        """Await fn() (a coroutine function), shared by concurrent callers of `key`."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            self.leaders += 1
+        else:
+            self.shared += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise SingleFlightTimeout(f'Timed out waiting for in-flight call {key!r}')
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter gave up
+
+    def stats(self) -> dict:
+        return super().stats(len(self._calls))
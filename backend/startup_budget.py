@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Startup budget check for the backend services.
+
+Imports each service module in a fresh interpreter, the way a gunicorn /
+uvicorn worker does, and fails (exit code 1) when the import takes longer
+or uses more memory than its budget, or pulls in a module that must stay
+off the serving path (torch, gradio, ...). Run it in CI or before a deploy:
+
+    python startup_budget.py                       # api.py
+    python startup_budget.py --yolo-onnx best.onnx # + server.py with that model
+    python startup_budget.py --json startup.json   # save the measurements
+
+Model downloads are excluded (api.py is imported with
+MOOMINGLE_PRELOAD_MODEL=0); server.py loads its ONNX model at import, so its
+budget includes onnxruntime and the model.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Each target: module, extra environment, budgets, modules that must not be imported
+TARGETS = {
+    'api': {
+        'module': 'api',
+        'env': {'MOOMINGLE_PRELOAD_MODEL': '0'},
+        'max_import_s': 1.0,
+        'max_rss_mb': 100,
+        'forbidden': ['torch', 'torchvision', 'gradio', 'ultralytics', 'onnxruntime', 'huggingface_hub'],
+    },
+    'server': {
+        'module': 'server',
+        'env': {'MOOMINGLE_YOLO_BACKEND': 'onnx'},
+        'max_import_s': 2.0,
+        'max_rss_mb': 300,
+        'forbidden': ['torch', 'torchvision', 'gradio', 'ultralytics'],
+    },
+}
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'import_s': elapsed,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': sorted(m for m in sys.modules if '.' not in m),
+}}))
+"""
+
+
+def measure(target: dict, runs: int) -> dict:
+    """Best of `runs` fresh-interpreter imports (the least noisy estimate)."""
+    env = {**os.environ, **target['env']}
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=target['module'])],
+            cwd=HERE, env=env, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"import {target['module']} failed:\n{completed.stderr[-2000:]}")
+        sample = json.loads(completed.stdout.strip().splitlines()[-1])
+        sample['process_s'] = time.perf_counter() - start
+        samples.append(sample)
+    best = min(samples, key=lambda s: s['import_s'])
+    return {
+        'import_s': round(best['import_s'], 3),
+        'process_s': round(min(s['process_s'] for s in samples), 3),
+        'rss_mb': round(max(s['rss_mb'] for s in samples), 1),
+        'forbidden_loaded': [m for m in target['forbidden'] if m in best['modules']],
+    }
+
+
+def check(name: str, target: dict, result: dict) -> list:
+    failures = []
+    if result['import_s'] > target['max_import_s']:
+        failures.append(f"{name}: import took {result['import_s']}s (budget {target['max_import_s']}s)")
+    if result['rss_mb'] > target['max_rss_mb']:
+        failures.append(f"{name}: RSS {result['rss_mb']} MB (budget {target['max_rss_mb']} MB)")
+    for module in result['forbidden_loaded']:
+        failures.append(f"{name}: imports {module} at startup")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if backend worker startup exceeds its budget')
+    parser.add_argument('--target', action='append', choices=list(TARGETS),
+                        help='Services to check (default: api, plus server with --yolo-onnx)')
+    parser.add_argument('--yolo-onnx', help='Exported YOLO model for the server target')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--max-import-s', type=float, help='Override every import-time budget')
+    parser.add_argument('--max-rss-mb', type=float, help='Override every RSS budget')
+    parser.add_argument('--json', help='Write the measurements to this file')
+    args = parser.parse_args()
+
+    names = args.target or (['api', 'server'] if args.yolo_onnx else ['api'])
+    if 'server' in names and not args.yolo_onnx:
+        parser.error('The server target needs --yolo-onnx')
+
+    results, failures = {}, []
+    for name in names:
+        target = dict(TARGETS[name])
+        if name == 'server':
+            target['env'] = {**target['env'], 'MOOMINGLE_YOLO_ONNX': os.path.abspath(args.yolo_onnx)}
+        if args.max_import_s is not None:
+            target['max_import_s'] = args.max_import_s
+        if args.max_rss_mb is not None:
+            target['max_rss_mb'] = args.max_rss_mb
+        result = measure(target, args.runs)
+        result['budget'] = {'import_s': target['max_import_s'], 'rss_mb': target['max_rss_mb']}
+        results[name] = result
+        failures += check(name, target, result)
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        return 1
+    print("✅ Startup within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
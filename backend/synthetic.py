@@ -0,0 +1,61 @@
+"""
+Synthetic, reproducible test images for benchmarks (no network, no dataset).
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_cattle_image(seed: int, size=(640, 480)) -> Image.Image:
+    """
+    Generate a cattle-like test image: sky/grass background, a body with
+    coat patches, a head and a textured muzzle. Same seed -> same image.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+
+    # Background: sky above the horizon, grass below
+    horizon = height * rng.uniform(0.35, 0.5)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    sky = yy < horizon
+    img[sky] = [150, 190, 235]
+    img[~sky] = [80, 130, 60]
+    img += (yy / height)[..., None] * 30
+
+    # Body and head ellipses
+    coat = rng.choice([[60, 40, 30], [200, 190, 180], [120, 70, 40], [30, 30, 30]])
+    cx, cy = width * rng.uniform(0.4, 0.6), height * rng.uniform(0.5, 0.6)
+    rx, ry = width * 0.28, height * 0.2
+    body = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1
+    img[body] = coat
+
+    hx, hy = cx + rx * 0.95, cy - ry * 0.6
+    head = ((xx - hx) / (rx * 0.3)) ** 2 + ((yy - hy) / (ry * 0.55)) ** 2 <= 1
+    img[head] = coat
+
+    # Coat patches
+    for _ in range(rng.integers(2, 6)):
+        px, py = rng.uniform(cx - rx, cx + rx), rng.uniform(cy - ry, cy + ry)
+        pr = rng.uniform(10, 40)
+        patch = body & (((xx - px) ** 2 + (yy - py) ** 2) <= pr ** 2)
+        img[patch] = [235, 230, 225]
+
+    # Muzzle with a bead/ridge texture
+    mx, my = hx + rx * 0.2, hy + ry * 0.3
+    muzzle = ((xx - mx) / (rx * 0.12)) ** 2 + ((yy - my) / (ry * 0.2)) ** 2 <= 1
+    ridges = (np.sin(xx * rng.uniform(0.6, 1.2)) * np.cos(yy * rng.uniform(0.6, 1.2)) > 0)
+    img[muzzle] = [70, 50, 55]
+    img[muzzle & ridges] = [40, 30, 35]
+
+    img += rng.normal(0, 8, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8), 'RGB')
+
+
+def encode_image(image: Image.Image, format='JPEG') -> bytes:
+    """Encode a PIL image the way the app uploads it."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=90)
+    return buffer.getvalue()
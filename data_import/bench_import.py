@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Moomingle Import Benchmark
+==========================
+Measure import_csv.py without touching Supabase.
+
+Synthetic partner CSVs with the columns of sample_template.csv are generated
+from a fixed seed, with a configurable share of dirty rows: bad prices
+(currency symbols, negative, absurd), unknown or misspelled breeds, missing
+required fields and duplicated rows. Every importer mode then runs in its
+own Python process against a local PostgREST stand-in
+(backend/postgrest_stub.py) that takes the listings inserts with a
+configurable latency and answers a fraction of them with 503, so the
+importer's retries are exercised.
+
+For every CSV size and mode it reports rows/s (CSV rows over the import's
+own run time), end-to-end seconds (process start to exit, imports
+included), the importer's peak RSS, rows inserted / skipped / failed,
+retried batches and the requests the stand-in saw. With --trace-memory
+the importer also runs under tracemalloc and reports the peak of the
+Python heap it allocated, which leaves out the interpreter and the
+supabase client that dominate RSS for small files (it slows the run,
+so rows/s are not comparable with untraced runs). Results are printed
+as JSON.
+
+Usage:
+    python bench_import.py                                    # 1k and 10k rows, every mode
+    python bench_import.py --rows 50000 --mode import --latency-ms 80 --error-rate 0.05
+    python bench_import.py --bad-price 0.1 --unknown-breed 0.1 --duplicates 0.05
+    python bench_import.py --rows 100000 --mode validate-only --mode import --trace-memory
+    python bench_import.py --output import_bench.json
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+BACKEND_DIR = HERE.parent / 'backend'
+
+MODES = {
+    'validate-only': {'validate_only': True},
+    'dry-run': {'dry_run': True},
+    'import': {},
+}
+DEFAULT_ROWS = [1000, 10000]
+LOCATIONS = ['Rohtak, Haryana', 'Junagadh, Gujarat', 'Mehsana, Gujarat', 'Fazilka, Punjab',
+             'Karnal, Haryana', 'Bikaner, Rajasthan', 'Guntur, Andhra Pradesh', 'Jhansi, Uttar Pradesh']
+SELLERS = ['Ramesh Kumar', 'Suresh Patel', 'Amit Shah', 'Gurpreet Singh', 'Lakshmi Reddy', '']
+BAD_PRICES = ['₹85,000', '-5000', 'call for price', '0', '250000000']
+UNKNOWN_BREEDS = ['Holstein', 'Jersey', 'murrah', 'Gyr', 'Nili Ravi']
+STUB_KEY = 'bench.stub.key'  # the supabase client wants a JWT-shaped key
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+# =============================================================================
+# SYNTHETIC CSV
+# =============================================================================
+
+def template_columns() -> list:
+    with open(HERE / 'sample_template.csv', 'r', encoding='utf-8-sig') as f:
+        return next(csv.reader(f))
+
+
+def synthetic_rows(count: int, seed: int, bad_price: float, unknown_breed: float,
+                   missing: float, duplicates: float, valid_breeds: dict, required: list) -> tuple:
+    """`count` partner rows, the given shares of them dirty. Returns (rows, dirty counts)."""
+    rng = random.Random(seed)
+    rows = []
+    dirty = {'bad_price': 0, 'unknown_breed': 0, 'missing': 0, 'duplicates': 0}
+    for i in range(count):
+        if rows and rng.random() < duplicates:
+            rows.append(dict(rng.choice(rows)))
+            dirty['duplicates'] += 1
+            continue
+        animal = rng.choice(list(valid_breeds))
+        breed = rng.choice(valid_breeds[animal])
+        row = {
+            'name': f'{breed} {i}',
+            'breed': breed,
+            'animal_type': animal.title() if rng.random() < 0.8 else '',
+            'price': str(rng.randrange(30000, 200000, 500)),
+            'age': f'{rng.randint(2, 9)} Years',
+            'yield_amount': f'{rng.randint(6, 20)}L / Day',
+            'location': rng.choice(LOCATIONS),
+            'seller_name': rng.choice(SELLERS),
+            'image_url': f'https://example.com/listings/{seed}-{i}.jpg',
+            'is_verified': rng.choice(['true', 'false']),
+        }
+        roll = rng.random()
+        if roll < bad_price:
+            row['price'] = rng.choice(BAD_PRICES)
+            dirty['bad_price'] += 1
+        elif roll < bad_price + unknown_breed:
+            row['breed'] = rng.choice(UNKNOWN_BREEDS)
+            dirty['unknown_breed'] += 1
+        elif roll < bad_price + unknown_breed + missing:
+            row[rng.choice(required)] = ''
+            dirty['missing'] += 1
+        rows.append(row)
+    return rows, dirty
+
+
+def write_csv(path: Path, rows: list, columns: list):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# =============================================================================
+# IMPORTER RUNS
+# =============================================================================
+
+def peak_rss_mb() -> float:
+    """
+    Peak RSS of this process. On Linux from VmHWM: ru_maxrss survives
+    exec, so an importer started from a large parent reports the parent's peak.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 2 ** 10, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+def run_child(mode: str, csv_path: str, batch_size: int, trace_memory: bool = False) -> dict:
+    """Inside the importer process: one import, its output discarded, stats as JSON."""
+    started = time.perf_counter()
+    import import_csv
+    loaded = time.perf_counter()
+    report = {}
+    if trace_memory:
+        tracemalloc.start()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ok = import_csv.import_csv(csv_path, batch_size=batch_size, report=report, **MODES[mode])
+    finished = time.perf_counter()
+    if trace_memory:
+        report['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return {
+        'ok': ok,
+        **report,
+        'startup_seconds': round(loaded - started, 3),
+        'import_seconds': round(finished - loaded, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_mode(stub, mode: str, csv_path: Path, rows: int, batch_size: int, seed: int,
+             trace_memory: bool = False) -> dict:
+    """One importer process against the stand-in, from a clean listings table."""
+    with stub.lock:
+        stub.tables.clear()
+        stub.stats.update(requests=0, inserted=0, injected_errors=0)
+        stub.random.seed(seed)
+    env = {**os.environ, 'SUPABASE_URL': stub.url, 'SUPABASE_KEY': STUB_KEY}
+    started = time.perf_counter()
+    command = [sys.executable, __file__, '--child', mode, str(csv_path), '--insert-batch-size', str(batch_size)]
+    if trace_memory:
+        command.append('--trace-memory')
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f'{mode} importer failed: {process.stderr.strip()[-500:]}')
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    with stub.lock:
+        stub_stats = dict(stub.stats, rows=len(stub.tables.get('listings', [])))
+    return {
+        'rows': rows,
+        'mode': mode,
+        **result,
+        'rows_per_second': round(rows / result['import_seconds'], 1) if result['import_seconds'] else None,
+        'end_to_end_seconds': round(wall, 3),
+        'stub': stub_stats,
+    }
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import_csv.py against a local PostgREST stand-in')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='CSV sizes')
+    parser.add_argument('--mode', action='append', choices=list(MODES), help='Importer modes (default: all)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--bad-price', type=float, default=0.02, help='Share of rows with a bad price')
+    parser.add_argument('--unknown-breed', type=float, default=0.02, help='Share with an unknown breed')
+    parser.add_argument('--missing', type=float, default=0.01, help='Share missing a required field')
+    parser.add_argument('--duplicates', type=float, default=0.02, help='Share duplicating an earlier row')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Stand-in delay per request')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Share of inserts answered with 503')
+    parser.add_argument('--insert-batch-size', type=int, default=None,
+                        help="Rows per insert request (default: the importer's)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Report the importer's peak Python heap (tracemalloc, slower)")
+    parser.add_argument('--keep-csv', help='Write the generated CSVs to this directory')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'CSV'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], args.insert_batch_size, args.trace_memory)))
+        return
+
+    # Only the parent needs the stand-in (and numpy): the importer processes stay lean
+    sys.path.insert(0, str(BACKEND_DIR))
+    import postgrest_stub
+    import import_csv
+    batch_size = args.insert_batch_size or import_csv.INSERT_BATCH_SIZE
+    columns = template_columns()
+    stub = postgrest_stub.start(latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed)
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'batch_size': batch_size,
+            'insert_retries': import_csv.INSERT_RETRIES,
+            'trace_memory': args.trace_memory,
+        },
+        'runs': [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix='moomingle-import-bench-') as scratch:
+        directory = Path(args.keep_csv or scratch)
+        directory.mkdir(parents=True, exist_ok=True)
+        for count in args.rows:
+            rows, dirty = synthetic_rows(count, args.seed, args.bad_price, args.unknown_breed, args.missing,
+                                         args.duplicates, import_csv.VALID_BREEDS, import_csv.REQUIRED_COLUMNS)
+            csv_path = directory / f'synthetic_{count}.csv'
+            write_csv(csv_path, rows, columns)
+            log(f"📄 {count} rows ({csv_path.stat().st_size / 2 ** 20:.1f} MB), dirty: {dirty}")
+            for mode in args.mode or list(MODES):
+                run = run_mode(stub, mode, csv_path, count, batch_size, args.seed, args.trace_memory)
+                run['dirty'] = dirty
+                results['runs'].append(run)
+                log(f"   {mode:14} {run['rows_per_second'] or 0:>10.0f} rows/s  "
+                    f"{run['end_to_end_seconds']:7.2f} s end-to-end  {run['peak_rss_mb']:6.1f} MB peak  "
+                    + (f"{run['traced_peak_mb']:6.1f} MB heap  " if 'traced_peak_mb' in run else '') +
+                    f"valid {run['valid']}  inserted {run['inserted']}  failed {run['failed']}  "
+                    f"retries {run['retries']}")
+    stub.shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"✅ Results written to {args.output}")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
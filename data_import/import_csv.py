@@ -5,25 +5,31 @@ Moomingle CSV Import Script
 Bulk import cattle/buffalo listings from CSV files into Supabase.
 
 Usage:
-    python import_csv.py <csv_file> [--dry-run] [--validate-only]
+    python import_csv.py <csv_file> [--dry-run] [--validate-only] [--precompute]
 
 Examples:
     python import_csv.py sample_template.csv --dry-run      # Preview without importing
     python import_csv.py partner_data.csv                    # Import to database
     python import_csv.py data.csv --validate-only           # Only validate, no import
+    python import_csv.py data.csv --precompute              # Also embed + classify the photos
 """
 
 import csv
 import sys
 import os
+import math
+import time
 import argparse
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, NamedTuple, Optional, Iterable
 import json
+from json.encoder import encode_basestring_ascii
 
 # Supabase Python client
 try:
+    import httpx
     from supabase import create_client, Client
+    from postgrest.exceptions import APIError
 except ImportError:
     print("❌ Missing dependency. Install with: pip install supabase")
     sys.exit(1)
@@ -54,6 +60,11 @@ ALL_BREEDS = VALID_BREEDS['buffalo'] + VALID_BREEDS['cattle']
 REQUIRED_COLUMNS = ['name', 'breed', 'price', 'location']
 OPTIONAL_COLUMNS = ['animal_type', 'age', 'yield_amount', 'seller_name', 'image_url', 'is_verified']
 
+# Inserts: rows per request, and retries of a batch after a transient failure
+INSERT_BATCH_SIZE = 100
+INSERT_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5  # doubled after every attempt
+
 
 # =============================================================================
 # VALIDATION
@@ -83,6 +94,8 @@ def validate_row(row_num: int, row: Dict[str, str]) -> List[ValidationError]:
     if price_str:
         try:
             price = float(price_str.replace(',', ''))
+            if not math.isfinite(price):  # 'nan' / 'inf' parse, but are not JSON
+                raise ValueError(price_str)
             if price <= 0:
                 errors.append(ValidationError(row_num, 'price', "Price must be positive"))
             if price > 10000000:  # 1 crore max
@@ -124,52 +137,119 @@ def validate_row(row_num: int, row: Dict[str, str]) -> List[ValidationError]:
     return errors
 
 
-def validate_csv(rows: List[Dict[str, str]]) -> Tuple[List[Dict], List[ValidationError]]:
-    """Validate all CSV rows. Returns (valid_rows, all_errors)."""
+def read_records(rows: Iterable[Dict[str, str]],
+                 transform: bool = True) -> Tuple[List['ListingRecord'], List[ValidationError], int, int]:
+    """
+    Validate CSV rows one at a time and transform the valid ones, so only
+    the compact records are kept, not the parsed rows (with transform=False
+    nothing is kept). Returns (records, all_errors, row_count, valid_count).
+    """
     all_errors = []
-    valid_rows = []
-    
+    records = []
+    count = 0
+    valid = 0
+
     for i, row in enumerate(rows, start=2):  # Start at 2 (row 1 is header)
+        count += 1
         errors = validate_row(i, row)
         if errors:
             all_errors.extend(errors)
-        else:
-            valid_rows.append(row)
-    
-    return valid_rows, all_errors
+            continue
+        valid += 1
+        if transform:
+            records.append(transform_row(row))
+
+    return records, all_errors, count, valid
 
 
 # =============================================================================
 # DATA TRANSFORMATION
 # =============================================================================
 
-def transform_row(row: Dict[str, str]) -> Dict[str, Any]:
+class ListingRecord(NamedTuple):
+    """
+    One validated listing, ready to upload. A tuple with the low-cardinality
+    breed, animal type, age and yield strings interned, so a large import
+    holds each of those once: about 160 bytes per record on top of its free
+    text (name, location, seller, image URL), against about 570 for the
+    equivalent dict. created_at is stamped when its batch is uploaded.
+    """
+    name: str
+    breed: str
+    price: float
+    location: str
+    age: str
+    yield_amount: str
+    seller_name: Optional[str]
+    image_url: Optional[str]
+    is_verified: bool
+    animal_type: Optional[str]
+
+
+def transform_row(row: Dict[str, str]) -> ListingRecord:
     """Transform CSV row to Supabase-compatible format."""
-    
+    intern = sys.intern
+
     # Parse price
     price_str = row.get('price', '0').strip().replace(',', '')
-    price = float(price_str) if price_str else 0
-    
+    price = float(price_str) if price_str else 0.0
+
     # Parse is_verified
-    is_verified_str = row.get('is_verified', 'false').strip().lower()
+    is_verified_str = (row.get('is_verified') or 'false').strip().lower()
     is_verified = is_verified_str in ['true', '1', 'yes', 'verified']
-    
-    # Build the record
-    record = {
-        'name': row.get('name', '').strip(),
-        'breed': row.get('breed', '').strip(),
-        'price': price,
-        'location': row.get('location', '').strip(),
-        'age': row.get('age', 'N/A').strip() or 'N/A',
-        'yield_amount': row.get('yield_amount', 'N/A').strip() or 'N/A',
-        'seller_name': row.get('seller_name', '').strip() or None,
-        'image_url': row.get('image_url', '').strip() or None,
-        'is_verified': is_verified,
-        'animal_type': row.get('animal_type', '').strip() or None,
-        'created_at': datetime.utcnow().isoformat(),
-    }
-    
-    return record
+
+    seller_name = (row.get('seller_name') or '').strip()
+    animal_type = (row.get('animal_type') or '').strip()
+    return ListingRecord(
+        name=row.get('name', '').strip(),
+        breed=intern(row.get('breed', '').strip()),
+        price=price,
+        location=row.get('location', '').strip(),
+        age=intern((row.get('age') or '').strip() or 'N/A'),
+        yield_amount=intern((row.get('yield_amount') or '').strip() or 'N/A'),
+        seller_name=seller_name or None,
+        image_url=(row.get('image_url') or '').strip() or None,
+        is_verified=is_verified,
+        animal_type=intern(animal_type) if animal_type else None,
+    )
+
+
+def encode_batch(records: List[ListingRecord], encoded: Dict[str, str] = None) -> bytes:
+    """
+    The JSON body of one insert request, written directly from the records
+    (the same document json.dumps would produce for the equivalent dicts).
+    `encoded` caches the JSON of the interned columns across the batches of
+    one import. The batch shares one created_at, as a multi-row INSERT
+    shares now().
+    """
+    encode = encode_basestring_ascii
+    cache = {} if encoded is None else encoded
+
+    def interned(value: Optional[str]) -> str:
+        if value is None:
+            return 'null'
+        text = cache.get(value)
+        if text is None:
+            text = cache[value] = encode(value)
+        return text
+
+    def optional(value: Optional[str]) -> str:
+        return encode(value) if value is not None else 'null'
+
+    created_at = datetime.utcnow().isoformat()
+    parts = []
+    for record in records:
+        parts.append(
+            f'{{"name":{encode(record.name)},"breed":{interned(record.breed)},'
+            f'"price":{float.__repr__(record.price)},"location":{encode(record.location)},'
+            f'"age":{interned(record.age)},"yield_amount":{interned(record.yield_amount)},'
+            f'"seller_name":{optional(record.seller_name)},'
+            f'"image_url":{optional(record.image_url)},'
+            f'"is_verified":{"true" if record.is_verified else "false"},'
+            f'"animal_type":{interned(record.animal_type)},'
+            f'"created_at":"{created_at}"}}'
+        )
+    return ('[' + ','.join(parts) + ']').encode('ascii')
 
 
 # =============================================================================
@@ -181,31 +261,140 @@ def get_supabase_client() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
-def insert_listings(client: Client, records: List[Dict[str, Any]]) -> Tuple[int, int]:
-    """Insert records into Supabase. Returns (success_count, error_count)."""
+def is_transient(error: Exception) -> bool:
+    """
+    Safe to retry: failures where the batch was certainly not inserted, as
+    the insert is not idempotent. That is a connection never made (connect
+    errors and timeouts, no free pooled connection), PostgREST unable to
+    reach the database (PGRST0xx) and Postgres rollback, resource and
+    operator errors (40xxx, 53xxx, 57xxx), which abort the transaction.
+    A read timeout, a dropped connection or a bare 5xx from a proxy may
+    come after the rows were committed, and rejected data (22xxx, 23xxx,
+    42xxx, 4xx) would fail again: neither is retried.
+    """
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    code = str(getattr(error, 'code', None) or '')
+    return code.startswith(('PGRST0', '40', '53', '57'))
+
+
+def post_batch(client: Client, body: bytes):
+    """
+    POST an encoded batch to the listings table through the client's own
+    PostgREST session. Prefer: return=minimal, so the inserted rows are not
+    sent back. Errors are raised as postgrest APIErrors, as the query
+    builder would.
+    """
+    response = client.postgrest.session.post(
+        'listings', content=body,
+        headers={'Content-Type': 'application/json', 'Prefer': 'return=minimal'},
+    )
+    if response.is_success:
+        return
+    try:
+        error = response.json()
+    except ValueError:
+        error = None
+    if not isinstance(error, dict):
+        error = {'message': response.text}
+    error.setdefault('code', str(response.status_code))
+    raise APIError(error)
+
+
+def insert_listings(client: Client, records: List[ListingRecord],
+                    batch_size: int = INSERT_BATCH_SIZE) -> Tuple[int, int, int]:
+    """Insert records into Supabase. Returns (success_count, error_count, retries)."""
     success = 0
     errors = 0
-    
-    # Insert in batches of 100
-    batch_size = 100
+    retries = 0
+    encoded = {}  # breed / animal type / age / yield JSON, for this import only
+
     for i in range(0, len(records), batch_size):
         batch = records[i:i + batch_size]
-        try:
-            result = client.table('listings').insert(batch).execute()
-            success += len(batch)
-            print(f"  ✅ Inserted batch {i//batch_size + 1}: {len(batch)} records")
-        except Exception as e:
-            errors += len(batch)
-            print(f"  ❌ Failed batch {i//batch_size + 1}: {e}")
-    
-    return success, errors
+        number = i // batch_size + 1
+        body = encode_batch(batch, encoded)
+        for attempt in range(INSERT_RETRIES + 1):
+            try:
+                post_batch(client, body)
+                success += len(batch)
+                print(f"  ✅ Inserted batch {number}: {len(batch)} records")
+                break
+            except Exception as e:
+                if attempt < INSERT_RETRIES and is_transient(e):
+                    retries += 1
+                    print(f"  🔁 Batch {number} failed ({e}), retrying")
+                    time.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                    continue
+                errors += len(batch)
+                print(f"  ❌ Failed batch {number}: {e}")
+                break
+    
+    return success, errors, retries
+
+
+# =============================================================================
+# PHOTO PRECOMPUTE (optional)
+# =============================================================================
+
+def precompute_photos(records: List[ListingRecord], options: Dict[str, Any]) -> bool:
+    """
+    Embed and classify the listing photos into the backend's embedding store
+    and report listings whose breed the model disputes (see precompute.py).
+    Returns False if the model could not be loaded.
+    """
+    import precompute
+
+    print("🧠 Precomputing photo embeddings...")
+    try:
+        api = precompute.load_backend()
+        model = precompute.load_model(api, options.get('model'), options.get('prototypes'))
+    except Exception as e:
+        print(f"❌ Precompute needs the backend's dependencies and model: {e}")
+        return False
+
+    report = precompute.precompute(
+        api, model, records,
+        store_path=options.get('store') or precompute.DEFAULT_STORE,
+        batch_size=options.get('batch_size') or precompute.BATCH_SIZE,
+        workers=options.get('fetch_workers') or precompute.FETCH_WORKERS,
+        min_confidence=(options['mismatch_confidence'] if options.get('mismatch_confidence') is not None
+                        else precompute.MISMATCH_CONFIDENCE),
+    )
+    print(f"   Photos: {report['photos']} (model {report['model_version']}, {report['seconds']}s)")
+    print(f"   Embedded: {report['embedded']}, already stored: {report['stored']}")
+    print(f"   Store: {report['store']}")
+    if report['errors']:
+        print(f"   ⚠️  {report['fetch_errors']} downloads failed, {report['decode_errors']} files were not images:")
+        for error in report['errors'][:10]:
+            print(f"      • {error}")
+        if len(report['errors']) > 10:
+            print(f"      ... and {len(report['errors']) - 10} more")
+
+    flags = report['flags']
+    if flags:
+        print(f"\n⚠️  {len(flags)} listings disagree with the breed model:\n")
+        for flag in flags[:20]:
+            predicted = flag['predicted_breed'] or 'no cow/buffalo found'
+            print(f"   • Record {flag['record']} '{flag['name']}': CSV says {flag['csv_breed']}, "
+                  f"model says {predicted} ({flag['confidence']:.0%}) [{flag['reason']}]")
+        if len(flags) > 20:
+            print(f"   ... and {len(flags) - 20} more")
+        if options.get('flags_csv'):
+            precompute.write_flags(options['flags_csv'], flags)
+            print(f"   Written to {options['flags_csv']}")
+    else:
+        print("   ✅ No breed disagreements")
+    print()
+    return True
 
 
 # =============================================================================
 # MAIN IMPORT FUNCTION
 # =============================================================================
 
-def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False) -> bool:
+def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False,
+               precompute_options: Dict[str, Any] = None, batch_size: int = INSERT_BATCH_SIZE,
+               report: Dict[str, Any] = None) -> bool:
     """
     Main import function.
     
@@ -213,6 +402,12 @@ def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False
         filepath: Path to CSV file
         dry_run: If True, validate and show what would be imported without actually importing
         validate_only: If True, only validate the CSV without importing
+        precompute_options: If given, embed and classify the listing photos first
+            (keys: store, model, prototypes, batch_size, fetch_workers,
+            mismatch_confidence, flags_csv)
+        batch_size: Rows per insert request
+        report: If given, filled with the row counts and insert retries
+            (read by bench_import.py)
     
     Returns:
         True if successful, False otherwise
@@ -229,37 +424,37 @@ def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False
         print(f"❌ File not found: {filepath}")
         return False
     
-    # Read CSV
+    # Read, validate and transform the CSV in one pass
     print("📖 Reading CSV file...")
     try:
         with open(filepath, 'r', encoding='utf-8-sig') as f:
             reader = csv.DictReader(f)
-            rows = list(reader)
+            columns = reader.fieldnames or []
+
+            # Check columns
+            print("🔍 Checking columns...")
+            missing_cols = [col for col in REQUIRED_COLUMNS if col not in columns]
+            if columns and missing_cols:
+                print(f"❌ Missing required columns: {', '.join(missing_cols)}")
+                print(f"   Required: {', '.join(REQUIRED_COLUMNS)}")
+                print(f"   Found: {', '.join(columns)}")
+                return False
+            if columns:
+                print(f"   ✅ All required columns present\n")
+
+            # Validate rows
+            print("✅ Validating data...")
+            records, errors, row_count, valid_count = read_records(reader, transform=not validate_only)
     except Exception as e:
         print(f"❌ Error reading CSV: {e}")
         return False
-    
-    print(f"   Found {len(rows)} rows\n")
-    
-    if not rows:
+
+    print(f"   Found {row_count} rows")
+
+    if not row_count:
         print("❌ CSV file is empty")
         return False
-    
-    # Check columns
-    print("🔍 Checking columns...")
-    first_row = rows[0]
-    missing_cols = [col for col in REQUIRED_COLUMNS if col not in first_row]
-    if missing_cols:
-        print(f"❌ Missing required columns: {', '.join(missing_cols)}")
-        print(f"   Required: {', '.join(REQUIRED_COLUMNS)}")
-        print(f"   Found: {', '.join(first_row.keys())}")
-        return False
-    print(f"   ✅ All required columns present\n")
-    
-    # Validate rows
-    print("✅ Validating data...")
-    valid_rows, errors = validate_csv(rows)
-    
+
     if errors:
         print(f"\n⚠️  Found {len(errors)} validation errors:\n")
         for error in errors[:20]:  # Show first 20 errors
@@ -268,35 +463,37 @@ def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False
             print(f"   ... and {len(errors) - 20} more errors")
         print()
     
-    print(f"   Valid rows: {len(valid_rows)} / {len(rows)}\n")
+    print(f"   Valid rows: {valid_count} / {row_count}\n")
+    if report is not None:
+        report.update(rows=row_count, valid=valid_count, inserted=0, failed=0, retries=0)
     
     if validate_only:
         print("✅ Validation complete (validate-only mode)")
         return len(errors) == 0
     
-    if not valid_rows:
+    if not records:
         print("❌ No valid rows to import")
         return False
     
-    # Transform data
-    print("🔄 Transforming data...")
-    records = [transform_row(row) for row in valid_rows]
-    print(f"   Prepared {len(records)} records\n")
+    print(f"🔄 Prepared {len(records)} records\n")
     
     # Preview (dry run or first few records)
     if dry_run or len(records) <= 5:
         print("📋 Preview of records to import:")
         for i, rec in enumerate(records[:5], 1):
             print(f"\n   Record {i}:")
-            print(f"      Name: {rec['name']}")
-            print(f"      Breed: {rec['breed']} ({rec.get('animal_type', 'Unknown')})")
-            print(f"      Price: ₹{rec['price']:,.0f}")
-            print(f"      Location: {rec['location']}")
-            print(f"      Verified: {rec['is_verified']}")
+            print(f"      Name: {rec.name}")
+            print(f"      Breed: {rec.breed} ({rec.animal_type or 'Unknown'})")
+            print(f"      Price: ₹{rec.price:,.0f}")
+            print(f"      Location: {rec.location}")
+            print(f"      Verified: {rec.is_verified}")
         if len(records) > 5:
             print(f"\n   ... and {len(records) - 5} more records")
         print()
     
+    if precompute_options is not None and not precompute_photos(records, precompute_options):
+        return False
+    
     if dry_run:
         print("✅ Dry run complete. No data was imported.")
         print(f"   Would import {len(records)} records to Supabase.")
@@ -306,14 +503,17 @@ def import_csv(filepath: str, dry_run: bool = False, validate_only: bool = False
     print("📤 Importing to Supabase...")
     try:
         client = get_supabase_client()
-        success, failed = insert_listings(client, records)
+        success, failed, retries = insert_listings(client, records, batch_size)
+        if report is not None:
+            report.update(inserted=success, failed=failed, retries=retries)
         
         print(f"\n{'='*60}")
         print(f"  IMPORT COMPLETE")
         print(f"{'='*60}")
         print(f"  ✅ Successfully imported: {success}")
         print(f"  ❌ Failed: {failed}")
-        print(f"  ⚠️  Skipped (validation errors): {len(rows) - len(valid_rows)}")
+        print(f"  🔁 Retried batches: {retries}")
+        print(f"  ⚠️  Skipped (validation errors): {row_count - valid_count}")
         print(f"{'='*60}\n")
         
         return failed == 0
@@ -336,6 +536,7 @@ Examples:
   python import_csv.py sample_template.csv --dry-run
   python import_csv.py partner_data.csv
   python import_csv.py data.csv --validate-only
+  python import_csv.py data.csv --dry-run --precompute --flags-csv flagged.csv
 
 CSV Format:
   Required columns: name, breed, price, location
@@ -352,13 +553,45 @@ Valid Breeds:
                         help='Validate and preview without importing')
     parser.add_argument('--validate-only', action='store_true',
                         help='Only validate CSV, do not import')
+    parser.add_argument('--insert-batch-size', type=int, default=INSERT_BATCH_SIZE,
+                        help=f'Rows per insert request (default: {INSERT_BATCH_SIZE})')
+    
+    precompute_group = parser.add_argument_group('photo precompute (needs backend/requirements.txt)')
+    precompute_group.add_argument('--precompute', action='store_true',
+                                  help='Embed + classify image_url photos into the embedding store '
+                                       'and flag breed disagreements')
+    precompute_group.add_argument('--store', help='Embedding store file (default: MOOMINGLE_EMBEDDING_STORE '
+                                                  'or backend/embeddings.sqlite3)')
+    precompute_group.add_argument('--model', help='Local model.onnx (default: the Hugging Face model)')
+    precompute_group.add_argument('--prototypes', help='prototypes.json for --model')
+    precompute_group.add_argument('--batch-size', type=int, help='Photos per model run (default: 64)')
+    precompute_group.add_argument('--fetch-workers', type=int, help='Concurrent downloads (default: 8)')
+    precompute_group.add_argument('--mismatch-confidence', type=float,
+                                  help='Flag a different breed predicted at least this confidently (default: 0.6)')
+    precompute_group.add_argument('--flags-csv', help='Write the flagged listings to this CSV')
     
     args = parser.parse_args()
+    if args.model and not args.prototypes:
+        parser.error('--model needs --prototypes')
+    
+    precompute_options = None
+    if args.precompute:
+        precompute_options = {
+            'store': args.store,
+            'model': args.model,
+            'prototypes': args.prototypes,
+            'batch_size': args.batch_size,
+            'fetch_workers': args.fetch_workers,
+            'mismatch_confidence': args.mismatch_confidence,
+            'flags_csv': args.flags_csv,
+        }
     
     success = import_csv(
         args.csv_file, 
         dry_run=args.dry_run, 
-        validate_only=args.validate_only
+        validate_only=args.validate_only,
+        precompute_options=precompute_options,
+        batch_size=args.insert_batch_size
     )
     
     sys.exit(0 if success else 1)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Moomingle Import Precompute
+===========================
+Embed and classify the photos of imported listings ahead of time
+(import_csv.py --precompute).
+
+Photos are downloaded by a bounded pool of fetchers, the next batch while
+the current one is on the model. Each batch is embedded and scored in one
+model run with the backend's own preprocessing, and the embeddings are
+written to the backend's persistent embedding store (see
+backend/embedding_store.py), keyed by image hash + model version. An API
+started with MOOMINGLE_EMBEDDING_STORE pointing at the same file serves
+the first classification and similarity lookup of these listings without
+running the model.
+
+Listings whose CSV breed the model confidently contradicts, or whose photo
+it does not recognise as a cow or buffalo, are flagged for review.
+"""
+
+import csv
+import io
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+DEFAULT_STORE = os.environ.get('MOOMINGLE_EMBEDDING_STORE', str(BACKEND_DIR / 'embeddings.sqlite3'))
+
+FETCH_WORKERS = 8               # concurrent downloads
+FETCH_TIMEOUT = 15              # seconds per photo
+MAX_PHOTO_BYTES = 20 * 2**20    # larger downloads are abandoned
+BATCH_SIZE = 64                 # photos per model run
+MISMATCH_CONFIDENCE = 0.6       # flag a different breed predicted at least this confidently
+
+FLAG_COLUMNS = ['record', 'name', 'image_url', 'csv_breed', 'predicted_breed',
+                'confidence', 'csv_breed_score', 'reason']
+
+
+# =============================================================================
+# BACKEND
+# =============================================================================
+
+def load_backend():
+    """The backend's api module, imported without downloading the model."""
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault('MOOMINGLE_PRELOAD_MODEL', '0')
+    import api
+    return api
+
+
+def load_model(api, model_path: str = None, prototypes_path: str = None):
+    """Local model files if given, else the Hugging Face model the API serves."""
+    if model_path:
+        api.models.install(api.models.load_files(model_path, prototypes_path))
+    else:
+        api.load_model()
+    model = api.models.current()
+    if model is None:
+        raise RuntimeError('Model could not be loaded (see the messages above)')
+    return model
+
+
+# =============================================================================
+# DOWNLOADS
+# =============================================================================
+
+def fetch_photo(url: str, timeout: float = FETCH_TIMEOUT) -> bytes:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        data = response.read(MAX_PHOTO_BYTES + 1)
+    if len(data) > MAX_PHOTO_BYTES:
+        raise ValueError(f'larger than {MAX_PHOTO_BYTES // 2**20} MB')
+    return data
+
+
+def fetch_batches(urls: List[str], batch_size: int, workers: int, fetch=fetch_photo):
+    """
+    Yield [(url, bytes or exception)] batches in order. At most `workers`
+    downloads run at once, and only the next batch is fetched ahead of the
+    one being processed, so memory stays at two batches of photos.
+    """
+    batches = [urls[i:i + batch_size] for i in range(0, len(urls), batch_size)]
+
+    def attempt(url):
+        try:
+            return fetch(url)
+        except Exception as e:  # Broken links are reported, not fatal
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='precompute-fetch') as pool:
+        ahead = [pool.submit(attempt, url) for url in batches[0]] if batches else []
+        for i, batch in enumerate(batches):
+            current = ahead
+            if i + 1 < len(batches):
+                ahead = [pool.submit(attempt, url) for url in batches[i + 1]]
+            yield [(url, future.result()) for url, future in zip(batch, current)]
+
+
+# =============================================================================
+# PRECOMPUTE
+# =============================================================================
+
+def breed_flag(record: Any, prediction: dict, min_confidence: float):
+    """Why the model contradicts the CSV row (None if it does not)."""
+    if prediction['status'] == 'rejected':
+        return 'not_cattle_or_buffalo'
+    if prediction['status'] != 'ok' or prediction['breed'] == record.breed:
+        return None
+    if prediction['confidence'] < min_confidence:
+        return None
+    csv_type = (record.animal_type or '').lower().replace('cow', 'cattle')
+    if csv_type and prediction['animal_type'].lower() != csv_type:
+        return 'animal_type_mismatch'
+    return 'breed_mismatch'
+
+
+def precompute(api, model, records: List[Any], store_path: str = DEFAULT_STORE,
+               batch_size: int = BATCH_SIZE, workers: int = FETCH_WORKERS,
+               min_confidence: float = MISMATCH_CONFIDENCE, fetch=fetch_photo) -> dict:
+    """
+    Embed, store and score the photos of `records` (import_csv
+    ListingRecords). Photos shared by several listings are processed once, photos
+    already in the store are only scored. Returns counts and the flags.
+    """
+    from PIL import Image
+    import numpy as np
+    from embedding_store import EmbeddingStore
+
+    started = time.perf_counter()
+    store = EmbeddingStore(store_path)
+    version = model.model_version
+    by_url = {}
+    for i, record in enumerate(records):
+        if record.image_url:
+            by_url.setdefault(record.image_url, []).append(i)
+    report = {'photos': len(by_url), 'fetch_errors': 0, 'decode_errors': 0, 'stored': 0,
+              'embedded': 0, 'model_version': version, 'store': store_path, 'errors': [], 'flags': []}
+    predictions = {}
+
+    for batch in fetch_batches(list(by_url), batch_size, workers, fetch):
+        photos = []
+        for url, data in batch:
+            if isinstance(data, Exception):
+                report['fetch_errors'] += 1
+                report['errors'].append(f'{url}: {data}')
+            else:
+                photos.append((url, api.image_hash(data), data))
+        stored = store.get_many([key for _, key, _ in photos], version)
+
+        embeddings, computed, images = {}, [], []
+        for url, key, data in photos:
+            if key in stored:
+                embeddings[url] = stored[key]
+                continue
+            try:
+                image = Image.open(io.BytesIO(data))
+                image.load()
+            except Exception as e:
+                report['decode_errors'] += 1
+                report['errors'].append(f'{url}: not an image ({e})')
+                continue
+            computed.append((url, key))
+            images.append(image.convert('RGB'))
+        if images:
+            for (url, key), embedding in zip(computed, api.compute_embeddings(images, model)):
+                embeddings[url] = embedding
+            store.put_many([(key, embeddings[url]) for url, key in computed], version)
+        report['stored'] += len(stored)
+        report['embedded'] += len(computed)
+
+        if embeddings:
+            urls = list(embeddings)
+            for url, prediction in zip(urls, model.scorer.score(np.stack([embeddings[u] for u in urls]))):
+                predictions[url] = prediction
+        print(f"   🧠 {len(predictions)} / {len(by_url)} photos")
+
+    for url, prediction in predictions.items():
+        for i in by_url[url]:
+            reason = breed_flag(records[i], prediction, min_confidence)
+            if reason:
+                report['flags'].append({
+                    'record': i + 1,
+                    'name': records[i].name,
+                    'image_url': url,
+                    'csv_breed': records[i].breed,
+                    'predicted_breed': prediction['breed'],
+                    'confidence': prediction['confidence'],
+                    'csv_breed_score': prediction['all_scores'].get(records[i].breed, 0.0),
+                    'reason': reason,
+                })
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def write_flags(path: str, flags: List[dict]):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FLAG_COLUMNS)
+        writer.writeheader()
+        writer.writerows(flags)
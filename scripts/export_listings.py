@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Export listings, offers and purchases to local columnar files for analytics.
+
+Each table becomes a directory of Hive-style monthly partitions (by the
+month the row was created), one Arrow IPC or Parquet file each:
+
+    exports/listings/created_month=2026-10/data.arrow
+    exports/listings/_state.json            # format, watermark, rows per partition
+
+The first run (or --full) pages through the table by (creation time, id)
+and writes each month as soon as it is complete, so memory stays at one
+partition. Later runs only pull rows whose updated_at is at or after the
+saved watermark (minus --overlap-seconds, for transactions that committed
+late), over the (updated_at, id) index. Each touched partition is read
+back memory-mapped, the changed rows replace their previous versions (by
+id) and the file is replaced atomically; the other partitions are not
+rewritten. Rows deleted from the database only disappear with --full.
+
+breed, location, animal_type and the status columns are dictionary-encoded,
+timestamps are UTC timestamps and amounts float64. Arrow files are written
+uncompressed so they can be memory-mapped without copying; Parquet files
+use zstd.
+
+Analyses then read the local copy instead of the live database:
+
+    from export_listings import load
+    listings = load('exports', 'listings')      # pyarrow.Table, memory-mapped
+    listings.to_pandas().groupby('breed', observed=True)['price'].median()
+
+or any tool that reads Hive-partitioned Arrow/Parquet (pyarrow.dataset,
+DuckDB, Polars, Spark). Files and directories starting with '_' or '.' are
+not data.
+
+Needs: pip install pyarrow requests. Run backend/migrations/
+add_listing_updated_at.sql and add_export_watermarks.sql first.
+
+Usage:
+    python scripts/export_listings.py                     # listings, offers, purchases -> exports/
+    python scripts/export_listings.py listings --format parquet --output-dir /data/moomingle
+    python scripts/export_listings.py --full              # rebuild (also drops deleted rows)
+    python scripts/export_listings.py --info              # what is exported, without the database
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    print("❌ Missing dependencies. Install with:")
+    print("   pip install pyarrow")
+    sys.exit(1)
+
+from supabase_rest import PAGE_SIZE, REPO_ROOT, SupabaseError, require_client
+
+# table: (partition column, dictionary-encoded columns)
+TABLES = {
+    'listings': ('created_at', ['breed', 'location', 'animal_type', 'status']),
+    'offers': ('created_at', ['status']),
+    'purchases': ('purchased_at', ['payment_method', 'payment_status']),
+}
+WATERMARK = 'updated_at'
+TIMESTAMP_COLUMNS = {'created_at', 'updated_at', 'purchased_at', 'completed_at', 'expires_at'}
+AMOUNT_COLUMNS = {'price', 'offer_amount', 'counter_amount', 'purchase_price'}
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+DEFAULT_OUTPUT = REPO_ROOT / 'exports'
+OVERLAP_SECONDS = 300
+NO_PARTITION = '__HIVE_DEFAULT_PARTITION__'     # rows without a creation time
+STATE_FILE = '_state.json'
+
+
+# =============================================================================
+# ARROW CONVERSION
+# =============================================================================
+
+def _column(name: str, values: list, dictionary: list) -> pa.Array:
+    if any(isinstance(v, (dict, list)) for v in values):
+        values = [None if v is None else json.dumps(v, ensure_ascii=False, separators=(',', ':'))
+                  for v in values]
+    if name in TIMESTAMP_COLUMNS:
+        return pa.array(values, pa.string()).cast(TIMESTAMP)
+    if name in AMOUNT_COLUMNS:
+        return pa.array([None if v is None else float(v) for v in values], pa.float64())
+    if name in dictionary:
+        return pa.array([None if v is None else str(v) for v in values], pa.string()).dictionary_encode()
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):  # mixed types: keep them as text
+        array = pa.array([None if v is None else str(v) for v in values], pa.string())
+    return array.cast(pa.string()) if pa.types.is_null(array.type) else array
+
+
+def to_arrow(rows: list, dictionary: list) -> pa.Table:
+    """PostgREST rows (JSON objects) -> Arrow table with the export's column types."""
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    return pa.table([_column(name, [row.get(name) for row in rows], dictionary) for name in names],
+                    names=names)
+
+
+def concat(tables: list) -> pa.Table:
+    """One table with one chunk per column and one dictionary per encoded column."""
+    table = pa.concat_tables(tables, promote_options='permissive') if len(tables) > 1 else tables[0]
+    return table.unify_dictionaries().combine_chunks()
+
+
+# =============================================================================
+# PARTITION FILES
+# =============================================================================
+
+def partition_key(value) -> str:
+    """'2026-10-19T18:56:26+00:00' -> '2026-10' (PostgREST returns UTC)."""
+    return value[:7] if value else NO_PARTITION
+
+
+def partition_dir(table_dir: Path, column: str, key: str) -> Path:
+    return table_dir / f'{column.rsplit("_", 1)[0]}_month={key}'
+
+
+def read_file(path: Path) -> pa.Table:
+    """A partition file, memory-mapped (zero-copy for Arrow IPC)."""
+    if path.suffix == '.arrow':
+        return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    return pq.read_table(path, memory_map=True)
+
+
+def write_file(path: Path, table: pa.Table):
+    """Write next to `path`, then rename over it: readers never see half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f'.{path.name}.partial')
+    if path.suffix == '.arrow':
+        with pa.OSFile(str(partial), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, partial, compression='zstd')
+    os.replace(partial, path)
+
+
+def load_state(table_dir: Path):
+    try:
+        return json.loads((table_dir / STATE_FILE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(table_dir: Path, state: dict):
+    partial = table_dir / f'.{STATE_FILE}.partial'
+    partial.write_text(json.dumps(state, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(partial, table_dir / STATE_FILE)
+
+
+def load(output_dir, table: str, columns: list = None) -> pa.Table:
+    """An exported table, every partition memory-mapped and concatenated."""
+    table_dir = Path(output_dir) / table
+    state = load_state(table_dir)
+    if state is None:
+        raise FileNotFoundError(f'{table_dir} has no export (run scripts/export_listings.py {table})')
+    paths = sorted(table_dir.glob(f'*=*/data{FORMATS[state["format"]]}'))
+    parts = [read_file(path) for path in paths]
+    if columns:
+        parts = [part.select([c for c in columns if c in part.column_names]) for part in parts]
+    return pa.concat_tables(parts, promote_options='permissive') if parts else pa.table({})
+
+
+# =============================================================================
+# EXPORT
+# =============================================================================
+
+def _timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _later(a, b):
+    """The later of two watermark strings (None is earliest)."""
+    if a is None or b is None:
+        return a or b
+    return a if _timestamp(a) >= _timestamp(b) else b
+
+
+def latest_change(client, table: str):
+    """The newest updated_at in the table, read before a full export starts."""
+    rows = client.request('GET', table, {'select': WATERMARK, 'order': f'{WATERMARK}.desc.nullslast',
+                                         'limit': 1}).json()
+    return rows[0][WATERMARK] if rows else None
+
+
+def export_full(client, table: str, output_dir: Path, fmt: str, page_size: int, log) -> dict:
+    """
+    Rebuild the whole table in a staging directory, one partition at a
+    time, and swap it in. The watermark is the newest change before the
+    scan, so rows changed during the scan are pulled again next time.
+    """
+    column, dictionary = TABLES[table]
+    watermark = latest_change(client, table)
+    staging = output_dir / f'.{table}.staging'
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    rows_per_partition = {}
+    current, buffered = None, []
+
+    def flush():
+        if buffered:
+            data = concat(buffered)
+            write_file(partition_dir(staging, column, current) / f'data{FORMATS[fmt]}', data)
+            rows_per_partition[current] = data.num_rows
+            buffered.clear()
+
+    fetched = 0
+    for page in client.pages(table, limit=page_size, order=(column, 'id')):
+        groups = {}
+        for row in page:
+            groups.setdefault(partition_key(row.get(column)), []).append(row)
+        for key, rows in groups.items():
+            if key != current:
+                flush()
+                current = key
+            buffered.append(to_arrow(rows, dictionary))
+        fetched += len(page)
+        log(f'{fetched} rows')
+    flush()
+
+    state = {'table': table, 'format': fmt, 'partition_column': column, 'watermark': watermark,
+             'rows': rows_per_partition, 'full_export_at': datetime.now(timezone.utc).isoformat()}
+    state['exported_at'] = state['full_export_at']
+    save_state(staging, state)
+
+    table_dir, retired = output_dir / table, output_dir / f'.{table}.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if table_dir.exists():
+        table_dir.rename(retired)
+    staging.rename(table_dir)
+    shutil.rmtree(retired, ignore_errors=True)
+    return {'mode': 'full', 'fetched': fetched, 'partitions_written': len(rows_per_partition), 'state': state}
+
+
+def export_incremental(client, table: str, output_dir: Path, state: dict, overlap: float,
+                       page_size: int, log) -> dict:
+    """Pull rows changed since the watermark and merge them into their partitions."""
+    column, dictionary = TABLES[table]
+    table_dir = output_dir / table
+    filters = None
+    if state['watermark']:
+        since = _timestamp(state['watermark']) - timedelta(seconds=overlap)
+        filters = {WATERMARK: f'gte.{since.isoformat()}'}
+
+    changed, watermark, fetched = {}, state['watermark'], 0
+    for page in client.pages(table, limit=page_size, filters=filters, order=(WATERMARK, 'id')):
+        for row in page:
+            changed.setdefault(partition_key(row.get(column)), []).append(row)
+        watermark = _later(watermark, page[-1].get(WATERMARK))
+        fetched += len(page)
+        log(f'{fetched} changed rows')
+
+    for key, rows in sorted(changed.items()):
+        path = partition_dir(table_dir, column, key) / f'data{FORMATS[state["format"]]}'
+        latest = {}
+        for row in rows:  # in (updated_at, id) order: the last version wins
+            latest[row['id']] = row
+        update = to_arrow(list(latest.values()), dictionary)
+        parts = [update]
+        if path.exists():
+            existing = read_file(path)
+            replaced = pc.is_in(existing['id'], value_set=update['id'].cast(existing.schema.field('id').type))
+            parts.insert(0, existing.filter(pc.invert(replaced)))
+        data = concat(parts).sort_by([(column, 'ascending'), ('id', 'ascending')])
+        write_file(path, data)
+        state['rows'][key] = data.num_rows
+
+    state['watermark'] = watermark
+    state['exported_at'] = datetime.now(timezone.utc).isoformat()
+    save_state(table_dir, state)
+    return {'mode': 'incremental', 'fetched': fetched, 'partitions_written': len(changed), 'state': state}
+
+
+def export_table(client, table: str, output_dir: Path, fmt: str, full: bool, overlap: float,
+                 page_size: int) -> dict:
+    state = load_state(output_dir / table)
+    fmt = fmt or (state or {}).get('format') or 'arrow'
+
+    def log(message):
+        print(f'   {table}: {message}', flush=True)
+
+    started = time.perf_counter()
+    if full or state is None or state.get('format') != fmt:
+        result = export_full(client, table, output_dir, fmt, page_size, log)
+    else:
+        result = export_incremental(client, table, output_dir, state, overlap, page_size, log)
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    return result
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def describe(output_dir: Path, tables: list) -> int:
+    """Print what is exported, without contacting the database."""
+    for table in tables:
+        state = load_state(output_dir / table)
+        if state is None:
+            print(f"⚪ {table:12} not exported")
+            continue
+        size = sum(p.stat().st_size for p in (output_dir / table).glob('*=*/*') if p.is_file())
+        print(f"📦 {table:12} {sum(state['rows'].values())} rows in {len(state['rows'])} partitions, "
+              f"{size / 2**20:.1f} MB {state['format']}")
+        print(f"   watermark {state['watermark']}, exported {state['exported_at']}, "
+              f"last full export {state['full_export_at']}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Incremental columnar export of listings, offers and purchases')
+    parser.add_argument('tables', nargs='*', default=list(TABLES), metavar='table',
+                        help=f'{" | ".join(TABLES)} (default: all)')
+    parser.add_argument('--output-dir', type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument('--format', choices=list(FORMATS), help='arrow (IPC, default) or parquet; '
+                                                                'changing it rebuilds the export')
+    parser.add_argument('--full', action='store_true', help='Rebuild instead of pulling changes')
+    parser.add_argument('--overlap-seconds', type=float, default=OVERLAP_SECONDS,
+                        help='Re-read changes this far before the watermark')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--info', action='store_true', help='Describe the local export and exit')
+    args = parser.parse_args(argv)
+    unknown = [table for table in args.tables if table not in TABLES]
+    if unknown:
+        parser.error(f'cannot export {", ".join(unknown)} (choose from {", ".join(TABLES)})')
+
+    if args.info:
+        return describe(args.output_dir, args.tables)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"📤 Exporting {', '.join(args.tables)} to {args.output_dir}")
+    with require_client(pool_size=len(args.tables)) as client:
+        with ThreadPoolExecutor(max_workers=len(args.tables), thread_name_prefix='export') as pool:
+            futures = {table: pool.submit(export_table, client, table, args.output_dir, args.format,
+                                          args.full, args.overlap_seconds, args.page_size)
+                       for table in args.tables}
+            results = {}
+            for table, future in futures.items():
+                try:
+                    results[table] = future.result()
+                except SupabaseError as e:
+                    results[table] = e
+
+    print(f"\n{'=' * 60}")
+    failed = 0
+    for table, result in results.items():
+        if isinstance(result, SupabaseError):
+            failed += 1
+            hint = ' (run backend/migrations/add_export_watermarks.sql)' if result.status == 400 else ''
+            print(f"❌ {table:12} {result}{hint}")
+            continue
+        state = result['state']
+        print(f"✅ {table:12} {result['mode']}: {result['fetched']} rows pulled, "
+              f"{result['partitions_written']} partitions written, "
+              f"{sum(state['rows'].values())} rows exported ({result['seconds']}s)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Inspect the data in Supabase, table by table.
+
+Rows are paged with keyset pagination (see supabase_rest.py) and written
+as they arrive, so memory stays at a few pages whatever the table size.
+Tables are fetched concurrently over one pooled session: while one table
+is being written, the next ones are already downloading into small
+bounded buffers. Counts are exact (Prefer: count=exact), not the length
+of a truncated response.
+
+Usage:
+    python scripts/inspect_data.py                          # listings, chats, messages
+    python scripts/inspect_data.py --count-only listings profiles offers
+    python scripts/inspect_data.py listings --format ndjson > listings.ndjson
+    python scripts/inspect_data.py --format csv --output-dir dump/
+"""
+
+import argparse
+import csv
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from supabase_rest import PAGE_SIZE, SupabaseError, require_client
+
+DEFAULT_TABLES = ['listings', 'chats', 'messages']
+# Terminal view: the columns worth a glance (other tables show all columns)
+PREVIEW_COLUMNS = {
+    'listings': ['id', 'name', 'breed', 'price', 'location', 'is_verified', 'status'],
+    'chats': ['id', 'listing_name', 'seller_name', 'last_message', 'last_message_time'],
+    'messages': ['id', 'chat_id', 'sender_id', 'text', 'is_read', 'created_at'],
+}
+ICONS = {'listings': '📊', 'chats': '💬', 'messages': '📨'}
+PREFETCH_PAGES = 4      # pages buffered per table ahead of the writer
+_DONE = object()
+
+
+# =============================================================================
+# WRITERS
+# =============================================================================
+
+def _cell(value) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return '' if value is None else str(value)
+
+
+class TerminalWriter:
+    """One line per row, the preview columns only, long values cut short."""
+
+    def __init__(self, table: str, out, width: int = 40):
+        self.table = table
+        self.out = out
+        self.width = width
+
+    def header(self, total):
+        count = f'{total} rows' if total is not None else 'count unknown'
+        self.out.write(f"\n{ICONS.get(self.table, '📋')} {self.table.upper()} TABLE ({count})\n{'=' * 80}\n")
+
+    def write(self, rows: list):
+        columns = PREVIEW_COLUMNS.get(self.table)
+        for row in rows:
+            fields = [(c, row.get(c)) for c in columns] if columns else row.items()
+            values = []
+            for name, value in fields:
+                text = _cell(value)
+                values.append(f'{name}={text[:self.width - 1] + "…" if len(text) > self.width else text}')
+            self.out.write('  ' + '  '.join(values) + '\n')
+
+    def footer(self, written: int):
+        if not written:
+            self.out.write(f'  (No {self.table} yet)\n')
+
+
+class NdjsonWriter:
+    """One JSON object per line; with several tables on one stream, each row carries `_table`."""
+
+    def __init__(self, table: str, out, tag: bool):
+        self.table = table
+        self.out = out
+        self.tag = tag
+
+    def header(self, total):
+        pass
+
+    def write(self, rows: list):
+        for row in rows:
+            if self.tag:
+                row = {'_table': self.table, **row}
+            self.out.write(json.dumps(row, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+
+    def footer(self, written: int):
+        pass
+
+
+class CsvWriter:
+    """CSV with the columns of the first row; JSON columns are written as JSON text."""
+
+    def __init__(self, table: str, out):
+        self.out = out
+        self.writer = None
+
+    def header(self, total):
+        pass
+
+    def write(self, rows: list):
+        if self.writer is None and rows:
+            self.writer = csv.DictWriter(self.out, fieldnames=list(rows[0]), extrasaction='ignore')
+            self.writer.writeheader()
+        for row in rows:
+            self.writer.writerow({k: _cell(v) for k, v in row.items()})
+
+    def footer(self, written: int):
+        pass
+
+
+def make_writer(fmt: str, table: str, out, several: bool):
+    if fmt == 'ndjson':
+        return NdjsonWriter(table, out, tag=several)
+    if fmt == 'csv':
+        return CsvWriter(table, out)
+    return TerminalWriter(table, out)
+
+
+# =============================================================================
+# FETCHING
+# =============================================================================
+
+class TableFeed:
+    """Downloads one table's pages in a worker thread into a bounded buffer."""
+
+    def __init__(self, client, table: str, args, stop: threading.Event):
+        self.client = client
+        self.table = table
+        self.args = args
+        self.stop = stop
+        self.total = None
+        self.buffer = queue.Queue(maxsize=PREFETCH_PAGES)
+
+    def _put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.buffer.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _set_total(self, total):
+        self.total = total
+
+    def run(self):
+        try:
+            if self.args.count_only:
+                self.total = self.client.count(self.table)
+            else:
+                fetched = 0
+                for rows in self.client.pages(self.table, limit=self.args.page_size, select=self.args.select,
+                                              order=tuple(self.args.order), on_total=self._set_total):
+                    if self.args.limit is not None:
+                        rows = rows[:self.args.limit - fetched]
+                    fetched += len(rows)
+                    if not self._put(rows) or (self.args.limit is not None and fetched >= self.args.limit):
+                        break
+            self._put(_DONE)
+        except SupabaseError as e:
+            self._put(e)
+
+    def items(self):
+        """Pages as they arrive; raises the worker's SupabaseError, if any."""
+        while True:
+            item = self.buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, SupabaseError):
+                raise item
+            yield item
+
+
+def inspect(client, tables: list, args, out=sys.stdout) -> dict:
+    """Write every table in order while they download concurrently. Returns {table: rows or error}."""
+    stop = threading.Event()
+    feeds = [TableFeed(client, table, args, stop) for table in tables]
+    report = {}
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='inspect') as pool:
+        for feed in feeds:
+            pool.submit(feed.run)
+        try:
+            for feed in feeds:
+                target, several = out, len(tables) > 1
+                if args.output_dir:
+                    target = open(Path(args.output_dir) / f'{feed.table}.{args.format}', 'w',
+                                  newline='' if args.format == 'csv' else None, encoding='utf-8')
+                    several = False
+                writer = make_writer(args.format, feed.table, target, several)
+                written, started = 0, False
+                try:
+                    for rows in feed.items():
+                        if not started:
+                            writer.header(feed.total)
+                            started = True
+                        writer.write(rows)
+                        written += len(rows)
+                    if not started:
+                        writer.header(feed.total)
+                    if not args.count_only:
+                        writer.footer(written)
+                    report[feed.table] = feed.total if args.count_only else written
+                except SupabaseError as e:
+                    report[feed.table] = e
+                finally:
+                    if target is not out:
+                        target.close()
+        finally:
+            stop.set()
+    return report
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Page through Supabase tables (constant memory)')
+    parser.add_argument('tables', nargs='*', default=DEFAULT_TABLES)
+    parser.add_argument('--format', choices=['table', 'ndjson', 'csv'], default='table')
+    parser.add_argument('--output-dir', help='Write <table>.<format> files here instead of stdout')
+    parser.add_argument('--count-only', action='store_true', help='Exact row counts, no rows')
+    parser.add_argument('--select', default='*', help='PostgREST select (must include the order columns)')
+    parser.add_argument('--order', nargs='+', default=['created_at', 'id'],
+                        help='Keyset columns, last one unique and non-null')
+    parser.add_argument('--limit', type=int, help='At most this many rows per table')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--workers', type=int, default=4, help='Tables downloaded at once')
+    args = parser.parse_args(argv)
+    if args.format == 'csv' and len(args.tables) > 1 and not args.output_dir:
+        parser.error('--format csv with several tables needs --output-dir')
+    if args.count_only:
+        args.format, args.output_dir = 'table', None
+    if args.output_dir:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    # Diagnostics go to stderr so ndjson/csv on stdout stays clean
+    log = sys.stderr if args.format != 'table' else sys.stdout
+    started = time.perf_counter()
+    with require_client(pool_size=args.workers) as client:
+        print(f"🔍 {client.url} - {', '.join(args.tables)}", file=log)
+        try:
+            report = inspect(client, args.tables, args)
+        except BrokenPipeError:  # e.g. piped into `head`
+            return 0
+
+    print(f"\n{'=' * 80}", file=log)
+    failed = 0
+    for table, result in report.items():
+        if isinstance(result, SupabaseError):
+            failed += 1
+            hint = {404: 'table does not exist', 401: 'unauthorized (RLS policy or key)'}.get(result.status, '')
+            print(f"❌ {table:20} {hint or result}", file=log)
+        else:
+            label = 'rows' if args.count_only else 'rows written'
+            print(f"✅ {table:20} {result if result is not None else '?'} {label}", file=log)
+    print(f"⏱️  {time.perf_counter() - started:.2f}s", file=log)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
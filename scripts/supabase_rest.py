@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Shared Supabase REST (PostgREST) access for the maintenance scripts.
+
+One pooled keep-alive requests.Session per client, so scripts that touch
+several tables (or fetch them concurrently) reuse connections instead of
+paying a TLS handshake per request. Rows are read with keyset pagination
+on (created_at, id): every page is an indexed range scan, and nothing is
+lost to PostgREST's max-rows cap the way a single `select=*` is.
+
+Credentials come from SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY or
+SUPABASE_ANON_KEY, read from the environment or the repository's .env.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    print("❌ Missing dependencies. Install with:")
+    print("   pip install requests")
+    sys.exit(1)
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PAGE_SIZE = 1000        # PostgREST's default max-rows; larger pages get truncated
+TIMEOUT = 30
+
+
+class SupabaseError(Exception):
+    """A PostgREST request that failed, with its HTTP status (0 = no response)."""
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+def _quoted(value) -> str:
+    """A value inside a PostgREST or=(...) filter."""
+    text = str(value)
+    if any(c in text for c in ',.():"\\ '):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+
+def _total(content_range: str):
+    """Row count from a `Content-Range: 0-999/12345` header (None if unknown)."""
+    total = (content_range or '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+class SupabaseRest:
+    """PostgREST client over one pooled keep-alive session."""
+
+    def __init__(self, url: str, key: str, timeout: float = TIMEOUT, pool_size: int = 8):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'apikey': key, 'Authorization': f'Bearer {key}'})
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Client for SUPABASE_URL (environment, then .env), or None when it is not configured."""
+        if load_dotenv is not None:
+            load_dotenv(REPO_ROOT / '.env')
+        url = os.environ.get('SUPABASE_URL')
+        key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
+        return cls(url, key, **kwargs) if url and key else None
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, method: str, path: str, params: dict = None, headers: dict = None, **kwargs):
+        """One request against /rest/v1/<path>; raises SupabaseError unless it succeeds."""
+        try:
+            response = self.session.request(method, f'{self.url}/rest/v1/{path}', params=params,
+                                            headers=headers, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise SupabaseError(f'{path}: {e}') from e
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message') or response.text
+            except ValueError:
+                message = response.text
+            raise SupabaseError(f'{path}: HTTP {response.status_code}: {message[:200]}', response.status_code)
+        return response
+
+    def count(self, table: str, filters: dict = None) -> int:
+        """Exact row count (Prefer: count=exact) without fetching any rows."""
+        response = self.request('GET', table, {'select': 'id', **(filters or {}), 'limit': 0},
+                                {'Prefer': 'count=exact'})
+        return _total(response.headers.get('Content-Range'))
+
+    def openapi(self) -> dict:
+        """The OpenAPI document at the REST root: every exposed table and its columns in one response."""
+        return self.request('GET', '', headers={'Accept': 'application/openapi+json'}).json()
+
+    def rpc(self, function: str, args: dict = None):
+        """Call a database function (POST /rest/v1/rpc/<function>)."""
+        return self.request('POST', f'rpc/{function}', json=args or {}).json()
+
+    def page(self, table: str, cursor: dict = None, limit: int = PAGE_SIZE, select: str = '*',
+             filters: dict = None, order: tuple = ('created_at', 'id'), count: bool = False):
+        """
+        Up to `limit` rows after `cursor` in `order` (ascending, NULLs last,
+        the last column unique and non-null). Returns (rows, total) where
+        total is the exact count of matching rows when `count` is set.
+        """
+        params = {'select': select, **(filters or {}),
+                  'order': ','.join(f'{column}.asc' for column in order), 'limit': limit}
+        if cursor:
+            *leading, unique = order
+            # Rows after the cursor: a later tuple, comparing only the tail
+            # of the key once the leading columns tie (NULLs sort last)
+            branches, equal = [], []
+            for column in leading:
+                value = cursor.get(column)
+                if value is None:
+                    equal.append(f'{column}.is.null')
+                    continue
+                branches.append(f'and({",".join(equal + [f"{column}.gt.{_quoted(value)}"])})'
+                                if equal else f'{column}.gt.{_quoted(value)}')
+                branches.append(f'and({",".join(equal + [f"{column}.is.null"])})'
+                                if equal else f'{column}.is.null')
+                equal.append(f'{column}.eq.{_quoted(value)}')
+            last = f'{unique}.gt.{_quoted(cursor[unique])}'
+            branches.append(f'and({",".join(equal + [last])})' if equal else last)
+            params['or'] = f'({",".join(branches)})'
+        response = self.request('GET', table, params, {'Prefer': 'count=exact'} if count else None)
+        total = _total(response.headers.get('Content-Range')) if count else None
+        return response.json(), total
+
+    def pages(self, table: str, limit: int = PAGE_SIZE, select: str = '*', filters: dict = None,
+              order: tuple = ('created_at', 'id'), on_total=None):
+        """
+        Yield pages of rows until the table is exhausted. The first request
+        also asks for the exact count, passed to `on_total` when given.
+        """
+        cursor = None
+        while True:
+            rows, total = self.page(table, cursor, limit, select, filters, order,
+                                    count=on_total is not None and cursor is None)
+            if total is not None:
+                on_total(total)
+            if not rows:
+                return
+            missing = [column for column in order if column not in rows[-1]]
+            if missing:
+                raise SupabaseError(f'{table}: select must include the order columns ({", ".join(missing)})')
+            cursor = {column: rows[-1][column] for column in order}
+            yield rows
+            if len(rows) < limit:
+                return
+
+    def rows(self, table: str, **kwargs):
+        """Every row of `table`, one page in memory at a time."""
+        for page in self.pages(table, **kwargs):
+            yield from page
+
+
+def require_client(**kwargs) -> SupabaseRest:
+    """SupabaseRest.from_env(), or exit with setup instructions."""
+    client = SupabaseRest.from_env(**kwargs)
+    if client is None:
+        print("❌ Error: Missing Supabase credentials")
+        print("Set SUPABASE_URL and SUPABASE_ANON_KEY (or SUPABASE_SERVICE_ROLE_KEY) in the")
+        print("environment or in .env (reading .env needs: pip install python-dotenv)")
+        sys.exit(1)
+    return client
@@ -1,38 +1,57 @@
 #!/usr/bin/env python3
 """
-Verify that all required database tables exist in Supabase
-"""
+Verify that the Supabase database matches backend/migrations/
 
-import os
-import sys
-from pathlib import Path
+Expected tables, columns and indexes are parsed from the migration files.
+What exists is read in one concurrent burst over one pooled session:
 
-# Add parent directory to path
-sys.path.insert(0, str(Path(__file__).parent.parent))
+- the PostgREST OpenAPI root document: every table's columns at once, so
+  empty tables are checked too (a sample row tells nothing about them)
+- rpc/schema_indexes (add_schema_introspection.sql): the index definitions
+- one `limit=0` probe per table with Prefer: count=exact: whether this key
+  can read it (RLS / grants) and how many rows it holds
 
-try:
-    from supabase import create_client
-    from dotenv import load_dotenv
-except ImportError:
-    print("❌ Missing dependencies. Install with:")
-    print("   pip install supabase python-dotenv")
-    sys.exit(1)
+so the whole check takes about one round trip.
 
-# Load environment variables
-load_dotenv()
+Usage:
+    python scripts/verify_tables.py
+    python scripts/verify_tables.py --columns          # also list every table's columns
+    python scripts/verify_tables.py --migrations backend/migrations/fix_rls_policies.sql ...
+"""
+
+import argparse
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_KEY = os.getenv('SUPABASE_ANON_KEY')
+from supabase_rest import REPO_ROOT, SupabaseError, require_client
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("❌ Error: Missing Supabase credentials in .env")
-    print("Make sure .env has SUPABASE_URL and SUPABASE_ANON_KEY")
-    sys.exit(1)
+MIGRATIONS_DIR = REPO_ROOT / 'backend' / 'migrations'
+# The current schema: the complete migration, then the incremental ones
+MIGRATIONS = [
+    'complete_migration_v3.sql',
+    'add_muzzle_embeddings.sql',
+    'add_muzzle_prints_updated_at.sql',
+    'add_listing_updated_at.sql',
+    'add_export_watermarks.sql',
+    'add_schema_introspection.sql',
+]
+# Feature migrations (backend/migrations/README.md): columns and indexes they
+# add are reported as warnings, so a database without the feature still passes
+OPTIONAL_MIGRATIONS = [
+    'add_seller_id_to_listings.sql',
+    'add_muzzle_embeddings.sql',
+    'add_muzzle_prints_updated_at.sql',
+    'add_listing_updated_at.sql',
+    'add_export_watermarks.sql',
+]
 
-# Required tables
+# Required tables (checked even if no migration creates them)
 REQUIRED_TABLES = [
     'listings',
-    'profiles', 
+    'profiles',
     'favorites',
     'purchases',
     'offers',
@@ -41,78 +60,273 @@ REQUIRED_TABLES = [
     'messages'
 ]
 
-def check_table_exists(supabase, table_name):
-    """Check if a table exists by trying to query it"""
-    try:
-        # Try to select with limit 0 (no data returned, just checks existence)
-        supabase.table(table_name).select('*').limit(0).execute()
-        return True
-    except Exception as e:
-        error_msg = str(e).lower()
-        if 'does not exist' in error_msg or 'relation' in error_msg:
-            return False
-        # Other errors might be permissions, which means table exists
-        return True
-
-def main():
+INDEX_FUNCTION = 'schema_indexes'
+_NOT_COLUMNS = {'constraint', 'primary', 'unique', 'foreign', 'check', 'exclude', 'like'}
+
+
+# =============================================================================
+# EXPECTED SCHEMA (from the migrations)
+# =============================================================================
+
+def _split_top_level(text: str) -> list:
+    """Split a column list on commas outside parentheses and quotes."""
+    parts, depth, quote, current = [], 0, None, ''
+    for char in text:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _create_table_body(sql: str, start: int) -> str:
+    """The text between the parenthesis opened at `start` and its match."""
+    depth = 0
+    for i in range(start, len(sql)):
+        if sql[i] == '(':
+            depth += 1
+        elif sql[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return sql[start + 1:i]
+    return sql[start + 1:]
+
+
+def _name(identifier: str) -> str:
+    """`public.listings` / `"listings"` -> listings"""
+    return identifier.split('.')[-1].strip('"').lower()
+
+
+IDENT = r'((?:"?\w+"?\.)?"?\w+"?)'
+STATEMENTS = re.compile(
+    r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + IDENT + r'\s*\('
+    r'|ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?' + IDENT + r'\s+((?:[^;\'"]|\'[^\']*\')*)'
+    r'|DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?' + IDENT +
+    r'|CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?' + IDENT +
+    r'\s+ON\s+(?:ONLY\s+)?' + IDENT +
+    r'|DROP\s+INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+EXISTS\s+)?' + IDENT,
+    re.IGNORECASE)
+
+
+def expected_schema(paths: list) -> tuple:
+    """
+    Replay the CREATE/ALTER/DROP TABLE and CREATE/DROP INDEX statements of
+    the migrations, in order. Returns ({table: {columns}}, {table: {index names}}).
+    """
+    tables, indexes = {}, {}
+    for path in paths:
+        sql = re.sub(r'--[^\n]*', '', Path(path).read_text(encoding='utf-8'))
+        for match in STATEMENTS.finditer(sql):
+            create, altered, changes, dropped, index, indexed, dropped_index = match.groups()
+            if create:
+                body = _create_table_body(sql, match.end() - 1)
+                words = [re.match(r'"?(\w+)', item).group(1).lower() for item in _split_top_level(body)]
+                columns = {word for word in words if word not in _NOT_COLUMNS}
+                tables[_name(create)] = columns
+            elif altered:
+                table = tables.setdefault(_name(altered), set())
+                for action in _split_top_level(changes):
+                    added = re.match(r'ADD\s+(?:COLUMN\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\S+)', action, re.I)
+                    removed = re.match(r'DROP\s+COLUMN\s+(?:IF\s+EXISTS\s+)?(\S+)', action, re.I)
+                    if added and added.group(1).lower() not in _NOT_COLUMNS:
+                        table.add(_name(added.group(1)))
+                    elif removed:
+                        table.discard(_name(removed.group(1)))
+            elif dropped:
+                tables.pop(_name(dropped), None)
+                indexes.pop(_name(dropped), None)
+            elif index:
+                indexes.setdefault(_name(indexed), set()).add(_name(index))
+            elif dropped_index:
+                for names in indexes.values():
+                    names.discard(_name(dropped_index))
+    return tables, indexes
+
+
+def optional_schema() -> tuple:
+    """
+    What each optional migration adds on its own. Returns
+    ({(table, column): migration}, {(table, index): migration}).
+    """
+    columns, indexes = {}, {}
+    for name in OPTIONAL_MIGRATIONS:
+        tables, table_indexes = expected_schema([MIGRATIONS_DIR / name])
+        columns.update({(table, column): name for table, names in tables.items() for column in names})
+        indexes.update({(table, index): name for table, names in table_indexes.items() for index in names})
+    return columns, indexes
+
+
+# =============================================================================
+# ACTUAL SCHEMA (one concurrent round trip)
+# =============================================================================
+
+def fetch_actual(client, tables: list) -> dict:
+    """OpenAPI document, index listing and per-table probes, all in flight at once."""
+    def attempt(fn, *args):
+        try:
+            return fn(*args)
+        except SupabaseError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(tables) + 2, thread_name_prefix='verify') as pool:
+        openapi = pool.submit(attempt, client.openapi)
+        index_rows = pool.submit(attempt, client.rpc, INDEX_FUNCTION)
+        probes = {table: pool.submit(attempt, client.count, table) for table in tables}
+        return {
+            'openapi': openapi.result(),
+            'indexes': index_rows.result(),
+            'probes': {table: future.result() for table, future in probes.items()},
+        }
+
+
+def compare(expected_tables: dict, expected_indexes: dict, actual: dict, tables: list,
+            optional: tuple = ({}, {})) -> list:
+    """
+    One report per table: status, rows, missing columns / indexes, actual
+    columns. Missing ones listed in `optional` (see optional_schema()) are
+    reported apart, as optional_columns / optional_indexes.
+    """
+    optional_columns, optional_indexes = optional
+    openapi = actual['openapi']
+    definitions = openapi.get('definitions', {}) if isinstance(openapi, dict) else None
+    index_rows = actual['indexes']
+    present_indexes = None
+    if isinstance(index_rows, list):
+        present_indexes = {}
+        for row in index_rows:
+            present_indexes.setdefault(row['table_name'], set()).add(row['index_name'])
+
+    reports = []
+    for table in tables:
+        probe = actual['probes'][table]
+        report = {'table': table, 'rows': None, 'columns': None,
+                  'missing_columns': [], 'missing_indexes': [],
+                  'optional_columns': [], 'optional_indexes': [], 'error': None}
+        if isinstance(probe, SupabaseError):
+            report['status'] = {404: 'missing', 401: 'unauthorized', 403: 'unauthorized'}.get(probe.status, 'error')
+            report['error'] = str(probe)
+        else:
+            report['status'] = 'ok'
+            report['rows'] = probe
+        if definitions is not None and table in definitions:
+            report['columns'] = sorted(definitions[table].get('properties', {}))
+            for column in sorted(expected_tables.get(table, set()) - set(report['columns'])):
+                kind = 'optional_columns' if (table, column) in optional_columns else 'missing_columns'
+                report[kind].append(column)
+        if present_indexes is not None and report['status'] != 'missing':
+            for index in sorted(expected_indexes.get(table, set()) - present_indexes.get(table, set())):
+                kind = 'optional_indexes' if (table, index) in optional_indexes else 'missing_indexes'
+                report[kind].append(index)
+        reports.append(report)
+    return reports
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify the Supabase schema against the migrations')
+    parser.add_argument('--migrations', nargs='+', help=f'SQL files in apply order (default: {", ".join(MIGRATIONS)})')
+    parser.add_argument('--columns', action='store_true', help="List every table's columns")
+    args = parser.parse_args(argv)
+
+    paths = args.migrations or [MIGRATIONS_DIR / name for name in MIGRATIONS]
+    expected_tables, expected_indexes = expected_schema(paths)
+    tables = list(dict.fromkeys(REQUIRED_TABLES + list(expected_tables)))
+
     print("🐄 Moomingle Database Verification")
     print("=" * 50)
-    print(f"📍 Supabase URL: {SUPABASE_URL}")
-    print()
-    
-    try:
-        # Create Supabase client
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("✅ Connected to Supabase")
-        print()
-        
-        # Check each table
-        missing_tables = []
-        existing_tables = []
-        
-        print("📊 Checking tables...")
-        print()
-        
-        for table in REQUIRED_TABLES:
-            exists = check_table_exists(supabase, table)
-            status = "✅" if exists else "❌"
-            print(f"{status} {table}")
-            
-            if exists:
-                existing_tables.append(table)
-            else:
-                missing_tables.append(table)
-        
+    with require_client(pool_size=len(tables) + 2) as client:
+        print(f"📍 Supabase URL: {client.url}")
+        print(f"📄 Expected: {len(tables)} tables, "
+              f"{sum(len(v) for v in expected_indexes.values())} indexes from {len(paths)} migrations")
         print()
-        print("=" * 50)
-        print(f"✅ Existing: {len(existing_tables)}/{len(REQUIRED_TABLES)}")
-        print(f"❌ Missing: {len(missing_tables)}/{len(REQUIRED_TABLES)}")
-        print()
-        
-        if missing_tables:
-            print("🔧 Missing tables:")
-            for table in missing_tables:
-                print(f"   • {table}")
-            print()
-            print("📋 To fix:")
-            print("1. Open Supabase Dashboard SQL Editor")
-            print("2. Run: backend/migrations/create_missing_tables.sql")
-            print()
-            return 1
+        started = time.perf_counter()
+        actual = fetch_actual(client, tables)
+        elapsed = time.perf_counter() - started
+    optional = optional_schema()
+    reports = compare(expected_tables, expected_indexes, actual, tables, optional)
+
+    icons = {'ok': '✅', 'missing': '❌', 'unauthorized': '🔒', 'error': '⚠️ '}
+    differences = 0
+    unreadable = 0
+    not_applied = set()
+    for report in reports:
+        line = f"{icons[report['status']]} {report['table']:20}"
+        if report['status'] == 'ok':
+            line += f" {report['rows']} rows, {len(report['columns']) if report['columns'] is not None else '?'} columns"
+        elif report['status'] == 'missing':
+            line += " NOT FOUND (table doesn't exist)"
+        elif report['status'] == 'unauthorized':
+            line += " UNAUTHORIZED (RLS policy or grants blocking this key)"
         else:
-            print("🎉 All required tables exist!")
-            print("✅ Database is ready to use")
-            print()
-            return 0
-            
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        print()
-        print("Troubleshooting:")
-        print("• Check .env has correct SUPABASE_URL and SUPABASE_ANON_KEY")
-        print("• Verify Supabase project is active")
-        print("• Check network connection")
+            line += f" {report['error'][:100]}"
+        print(line)
+        if report['missing_columns']:
+            print(f"     missing columns: {', '.join(report['missing_columns'])}")
+        if report['missing_indexes']:
+            print(f"     missing indexes: {', '.join(report['missing_indexes'])}")
+        if report['optional_columns'] or report['optional_indexes']:
+            print(f"     ⚠️  optional, not applied: {', '.join(report['optional_columns'] + report['optional_indexes'])}")
+            not_applied.update(optional[0].get((report['table'], c)) for c in report['optional_columns'])
+            not_applied.update(optional[1].get((report['table'], i)) for i in report['optional_indexes'])
+        if args.columns and report['columns']:
+            for column in report['columns']:
+                print(f"   • {column}")
+        if report['status'] in ('unauthorized', 'error'):
+            unreadable += 1
+        elif report['status'] == 'missing' or report['missing_columns'] or report['missing_indexes']:
+            differences += 1
+
+    print()
+    print("=" * 50)
+    unchecked = []
+    if isinstance(actual['openapi'], SupabaseError):
+        unchecked.append('columns')
+        print(f"⚠️  Columns not checked, OpenAPI document unavailable: {actual['openapi']}")
+    if isinstance(actual['indexes'], SupabaseError):
+        unchecked.append('indexes')
+        print(f"⚠️  Indexes not checked: run backend/migrations/add_schema_introspection.sql "
+              f"({actual['indexes']})")
+    if not_applied:
+        print(f"⚠️  Optional migrations not (fully) applied: {', '.join(sorted(not_applied))}")
+        print("   The features that need them are off until they run (see backend/migrations/README.md)")
+    print(f"⏱️  Checked in {elapsed * 1000:.0f} ms")
+    print()
+    if differences:
+        print(f"🔧 {differences} table(s) differ from the migrations.")
+        print("📋 To fix: run the listed migrations in the Supabase Dashboard SQL Editor")
+        print(f"   ({', '.join(str(Path(p).name) for p in paths)})")
+    if unreadable or unchecked:
+        reasons = []
+        if unreadable:
+            reasons.append(f"{unreadable} table(s) could not be read")
+        if unchecked:
+            reasons.append(f"{' and '.join(unchecked)} not checked")
+        print(f"❓ Could not verify the schema: {'; '.join(reasons)}.")
+        denied = [e for e in (actual['openapi'], actual['indexes']) if isinstance(e, SupabaseError)]
+        if unreadable or any(e.status in (401, 403) for e in denied):
+            print("🔑 Check SUPABASE_URL / SUPABASE_KEY: the key must be able to read every table")
+    if differences or unreadable or unchecked:
         return 1
+    if not_applied:
+        print("🎉 All required tables, columns and indexes match the migrations!")
+    else:
+        print("🎉 All tables, columns and indexes match the migrations!")
+    return 0
+
 
 if __name__ == '__main__':
     sys.exit(main())